@@ -0,0 +1,141 @@
+# Compresses the tweet files once the listener has finished writing to them. This used to be done
+# by starting a new process for every file, which were never cleaned up and could all end up running
+# at the same time (competing with the listener for CPU). Instead, a fixed number of worker
+# processes take files from a queue one at a time. The queue is also saved to a file so that if the
+# listener is restarted then any files that hadn't been compressed yet still get compressed.
+
+import gzip
+import multiprocessing as mp
+import os
+import threading
+import time
+import traceback
+
+DEFAULT_WORKERS = 1 # Number of files to compress at the same time
+DEFAULT_LEVEL = 9 # gzip compression level (1 is fastest, 9 is smallest)
+DEFAULT_NICE = 10 # Run the compression at a lower priority than the listener
+QUEUE_FILENAME = ".compress_queue" # Name of the file that the queue is saved to (in the data dir)
+
+
+def compress_file(filename, level=DEFAULT_LEVEL):
+    """Compress a file using gzip, deleting the original. The compressed data is written to a
+    temporary file first and then renamed, so a half-compressed file is never left behind if the
+    program is killed.
+    Returns a tuple of (filename, compressed filename, original size, compressed size, seconds
+    taken, error). 'error' is None unless something went wrong."""
+
+    start = time.time()
+    new_filename = filename+".gz"
+    tmp_filename = new_filename+".tmp"
+    try:
+        original_size = os.path.getsize(filename)
+        with open(filename, 'rb') as oldfile:
+            zipfile = gzip.GzipFile(tmp_filename, 'wb', level)
+            try:
+                while True:
+                    block = oldfile.read(1024 * 1024)
+                    if not block:
+                        break
+                    zipfile.write(block)
+            finally:
+                zipfile.close()
+        os.rename(tmp_filename, new_filename)
+        os.remove(filename)
+        return (filename, new_filename, original_size, os.path.getsize(new_filename),
+                time.time() - start, None)
+    except Exception:
+        # (Can't pass exceptions back from the pool in python 2, so return the error instead)
+        return (filename, new_filename, 0, 0, time.time() - start, traceback.format_exc())
+
+
+def _lower_priority(nice):
+    """Run by each of the worker processes when they start so that they don't slow the listener."""
+    if nice:
+        os.nice(nice)
+
+
+class CompressionPool(object):
+    """Compresses files in the background using a fixed number of worker processes.
+    If 'queue_file' is given then files that are waiting to be compressed are remembered in that
+    file, and any that are left over from last time are compressed when the pool starts."""
+
+    def __init__(self, workers=DEFAULT_WORKERS, queue_file=None, level=DEFAULT_LEVEL,
+            nice=DEFAULT_NICE):
+        self.workers = workers
+        self.queue_file = queue_file
+        self.level = level
+
+        self.completed = 0 # Number of files that have been compressed
+        self.failed = 0 # Number of files that couldn't be compressed
+        self._pending = set() # Files that have been submitted but not finished
+        self._lock = threading.Lock() # (Jobs finish in a different thread to the one they start in)
+
+        self._pool = mp.Pool(workers, _lower_priority, (nice,))
+
+        # Restart any jobs that didn't finish last time
+        if self.queue_file is not None:
+            for filename in self._read_queue():
+                print "Compressing file left over from last time: {f}".format(f=filename)
+                self.submit(filename)
+
+    def submit(self, filename):
+        """Add a file to the queue to be compressed."""
+        with self._lock:
+            if filename in self._pending:
+                return
+            self._pending.add(filename)
+            self._save_queue()
+        self._pool.apply_async(compress_file, (filename, self.level), callback=self._finished)
+
+    def backlog(self):
+        """The number of files that are waiting to be compressed (or are being compressed)."""
+        with self._lock:
+            return len(self._pending)
+
+    def close(self):
+        """Wait for all of the files in the queue to be compressed and stop the workers."""
+        print "Waiting for {n} file(s) to finish compressing".format(n=self.backlog())
+        self._pool.close()
+        self._pool.join()
+
+    def _finished(self, result):
+        """Called (in a background thread) when a worker has finished with a file."""
+        filename, new_filename, original_size, compressed_size, seconds, error = result
+        with self._lock:
+            self._pending.discard(filename)
+            if error is None:
+                self.completed += 1
+            else:
+                self.failed += 1
+            self._save_queue()
+
+        if error is None:
+            ratio = float(original_size) / compressed_size if compressed_size else 0
+            print "\tFinished compressing file {f}, created file {f2} ({s:.1f}s, {o} -> {c} bytes, ratio {r:.1f})".format(\
+                    f=filename, f2=new_filename, s=seconds, o=original_size, c=compressed_size, r=ratio)
+        else:
+            print "****\nCould not compress file {f}. The trackback is:\n{e}****".format(\
+                    f=filename, e=error)
+
+    def _read_queue(self):
+        """Read the files that still need compressing from the queue file."""
+        if not os.path.isfile(self.queue_file):
+            return []
+        filenames = []
+        with open(self.queue_file, 'r') as f:
+            for line in f:
+                filename = line.rstrip("\n")
+                if filename and os.path.isfile(filename) and filename not in filenames:
+                    filenames.append(filename)
+        return filenames
+
+    def _save_queue(self):
+        """Write the files that are waiting to be compressed to the queue file. (The lock must be
+        held when this is called)."""
+        if self.queue_file is None:
+            return
+        tmp_filename = self.queue_file+".tmp"
+        with open(tmp_filename, 'w') as f:
+            for filename in sorted(self._pending):
+                f.write(filename+"\n")
+        os.rename(tmp_filename, self.queue_file) # (Replaces the old queue in one go)
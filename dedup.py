@@ -0,0 +1,96 @@
+# Removes duplicate tweets as they arrive. When the connection to twitter drops and is re-made (or
+# the listener is restarted) twitter often sends some of the same tweets again, so the same tweet
+# ends up in the files more than once. To spot these we need to remember the ids of recent tweets,
+# but without using more and more memory the longer the listener runs. A Bloom filter stores ids in
+# a fixed amount of memory. It can occasionally think that it has seen a tweet when it hasn't (the
+# 'error rate') but never the other way round.
+#
+# See https://en.wikipedia.org/wiki/Bloom_filter
+
+import math
+
+DEFAULT_CAPACITY = 500000 # Number of ids to remember in each generation of the filter
+DEFAULT_ERROR_RATE = 1e-6 # Chance of wrongly thinking that a new tweet is a duplicate
+
+_MASK = (1 << 64) - 1
+
+
+def _mix(x):
+    """Scramble the bits of a 64-bit integer (the 'splitmix64' finaliser). Tweet ids are not random
+    (they contain a timestamp) so they need mixing before they can be used as hashes."""
+    x = (x ^ (x >> 30)) * 0xbf58476d1ce4e5b9 & _MASK
+    x = (x ^ (x >> 27)) * 0x94d049bb133111eb & _MASK
+    return x ^ (x >> 31)
+
+
+class BloomFilter(object):
+    """A fixed-size set of integers that can say whether an integer has (probably) been added. Big
+    enough to hold 'capacity' integers with a chance of 'error_rate' of a false positive."""
+
+    def __init__(self, capacity, error_rate=DEFAULT_ERROR_RATE):
+        self.capacity = capacity
+        # Work out the number of bits and number of hashes needed for the error rate
+        self.num_bits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.num_hashes = max(1, int(round(self.num_bits / float(capacity) * math.log(2))))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0 # Number of integers that have been added
+
+    def _positions(self, value):
+        # Make all the hashes from two (double hashing)
+        h1 = _mix(value)
+        h2 = _mix(h1) | 1
+        return [(h1 + i * h2) % self.num_bits for i in xrange(self.num_hashes)]
+
+    def __contains__(self, value):
+        bits = self.bits
+        for pos in self._positions(value):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def add(self, value):
+        """Add an integer. Returns True if it was (probably) already there."""
+        bits = self.bits
+        present = True
+        for pos in self._positions(value):
+            byte = pos >> 3
+            mask = 1 << (pos & 7)
+            if not bits[byte] & mask:
+                present = False
+                bits[byte] |= mask
+        if not present:
+            self.count += 1
+        return present
+
+
+class RollingBloomFilter(object):
+    """Remembers the ids of recent tweets in a fixed amount of memory. There are two Bloom filters,
+    each holding up to 'capacity' ids. When the current one is full the older one is thrown away and
+    a new one is started, so the most recent 'capacity' to 2*'capacity' ids are always remembered.
+    (At most twice the memory of one Bloom filter is ever used)."""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, error_rate=DEFAULT_ERROR_RATE):
+        self.capacity = capacity
+        # (Each id is checked against both filters, so halve the error rate of each one)
+        self.error_rate = error_rate / 2.0
+        self.current = BloomFilter(capacity, self.error_rate)
+        self.previous = None
+        self.duplicates = 0 # Number of duplicate ids that have been seen
+
+    def seen(self, tweet_id):
+        """Remember a tweet id, returning True if it has been seen recently (i.e. is a duplicate)."""
+        if self.previous is not None and tweet_id in self.previous:
+            self.duplicates += 1
+            self.current.add(tweet_id) # (Keep remembering it after the old filter is thrown away)
+            return True
+        if self.current.add(tweet_id):
+            self.duplicates += 1
+            return True
+        if self.current.count >= self.capacity:
+            self.previous = self.current
+            self.current = BloomFilter(self.capacity, self.error_rate)
+        return False
+
+    def memory(self):
+        """The number of bytes used to store the filters."""
+        return len(self.current.bits) + (len(self.previous.bits) if self.previous is not None else 0)
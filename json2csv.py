@@ -5,6 +5,7 @@
 # Tweet_ID, User_ID, Screen_Name, Lat, Lon, Loc_Txt, Time, Text
 #
 # Note: for convenience some time columns are also added: Year, Month, Day, Hour, Minute, Seconds
+# (and optionally Epoch, the number of seconds since 1970 UTC)
 
 import argparse # For parsing command line arguments
 from argparse import RawTextHelpFormatter # For making nicely formatted help text
@@ -15,12 +16,14 @@ import sys
 import multiprocessing as mp # For executing in multiple threads
 import traceback
 import io
+import zlib # For reading gzip files that are still being written
 import pprint # For pretty-printing errors
 pp = pprint.PrettyPrinter(depth=1)
 
-import datetime as dt
-# Can't use dt.strptime() to convert time string to date because %z isn't valid! Instead use this:
-import email.utils 
+# Can't use strptime() to convert time string to date because %z isn't valid! Instead use tweepy's
+# parser for twitter's time format (which is quicker anyway, and remembers recent times).
+from tweepy.utils import parse_twitter_time
+from ledger import DeleteLedger # For removing tweets that have been deleted
 # NOTE ABOUT TIME ZONES: I'm using local time, not UTC. So there will be two kinks in the data when
 # UK changes time zone. Advantage is that work patterns are constant (e.g. 9am-5pm) so don't want to
 # change these when the time zone changes.
@@ -78,6 +81,52 @@ fields = [
 error_fields = dict()
 error_count = 0
 
+# The ids of tweets that have been deleted (a ledger.DeleteLedger), if the user gives any ledgers
+deleted = None
+
+
+class GzipLineReader(object):
+    """Reads the lines of a gzip file, like gzip.GzipFile, but doesn't mind if the file hasn't been
+    finished. Files that streaming.py is still writing with -z have everything flushed so far on
+    disk, but not the gzip trailer (a checksum and the length) that is added when they are closed,
+    and GzipFile gives up with 'CRC check failed' (losing the last lines it read) when it gets to
+    the end of one of those. Here the file is decompressed as a stream instead, and whatever has
+    been decompressed by the end of the file is used. Files that have been appended to are several
+    gzip 'members' one after the other, these are read one after another."""
+
+    CHUNK_SIZE = 1024 * 1024 # Read (compressed) data from the file in chunks this big
+
+    def __init__(self, name):
+        self.name = name
+        self._file = open(name, 'rb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self._file.close()
+
+    def __iter__(self):
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS) # (16+ means expect a gzip header)
+        partial = "" # The start of a line that hasn't been finished yet
+        while True:
+            data = self._file.read(self.CHUNK_SIZE)
+            if not data:
+                break
+            while data:
+                text = partial + decompressor.decompress(data)
+                # Anything after the end of one member is the start of the next one
+                data = decompressor.unused_data
+                if data:
+                    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                lines = text.split("\n")
+                partial = lines.pop()
+                for line in lines:
+                    yield line + "\n"
+        partial += decompressor.flush()
+        if partial:
+            yield partial
+
 
 def read_json((fname, of)):
     """Reads an input json file, specified by 'fname'. Writes output to an output file ('of') that is
@@ -103,7 +152,7 @@ def read_json((fname, of)):
         if isinstance(fname, io.BytesIO):
             return fname # If it's already a stream just return it, no need to open
         elif fname[-3:] == ".gz":
-            return gzip.GzipFile(fname, mode="rb")
+            return GzipLineReader(fname) # (Rather than GzipFile, the file might be unfinished)
         else:
             return open(fname, "r")
 
@@ -111,6 +160,9 @@ def read_json((fname, of)):
     # 'f'. (gzip and normal files can be treated the same)
     #with gzip.GzipFile(fname, mode="rb") if fname[-3:] == ".gz" else open(fname, "r") as f:
 
+    last_time_str = None # The time of the last tweet, and its time columns
+    time_cols = ""
+
     with open_f() as f:
 
         for line in f:
@@ -131,6 +183,10 @@ def read_json((fname, of)):
             if tweet.keys() == ["delete"]:
                 #print "Have received a 'delete' message, ignoring"
                 continue
+
+            # See if the tweet has been deleted since it was collected
+            if deleted is not None and tweet.get('id') in deleted:
+                continue
             
             # We might need to remember the coordinates of this tweet
             xcor = None
@@ -179,24 +235,23 @@ def read_json((fname, of)):
                     csvline.append(", ")
                 
 
-            if not args.no_time_columns:
-
-                # Have added all the required fields, now add time columns for convenience.This is
-                # much more complicated than it should be because the %z symbol in strftime()
-                # doesn't work on my mac, might work on unix. Instead use email.util library (!)
+            if not args.no_time_columns or args.epoch:
 
+                # Have added all the required fields, now add time columns for convenience. (Lots
+                # of tweets arrive in the same second, so the columns for the last time are
+                # remembered)
                 time_str = tweet['created_at']
-                # Make a tuple from the time (e.g. (year,month,day,hour,minute,second)
-                time_tpl = email.utils.parsedate_tz(time_str) 
-                # Now use those indivdual components to make a datetime object
-                t = dt.datetime(*[time_tpl[i] for i in range(7)]) 
-
-                #of.write("{Yr}, {Mo}, {D}, {H}, {M}, {S}".format( 
-                #    Yr=t.year, Mo=t.month, D=t.day, M=t.minute, H=t.hour, S=t.second )
-                #)
-                csvline.append("{Yr}, {Mo}, {D}, {H}, {M}, {S}".format( 
-                    Yr=t.year, Mo=t.month, D=t.day, M=t.minute, H=t.hour, S=t.second )
-                )
+                if time_str != last_time_str:
+                    t, epoch = parse_twitter_time(time_str)
+                    time_cols = []
+                    if not args.no_time_columns:
+                        time_cols.append("{Yr}, {Mo}, {D}, {H}, {M}, {S}".format(
+                            Yr=t.year, Mo=t.month, D=t.day, M=t.minute, H=t.hour, S=t.second ))
+                    if args.epoch:
+                        time_cols.append(str(epoch))
+                    time_cols = ", ".join(time_cols)
+                    last_time_str = time_str
+                csvline.append(time_cols)
 
             
             # Finished converting this tweet into a csv string.
@@ -258,6 +313,8 @@ parser.add_argument('-nd', '--no_defaults', action="store_true", default=False,
         help="Don't add any of the default fields to the CSV output")
 parser.add_argument('-ntc', '--no_time_columns', action="store_true", default=False,
         help="Don't add the extra time columns to the CSV output")
+parser.add_argument('-ep', '--epoch', action="store_true", default=False,
+        help="Add a column with the time as the number of seconds since 1970 (UTC)")
 
 # Whether to run multi-threaded
 parser.add_argument('-nmt', '--no_multi_thread', action="store_true", default=False,
@@ -269,6 +326,10 @@ parser.add_argument('-bb', '--bounding_box', nargs=4, dest='bounding_box', type=
             'only return tweets that have coordinates within this box.\n'+\
             'Note: tweets without GPS coordinates will be ignored.')
 
+# Can remove tweets that have been deleted, using the ledgers saved by streaming.py
+parser.add_argument('-d', '--deletes', nargs="+", metavar="LEDGER", default=None,
+        help="Ledger file(s) of deleted tweets (e.g. data/*.deletes) written by streaming.py.\n"+\
+                "Tweets in these files will not be written to the CSV.")
 
 # Parse command-line arguments
 args = parser.parse_args()
@@ -301,6 +362,13 @@ if __name__=="__main__":
     if args.bounding_box != None:
         check_bb(args.bounding_box)
 
+    # Read the ledgers of deleted tweets. (This is done before starting the worker processes
+    # below so they all get a copy).
+    if args.deletes:
+        deleted = DeleteLedger.load(args.deletes)
+        print "Read {n} deleted tweets from {f} ledger file(s), these will be left out".format(\
+                n=len(deleted), f=len(args.deletes))
+
     print "Will write output to: ",args.outfile
 
     print "Will extract data in the following json fields: ",fields
@@ -322,6 +390,8 @@ if __name__=="__main__":
         # Also add the extra time columns (added for convenience)
         if not args.no_time_columns:
             of.write("Year, Month, Day, Hour, Minute, Second")
+        if args.epoch:
+            of.write(", Epoch" if not args.no_time_columns else "Epoch")
         of.write("\n")
 
         if args.no_multi_thread: # Run in a single thread
@@ -0,0 +1,194 @@
+# Stores the 'delete' messages that twitter sends when someone deletes a tweet. We need these to
+# remove deleted tweets from the data, but there are a lot of them so rather than writing them out as
+# json they are stored in a compact binary 'ledger': one for each tweet file (e.g. t1452591943781.json
+# has deletes in t1452591943781.deletes).
+#
+# While the listener is running deletes are appended to a log file (t<ts>.deletes.log) as fixed-size
+# records. When the tweet file is rotated the log is sorted by status id and written as the ledger.
+# A ledger file is:
+#
+#   MAGIC (8 bytes), number of deletes N (8 bytes),
+#   N status ids, N user ids, N received times (milliseconds since the epoch)
+#
+# with every number a little-endian signed 64-bit integer. The status ids are sorted so that
+# DeleteLedger can check whether a tweet has been deleted with a binary search.
+
+import array
+import bisect
+import json
+import os
+import struct
+import sys
+import time
+
+from writer import BufferedTweetWriter
+
+MAGIC = "TWDELv1\n"
+LEDGER_EXT = ".deletes" # Extension for ledger files
+LOG_EXT = ".deletes.log" # Extension for unsorted logs of deletes that are still being written
+_RECORD = struct.Struct("<qqq") # (status id, user id, received time) in the log files
+_HEADER = struct.Struct("<8sq")
+
+# array.array needs a type that holds 64-bit integers. 'l' does on 64-bit linux and mac; fall back to
+# plain lists (slower and bigger, but still work with bisect) where it doesn't.
+_ARRAY_TYPE = 'l' if array.array('l').itemsize == 8 else None
+
+
+def _int_array(values=()):
+    if _ARRAY_TYPE is None:
+        return list(values)
+    return array.array(_ARRAY_TYPE, values)
+
+
+def _read_ints(f, n):
+    """Read 'n' little-endian 64-bit integers from a file."""
+    data = f.read(8 * n)
+    if len(data) != 8 * n:
+        raise IOError("Ledger file {f} is truncated".format(f=f.name))
+    if _ARRAY_TYPE is None:
+        return list(struct.unpack("<%dq" % n, data))
+    values = array.array(_ARRAY_TYPE)
+    values.fromstring(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _ints_to_string(values):
+    if _ARRAY_TYPE is None:
+        return struct.pack("<%dq" % len(values), *values)
+    values = array.array(_ARRAY_TYPE, values)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tostring()
+
+
+def parse_delete(raw_data):
+    """Get (status id, user id, received time in milliseconds) from a raw delete message. The time is
+    the 'timestamp_ms' that twitter includes, or now if there isn't one."""
+    data = json.loads(raw_data)
+    status = data['delete']['status']
+    received = data['delete'].get('timestamp_ms')
+    if received is None:
+        received = time.time() * 1000
+    return (int(status['id']), int(status['user_id']), int(received))
+
+
+def write_ledger(filename, records):
+    """Write a list of (status id, user id, received time) tuples to a ledger file, sorted by status
+    id. The file is written to a temporary name and renamed so it is never left half-written."""
+    records = sorted(records)
+    tmp_filename = filename+".tmp"
+    with open(tmp_filename, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, len(records)))
+        for column in range(3):
+            f.write(_ints_to_string([r[column] for r in records]))
+    os.rename(tmp_filename, filename)
+
+
+def read_log(filename):
+    """Read the (status id, user id, received time) tuples from an unsorted log file. An incomplete
+    record at the end (if the listener died while writing it) is ignored."""
+    records = []
+    with open(filename, 'rb') as f:
+        data = f.read()
+    for start in xrange(0, len(data) - _RECORD.size + 1, _RECORD.size):
+        records.append(_RECORD.unpack_from(data, start))
+    return records
+
+
+def compact_log(log_filename):
+    """Sort an unsorted log file into a ledger file (with the same name minus '.log') and delete the
+    log. Returns the name of the ledger file."""
+    ledger_filename = log_filename[:-len(".log")]
+    records = read_log(log_filename)
+    if os.path.isfile(ledger_filename): # (Shouldn't happen, but don't lose anything if it does)
+        records.extend(DeleteLedger.load([ledger_filename]).records())
+    write_ledger(ledger_filename, records)
+    os.remove(log_filename)
+    return ledger_filename
+
+
+class DeleteLedgerWriter(object):
+    """Used by the listener to record deletes. open() starts a new log (when the tweet file is
+    rotated), sorting the previous log into a ledger. Writes are buffered the same way as tweets
+    (see writer.py)."""
+
+    def __init__(self, **kwargs):
+        self.log_filename = None
+        self.count = 0 # Number of deletes in the current log
+        self._writer = BufferedTweetWriter(**kwargs)
+
+    def open(self, basename):
+        """Start logging deletes for the tweet file 'basename' (without its .json extension)."""
+        old_log = self.log_filename
+        self.log_filename = basename+LOG_EXT
+        self.count = 0
+        self._writer.open(self.log_filename) # (Flushes and closes the old log)
+        if old_log is not None:
+            compact_log(old_log)
+
+    def add(self, status_id, user_id, received):
+        self._writer.write(_RECORD.pack(status_id, user_id, received))
+        self.count += 1
+
+    def close(self):
+        """Finish the current log, sorting it into a ledger."""
+        self._writer.close()
+        if self.log_filename is not None:
+            compact_log(self.log_filename)
+            self.log_filename = None
+
+
+class DeleteLedger(object):
+    """The deletes from one or more ledger files, for checking whether tweets have been deleted.
+    E.g.:
+
+        deleted = DeleteLedger.load(glob.glob("data/*.deletes"))
+        if tweet_id in deleted:
+            ...
+    """
+
+    def __init__(self, status_ids, user_ids, received):
+        # (Three sorted columns rather than a list of tuples, to save memory)
+        self.status_ids = status_ids
+        self.user_ids = user_ids
+        self.received = received
+
+    @classmethod
+    def load(cls, filenames):
+        """Read ledger files (and any unsorted logs, ending in .deletes.log) into one ledger."""
+        columns = [_int_array(), _int_array(), _int_array()]
+        for filename in filenames:
+            if filename.endswith(LOG_EXT):
+                for record in read_log(filename):
+                    for i in range(3):
+                        columns[i].append(record[i])
+                continue
+            with open(filename, 'rb') as f:
+                magic, n = _HEADER.unpack(f.read(_HEADER.size))
+                if magic != MAGIC:
+                    raise IOError("{f} doesn't look like a ledger of deletes".format(f=filename))
+                for i in range(3):
+                    columns[i].extend(_read_ints(f, n))
+        # Sort all the columns by status id
+        order = sorted(xrange(len(columns[0])), key=columns[0].__getitem__)
+        return cls(*[_int_array(column[i] for i in order) for column in columns])
+
+    def __len__(self):
+        return len(self.status_ids)
+
+    def __contains__(self, status_id):
+        i = bisect.bisect_left(self.status_ids, status_id)
+        return i < len(self.status_ids) and self.status_ids[i] == status_id
+
+    def get(self, status_id):
+        """Get (user id, received time) for a deleted status, or None if it hasn't been deleted."""
+        i = bisect.bisect_left(self.status_ids, status_id)
+        if i < len(self.status_ids) and self.status_ids[i] == status_id:
+            return (self.user_ids[i], self.received[i])
+        return None
+
+    def records(self):
+        """All of the deletes as (status id, user id, received time) tuples."""
+        return zip(self.status_ids, self.user_ids, self.received)
@@ -0,0 +1,99 @@
+# Functions for working out what sort of message has been received from the twitter stream without
+# having to decode the whole thing. Decoding a tweet with json.loads takes most of the CPU time of
+# the listener, but all we really need to know is whether the message is a tweet (and its id) or
+# one of the other types of message that twitter sends (deletes, limit notices, etc).
+#
+# See https://dev.twitter.com/streaming/overview/messages-types for the message types.
+
+import json
+
+# The different types of message
+TWEET = "tweet"
+DELETE = "delete"
+LIMIT = "limit"
+DISCONNECT = "disconnect"
+WARNING = "warning"
+UNKNOWN = "unknown" # Valid json but not something we recognise
+INVALID = "invalid" # Not valid json
+
+# Messages that aren't tweets have a single key at the top level that says what they are, e.g.
+# {"delete":{"status":{...}}} or {"limit":{"track":1234}}
+NOTICE_TYPES = {
+        "delete": DELETE,
+        "limit": LIMIT,
+        "disconnect": DISCONNECT,
+        "warning": WARNING,
+        }
+
+# Only look this far into a message for the tweet id. Twitter puts the id straight after the
+# 'created_at' field so it is normally within the first 60 or so characters.
+SCAN_BYTES = 256
+
+
+def classify_message(raw_data):
+    """Work out the type of a message from the stream by looking at the first few bytes of it.
+    Returns a tuple of (type, id) where type is one of the constants above and id is the id of the
+    tweet (an int), or None if the message isn't a tweet.
+    If the message can't be classified by looking at the first bytes (e.g. it is formatted in a way
+    that twitter doesn't normally use) then it is decoded fully with classify_json()."""
+
+    start = 0
+    end = len(raw_data)
+    # Skip any whitespace at the start (and end) of the message
+    while start < end and raw_data[start] in " \t\r\n":
+        start += 1
+    while end > start and raw_data[end-1] in " \t\r\n":
+        end -= 1
+
+    # Must be a json object. Check the end as well so that a truncated message isn't mistaken for
+    # a complete tweet.
+    if start == end or raw_data[start] != "{" or raw_data[end-1] != "}":
+        return classify_json(raw_data)
+
+    # Find the first key. For notices this tells us what the message is.
+    if raw_data[start+1:start+2] != '"':
+        return classify_json(raw_data)
+    key_end = raw_data.find('"', start+2)
+    if key_end == -1:
+        return classify_json(raw_data)
+    key = raw_data[start+2:key_end]
+    if key in NOTICE_TYPES:
+        return (NOTICE_TYPES[key], None)
+
+    # Otherwise look for the tweet id. Only accept it if it is found before any nested object,
+    # otherwise it might be the id of the user or of a retweeted status.
+    scan_end = min(end, start + SCAN_BYTES)
+    id_pos = raw_data.find('"id":', start, scan_end)
+    if id_pos == -1 or raw_data.find("{", start+1, id_pos) != -1:
+        return classify_json(raw_data)
+    num_start = id_pos + 5
+    num_end = num_start
+    while num_end < scan_end and raw_data[num_end] in "0123456789":
+        num_end += 1
+    if num_end == num_start or raw_data[num_end] not in ",}":
+        return classify_json(raw_data)
+    return (TWEET, int(raw_data[num_start:num_end]))
+
+
+def classify_json(raw_data):
+    """Work out the type of a message by decoding all of it. This is slow, so is only used when
+    classify_message() can't work out what the message is. Returns a tuple of (type, id) like
+    classify_message()."""
+    try:
+        data = json.loads(raw_data)
+    except ValueError:
+        return (INVALID, None)
+    msg_type = message_type(data)
+    return (msg_type, data['id'] if msg_type == TWEET else None)
+
+
+def message_type(data):
+    """Work out the type of a message that has already been decoded (i.e. is a dictionary)."""
+    if not isinstance(data, dict):
+        return UNKNOWN
+    if 'id' in data:
+        return TWEET
+    for key in data:
+        if key in NOTICE_TYPES:
+            return NOTICE_TYPES[key]
+    return UNKNOWN
@@ -0,0 +1,345 @@
+# Keeps track of what the listener is doing (number of tweets received, how long writing takes, how
+# full the queues are, etc) and makes it available on a local web page in the format that Prometheus
+# (https://prometheus.io/) understands. Useful for keeping an eye on several listeners at once
+# without having to watch their output. E.g. after starting the listener with '--metrics_port 9100':
+#
+#   curl http://localhost:9100/metrics
+#
+# See https://prometheus.io/docs/instrumenting/exposition_formats/ for the format.
+
+import BaseHTTPServer
+import SocketServer
+import threading
+import time
+
+# Default histogram buckets (seconds), from 10 microseconds to 10 seconds
+DEFAULT_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10)
+# Buckets for the stages of connecting, which can take from milliseconds to minutes (backing off)
+CONNECTION_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = zip(names, values)
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join('{k}="{v}"'.format(k=k, v=str(v).replace('\\', '\\\\').replace('"', '\\"'))
+            for k, v in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(object):
+    """Base class for metrics. A metric can have labels (e.g. the type of message), in which case
+    labels() gives the part of the metric for particular label values."""
+
+    kind = None # The prometheus type
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """Get the metric for the given label values (in the same order as 'labelnames')."""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self):
+        """The lines of text for this metric."""
+        lines = ["# HELP {n} {h}".format(n=self.name, h=self.help_text),
+                "# TYPE {n} {t}".format(n=self.name, t=self.kind)]
+        for values, child in sorted(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, values))
+        return lines
+
+
+class _Value(object):
+    """A single number that can be added to or set."""
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+    def render(self, name, labelnames, values):
+        return ["{n}{l} {v}".format(n=name, l=_format_labels(labelnames, values),
+            v=_format_value(self.value))]
+
+
+class _FunctionValue(object):
+    """A value that is worked out (by calling a function) whenever the metrics are read."""
+
+    def __init__(self, function):
+        self.function = function
+
+    def render(self, name, labelnames, values):
+        return ["{n}{l} {v}".format(n=name, l=_format_labels(labelnames, values),
+            v=_format_value(self.function()))]
+
+
+class Counter(Metric):
+    """A number that only goes up (e.g. the number of tweets received)."""
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        """Add to the counter (only if it has no labels)."""
+        self.labels().inc(amount)
+
+
+class Gauge(Metric):
+    """A number that can go up and down (e.g. the number of messages in a queue)."""
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def set_function(self, function, *values):
+        """Work out the value for the given labels by calling 'function' whenever it is needed."""
+        with self._lock:
+            self._children[values] = _FunctionValue(function)
+
+
+class _HistogramValue(object):
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.total += value
+            self.count += 1
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+
+    def render(self, name, labelnames, values):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append("{n}_bucket{l} {c}".format(n=name, c=cumulative,
+                l=_format_labels(labelnames, values, ("le", _format_value(float(bound))))))
+        lines.append("{n}_bucket{l} {c}".format(n=name, c=self.count,
+            l=_format_labels(labelnames, values, ("le", "+Inf"))))
+        lines.append("{n}_sum{l} {v}".format(n=name, l=_format_labels(labelnames, values),
+            v=_format_value(self.total)))
+        lines.append("{n}_count{l} {c}".format(n=name, l=_format_labels(labelnames, values),
+            c=self.count))
+        return lines
+
+
+class Histogram(Metric):
+    """Counts how many observations (e.g. times taken to write a tweet) fall into each bucket."""
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+
+class Registry(object):
+    """A collection of metrics. get() returns the existing metric with a name, or creates it, so
+    several listeners can share one registry (and one web page)."""
+
+    def __init__(self):
+        self._metrics = [] # (In the order they were created, so the page is always the same)
+        self._by_name = {}
+        self._lock = threading.Lock()
+
+    def get(self, cls, name, help_text, labelnames=(), **kwargs):
+        with self._lock:
+            metric = self._by_name.get(name)
+            if metric is None:
+                metric = cls(name, help_text, labelnames, **kwargs)
+                self._metrics.append(metric)
+                self._by_name[name] = metric
+            return metric
+
+    def render(self):
+        """All of the metrics as text in the prometheus format."""
+        lines = []
+        for metric in list(self._metrics):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class CaptureMetrics(object):
+    """The metrics for one capture (i.e. one stream and the listener writing it to disk). All of the
+    metrics have a 'capture' label so that several captures can share a registry."""
+
+    def __init__(self, registry=None, capture="default"):
+        self.registry = registry if registry is not None else Registry()
+        self.capture = capture
+        self.last_message = None # When the last message arrived
+
+        r = self.registry
+        self._messages = r.get(Counter, "twitter_messages_total",
+                "Messages received from the stream, by type", ("capture", "type"))
+        self._bytes = r.get(Counter, "twitter_bytes_total",
+                "Bytes received from the stream", ("capture",)).labels(capture)
+        self._tweets = r.get(Counter, "twitter_tweets_written_total",
+                "Tweets written to disk", ("capture",)).labels(capture)
+        self._duplicates = r.get(Counter, "twitter_duplicates_total",
+                "Duplicate tweets that were not written", ("capture",)).labels(capture)
+        self._connects = r.get(Counter, "twitter_connects_total",
+                "Successful connections to the stream (reconnects are this minus one)",
+                ("capture",)).labels(capture)
+        self._errors = r.get(Counter, "twitter_errors_total",
+                "Errors (HTTP status codes and timeouts) from the stream", ("capture", "error"))
+        self._stages = r.get(Histogram, "twitter_stage_seconds",
+                "Time taken by each stage of handling a message", ("capture", "stage"))
+        self._connecting = r.get(Histogram, "twitter_connection_seconds",
+                "Time taken by each stage of (re)connecting to the stream", ("capture", "stage"),
+                buckets=CONNECTION_BUCKETS)
+        self._streams = [] # The tweepy Streams whose bytes are counted (see watch_stream())
+        self._old_bytes = [0, 0] # (Received and decompressed by streams that have been unwatched)
+        self._streams_lock = threading.Lock()
+        self.gauge("twitter_stream_bytes",
+                "Bytes of message data received from twitter as sent (i.e. compressed, if the "+
+                "stream is compressed)", lambda: self.stream_bytes()[0])
+        self.gauge("twitter_stream_decompressed_bytes",
+                "Bytes of message data received from twitter after decompression",
+                lambda: self.stream_bytes()[1])
+        self.gauge("twitter_seconds_since_last_message",
+                "Seconds since the last message was received from the stream (-1 if none yet)",
+                self.seconds_since_last_message)
+
+        # (Remember the counter for each type of message rather than looking it up every time)
+        self._message_types = {}
+
+    def seconds_since_last_message(self):
+        if self.last_message is None:
+            return -1
+        return time.time() - self.last_message
+
+    def received(self, nbytes):
+        """Called when a message arrives from the stream."""
+        self.last_message = time.time()
+        self._bytes.inc(nbytes)
+
+    def message(self, msg_type):
+        """Called with the type (see messages.py) of each message that is handled."""
+        counter = self._message_types.get(msg_type)
+        if counter is None:
+            counter = self._message_types.setdefault(msg_type,
+                    self._messages.labels(self.capture, msg_type))
+        counter.inc()
+
+    def watch_stream(self, stream):
+        """Count the bytes received by a tweepy Stream (along with any streams already watched)."""
+        with self._streams_lock:
+            self._streams.append(stream)
+
+    def unwatch_stream(self, stream):
+        """Stop watching a stream that has finished (or been replaced), keeping the bytes that it
+        received in the totals."""
+        with self._streams_lock:
+            if stream in self._streams:
+                self._streams.remove(stream)
+                self._old_bytes[0] += stream.bytes_received
+                self._old_bytes[1] += stream.bytes_decompressed
+
+    def stream_bytes(self):
+        """The bytes received by all of the streams, as sent and after decompression."""
+        with self._streams_lock:
+            return (self._old_bytes[0] + sum(s.bytes_received for s in self._streams),
+                    self._old_bytes[1] + sum(s.bytes_decompressed for s in self._streams))
+
+    def written(self, count=1):
+        self._tweets.inc(count)
+
+    def duplicate(self):
+        self._duplicates.inc()
+
+    def connected(self):
+        self._connects.inc()
+
+    def error(self, error):
+        self._errors.labels(self.capture, str(error)).inc()
+
+    def observe(self, stage, seconds):
+        """Record how long a stage (e.g. 'write') took."""
+        self._stages.labels(self.capture, stage).observe(seconds)
+
+    def connection_timings(self, timings):
+        """Record how long connecting took (a tweepy ConnectionTimings)."""
+        for stage in ("backoff", "connect", "tls", "response", "first_frame", "gap"):
+            seconds = getattr(timings, stage)
+            if seconds is not None:
+                self._connecting.labels(self.capture, stage).observe(seconds)
+
+    def gauge(self, name, help_text, function):
+        """Add a gauge whose value comes from calling 'function', e.g. the depth of a queue."""
+        self.registry.get(Gauge, name, help_text, ("capture",)).set_function(function, self.capture)
+
+
+class _MetricsHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.registry.render()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # (Don't print a line for every request)
+
+
+class _MetricsServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def start_server(registry, port, host="127.0.0.1"):
+    """Serve the metrics in 'registry' on http://host:port/metrics in a background thread. Only
+    listens on the local machine by default. Returns the server (call shutdown() to stop it)."""
+    server = _MetricsServer((host, port), _MetricsHandler)
+    server.registry = registry
+    thread = threading.Thread(target=server.serve_forever, name="metrics-server")
+    thread.daemon = True
+    thread.start()
+    # (The port that it is really using, in case 'port' was 0 for any free one)
+    print "Serving metrics on http://{h}:{p}/metrics".format(h=host, p=server.server_address[1])
+    return server
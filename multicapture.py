@@ -0,0 +1,286 @@
+# Runs several captures (e.g. a dozen different regions) in one process, rather than starting a
+# separate 'python streaming.py' for each one with the stream-*.sh scripts. Every process used to
+# have its own python interpreter, its own pool of compression processes and its own metrics page;
+# here the captures share one compression pool and one metrics page, and a supervisor restarts any
+# capture whose stream stops.
+#
+# The captures are described in a configuration file (see captures-example.ini), one section per
+# capture:
+#
+#   [leeds]
+#   locations = -2.17 53.52 -1.20 53.9
+#   data_dir = data-leeds
+#
+#   [election]
+#   track = #GE2015, election
+#   rotate_every = hour
+#
+# The keys are the long names of the streaming.py command-line options (e.g. flush_bytes,
+# queue_size, partition) plus 'track' (comma-separated words), 'locations', 'sample', 'credentials'
+# and 'data_dir' (which defaults to the name of the section). An optional [supervisor] section has
+# the options that are shared by all the captures: metrics_port, compress_workers, queue_file and
+# event_loop. With 'event_loop = yes' all of the streams are read by one thread (see
+# tweepy/asyncstream.py) rather than one thread each.
+#
+# The configuration file (and any track_file or locations_file that the captures use) is read again
+# when it changes, or when the process gets a SIGHUP. Captures whose words or locations have changed
+# are switched to a new connection without a gap (see reconfigure.py), new captures are started and
+# removed ones are stopped. (Other options can't be changed without restarting the program).
+#
+# Usage: python multicapture.py captures.ini
+
+import configparser # for reading the configuration file
+import argparse
+import os
+import sys
+import time
+import threading
+
+from tweepy.asyncstream import EventLoop
+import streaming
+import metrics
+import pipeline
+import reconfigure
+from compression import CompressionPool, QUEUE_FILENAME, DEFAULT_WORKERS
+
+SUPERVISOR_SECTION = "supervisor"
+CHECK_INTERVAL = 1 # How often (seconds) the supervisor checks that the streams are running
+
+# Options that are flags (i.e. take no value on the command line)
+FLAG_OPTIONS = set(["sample", "full_parse", "compress_on_write", "no_delete_ledger", "gzip_stream"])
+# Options that can be changed without restarting (the filter)
+FILTER_OPTIONS = set(["words", "locs", "track_file", "locations_file"])
+
+
+def section_to_args(parser, name, section):
+    """Turn the options in a section of the configuration file into the command-line options that
+    streaming.py would have been given, and parse them. Returns (args, data_dir)."""
+    argv = []
+    data_dir = name
+    for key, value in section.items():
+        if key == "data_dir":
+            data_dir = value
+        elif key == "track":
+            argv.append("-w")
+            argv.extend(w.strip() for w in value.split(",") if w.strip())
+        elif key == "locations":
+            argv.append("-l")
+            argv.extend(value.replace(",", " ").split())
+        elif key == "credentials":
+            argv.extend(["-c", value])
+        elif key in FLAG_OPTIONS:
+            if section.getboolean(key):
+                argv.append("--"+key)
+        else:
+            argv.extend(["--"+key, value])
+    try:
+        args = parser.parse_args(argv)
+    except SystemExit:
+        print "Error in the options for capture [{n}]: {a}".format(n=name, a=" ".join(argv))
+        raise
+    if not streaming.has_filters(args) and not args.sample:
+        print "Error: capture [{n}] has no locations, track words or sample flag".format(n=name)
+        sys.exit(1)
+    if args.locs is not None:
+        streaming.check_locations(args.locs)
+    if not os.path.isfile(args.cred):
+        print "Error",args.cred,"(for capture [{n}]) doesn't look like a file.".format(n=name)
+        sys.exit(1)
+    return args, data_dir
+
+
+class Capture(reconfigure.Supervised):
+    """One named capture: a stream with its own filter and data directory, and the listener that
+    writes it to disk. The stream is read in its own thread, or by 'loop' (an EventLoop) if given.
+    The supervisor restarts the stream if it stops (see reconfigure.Supervised)."""
+
+    def __init__(self, name, args, data_dir, compressor, registry=None, loop=None):
+        # (Raises IOError/ValueError if the filters can't be read)
+        reconfigure.Supervised.__init__(self, "capture [{n}]".format(n=name),
+                streaming.read_filters(args))
+        self.name = name
+        self.args = args
+        self.data_dir = data_dir
+        self.loop = loop
+        self.auth = streaming.read_auth(args.cred)
+        self.capture_metrics = None
+        if registry is not None:
+            self.capture_metrics = metrics.CaptureMetrics(registry, capture=name)
+        self.listener = streaming.make_listener(args, data_dir,
+                compressor=None if args.compress_on_write else compressor,
+                capture_metrics=self.capture_metrics, name=name)
+        # (While the filter is being changed the old and new connections both write to the listener)
+        self.merger = pipeline.MergingListener(self.listener)
+
+    def _connection(self, filters):
+        return reconfigure.Connection(self.label, self.auth, self.merger, filters, loop=self.loop,
+                capture_metrics=self.capture_metrics, **streaming.stream_options(self.args))
+
+    def reconfigure(self, args):
+        """Change to the options in 'args' (read from the configuration file again). Only the words
+        and locations can be changed while running; the capture is switched to a new connection
+        that uses them without a gap. Raises IOError/ValueError if the new filter can't be read."""
+        filters = streaming.read_filters(args)
+        ignored = sorted(k for k in vars(args) if k not in FILTER_OPTIONS and
+                getattr(args, k) != getattr(self.args, k))
+        if ignored:
+            print "Warning: can't change {o} for capture [{n}] without restarting".format(
+                    o=", ".join(ignored), n=self.name)
+        if filters == self.filters:
+            return
+        print "Changing capture [{n}] to {d}".format(n=self.name, d=reconfigure.describe(filters))
+        self.switch(filters)
+
+    def close(self):
+        self.listener.close()
+
+
+def read_config(config_file, parser):
+    """Read the configuration file. Returns the [supervisor] section (or an empty dict) and a list
+    of (name, args, data_dir) for the captures. Exits if there's something wrong with it."""
+    config = configparser.ConfigParser()
+    config.read(config_file)
+    supervisor = config[SUPERVISOR_SECTION] if config.has_section(SUPERVISOR_SECTION) else {}
+    sections = []
+    data_dirs = set()
+    for name in config.sections():
+        if name == SUPERVISOR_SECTION:
+            continue
+        capture_args, data_dir = section_to_args(parser, name, config[name])
+        if data_dir in data_dirs:
+            print "Error: more than one capture is writing to", data_dir
+            sys.exit(1)
+        data_dirs.add(data_dir)
+        sections.append((name, capture_args, data_dir))
+    return supervisor, sections
+
+
+def watched_files(config_file, captures):
+    """The files that trigger a reload when they change."""
+    return [config_file] + [f for c in captures for f in (c.args.track_file, c.args.locations_file)]
+
+
+def reload_captures(config_file, parser, captures, compressor, registry, loop):
+    """Read the configuration file again and change the running 'captures' to match it: removed
+    captures are stopped, new ones are started, and ones whose words/locations have changed are
+    switched to new connections. Returns the new list of captures. If the file has a mistake in it
+    then the old captures carry on as they are."""
+    try:
+        supervisor, sections = read_config(config_file, parser)
+    except SystemExit:
+        print "Not reloading {f} because of the error(s) above, carrying on as before".format(
+                f=config_file)
+        return captures
+
+    # Stop the captures that have gone first, in case a new one uses the same directory
+    names = set(name for name, capture_args, data_dir in sections)
+    for capture in captures:
+        if capture.name not in names:
+            print "Capture [{n}] has been removed, stopping it".format(n=capture.name)
+            capture.stop()
+            capture.close()
+    by_name = dict((c.name, c) for c in captures if c.name in names)
+
+    new_captures = []
+    for name, capture_args, data_dir in sections:
+        capture = by_name.get(name)
+        try:
+            if capture is None:
+                capture = Capture(name, capture_args, data_dir, compressor, registry, loop)
+                capture.start()
+            else:
+                if data_dir != capture.data_dir:
+                    print "Warning: can't change data_dir for capture [{n}] without restarting" \
+                            .format(n=name)
+                capture.reconfigure(capture_args)
+        except (IOError, ValueError) as e:
+            print "Error: could not read the words/locations for capture [{n}] ({e})".format(n=name,
+                    e=e)
+        if capture is not None:
+            new_captures.append(capture)
+    return new_captures
+
+
+def run():
+    """Main function: reads the configuration file, starts all the captures, and keeps them going
+    until interrupted (or until they have all given up). Reloads the configuration file when it
+    changes (or on a SIGHUP)."""
+
+    parser = argparse.ArgumentParser(description="Run several captures in one process")
+    parser.add_argument('config', type=str, help='the configuration file describing the captures')
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.config):
+        print "Error",args.config,"doesn't look like a file."
+        sys.exit(1)
+    capture_parser = streaming.make_parser()
+    supervisor, sections = read_config(args.config, capture_parser)
+
+    # Options shared by all the captures
+    metrics_port = supervisor.get("metrics_port")
+    if metrics_port is not None:
+        metrics_port = int(metrics_port) # (0 means any free port)
+    compress_workers = int(supervisor.get("compress_workers", DEFAULT_WORKERS))
+    queue_file = supervisor.get("queue_file", QUEUE_FILENAME)
+    loop = None
+    if str(supervisor.get("event_loop", "no")).lower() in ("1", "yes", "true", "on"):
+        loop = EventLoop()
+
+    registry = None
+    if metrics_port is not None:
+        registry = metrics.Registry()
+        metrics.start_server(registry, metrics_port)
+
+    # One pool compresses the old files from all the captures
+    compressor = CompressionPool(workers=compress_workers, queue_file=queue_file)
+    if registry is not None:
+        registry.get(metrics.Gauge, "twitter_compression_backlog",
+                "Files waiting to be compressed", ("capture",)).set_function(
+                        compressor.backlog, SUPERVISOR_SECTION)
+
+    captures = []
+    for name, capture_args, data_dir in sections:
+        try:
+            captures.append(Capture(name, capture_args, data_dir, compressor, registry, loop))
+        except (IOError, ValueError) as e:
+            print "Error: could not read the words/locations for capture [{n}] ({e})".format(n=name,
+                    e=e)
+            sys.exit(1)
+
+    if not captures:
+        print "Error: no captures in", args.config
+        sys.exit(1)
+
+    trigger = reconfigure.ReloadTrigger(watched_files(args.config, captures))
+    try:
+        if loop is not None:
+            loop_thread = threading.Thread(target=loop.run, name="event-loop")
+            loop_thread.daemon = True
+            loop_thread.start()
+        for capture in captures:
+            capture.start()
+        while True:
+            time.sleep(CHECK_INTERVAL)
+            if trigger.due():
+                print "Reloading", args.config
+                captures = reload_captures(args.config, capture_parser, captures, compressor,
+                        registry, loop)
+                trigger.watch(watched_files(args.config, captures))
+            now = time.time()
+            running = [c for c in captures if c.check(now)]
+            if not running:
+                print "All of the captures have stopped, giving up."
+                break
+    except KeyboardInterrupt:
+        print "Stopping captures"
+    finally:
+        for capture in captures:
+            capture.stop()
+        if loop is not None:
+            loop.stop()
+        for capture in captures:
+            capture.close()
+        compressor.close()
+
+if __name__=="__main__":
+    run()
@@ -0,0 +1,256 @@
+# Separates reading from the twitter stream and writing tweets to disk. Normally the stream calls the
+# listener's on_data() in the same thread that reads from the connection, so if writing to disk
+# stalls (e.g. the disk is busy compressing a file) then nothing is read from the connection and
+# twitter can disconnect us for being too slow. A QueuedListener sits between the stream and the
+# real listener: the stream's thread just puts messages in a queue and another thread takes them
+# off the queue and passes them on. Short delays writing to disk are then soaked up by the queue.
+
+import collections
+import threading
+import time
+import traceback
+
+from tweepy.streaming import StreamListener
+
+# What to do when the queue is full
+BLOCK = "block" # Wait for space (stops reading from the stream, but never loses any tweets)
+DROP_NEWEST = "drop_newest" # Throw away the message that has just arrived
+DROP_OLDEST = "drop_oldest" # Throw away the message that has been in the queue the longest
+POLICIES = [BLOCK, DROP_NEWEST, DROP_OLDEST]
+
+DEFAULT_QUEUE_SIZE = 50000 # Maximum number of messages in the queue
+DROP_REPORT_EVERY = 1000 # Print a message every time this many messages have been dropped
+DEFAULT_MAX_BATCH = 1000 # Most messages to pass on to the downstream listener in one go
+
+
+class QueuedListener(StreamListener):
+    """A listener that passes messages on to another listener ('downstream') through a bounded
+    queue, so that the stream can carry on reading while the downstream listener is busy.
+    'max_size' is the most messages that can be waiting and 'policy' says what to do when the queue
+    is full (one of POLICIES). Messages other than data (errors, timeouts, etc) are passed straight
+    to the downstream listener.
+    Messages are passed on to the downstream listener's on_batch() as a list of everything that is
+    waiting in the queue (up to 'max_batch' messages), so a busy queue is emptied quickly.
+    QueuedListeners can be chained to make a pipeline with more than one stage.
+    If 'capture_metrics' (a metrics.CaptureMetrics) is given then the depth of the queue, the
+    number of dropped messages and the time that messages wait in the queue are recorded."""
+
+    def __init__(self, downstream, max_size=DEFAULT_QUEUE_SIZE, policy=BLOCK, name="pipeline",
+            capture_metrics=None, max_batch=DEFAULT_MAX_BATCH):
+        if policy not in POLICIES:
+            raise ValueError("Unknown queue policy '{p}', should be one of {ps}".format(
+                p=policy, ps=POLICIES))
+        self.api = getattr(downstream, "api", None)
+        self.downstream = downstream
+        self.max_size = max_size
+        self.max_batch = max_batch
+        self.policy = policy
+        self.name = name
+        self.metrics = capture_metrics
+
+        self.high_water = 0 # The most messages that have been in the queue at once
+        self.dropped = 0 # Number of messages thrown away because the queue was full
+        self.processed = 0 # Number of messages passed on to the downstream listener
+        self.blocked_time = 0.0 # Total time (seconds) the stream has spent waiting for space
+
+        self._queue = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._stopped = False # Set when the downstream listener says to stop, or on close()
+
+        if capture_metrics is not None:
+            capture_metrics.gauge("twitter_queue_depth", "Messages waiting in the queue", self.depth)
+            capture_metrics.gauge("twitter_queue_high_water",
+                    "The most messages that have been in the queue at once", lambda: self.high_water)
+            capture_metrics.gauge("twitter_queue_dropped",
+                    "Messages dropped because the queue was full", lambda: self.dropped)
+
+        self._consumer = threading.Thread(target=self._consume, name=name+"-consumer")
+        self._consumer.daemon = True
+        self._consumer.start()
+
+    def depth(self):
+        """The number of messages currently waiting in the queue."""
+        with self._lock:
+            return len(self._queue)
+
+    def on_data(self, raw_data):
+        """Called by the stream (in its thread). Puts the message in the queue and returns."""
+        with self._lock:
+            return self._put(raw_data)
+
+    def on_batch(self, frames):
+        """Called by the stream with a list of messages. Puts them all in the queue."""
+        with self._lock:
+            for raw_data in frames:
+                if self._put(raw_data) is False:
+                    return False
+        return True
+
+    def _put(self, raw_data):
+        # (The lock must be held when this is called)
+        if self._stopped:
+            return False
+        if len(self._queue) >= self.max_size:
+            if self.policy == BLOCK:
+                start = time.time()
+                while len(self._queue) >= self.max_size and not self._stopped:
+                    self._not_full.wait()
+                self.blocked_time += time.time() - start
+                if self._stopped:
+                    return False
+            elif self.policy == DROP_NEWEST:
+                self._dropped_message()
+                return True
+            else: # DROP_OLDEST
+                self._queue.popleft()
+                self._dropped_message()
+        # (Remember when the message arrived, if timing how long messages wait in the queue)
+        self._queue.append(raw_data if self.metrics is None else (time.time(), raw_data))
+        if len(self._queue) > self.high_water:
+            self.high_water = len(self._queue)
+        self._not_empty.notify()
+        return True
+
+    def _dropped_message(self):
+        # (The lock must be held when this is called)
+        self.dropped += 1
+        if self.dropped % DROP_REPORT_EVERY == 1:
+            print "Warning: the {n} queue is full ({s} messages), have dropped {d} message(s) so far".format(
+                    n=self.name, s=self.max_size, d=self.dropped)
+
+    def _consume(self):
+        """Runs in the background, passing messages from the queue to the downstream listener."""
+        while True:
+            with self._lock:
+                while not self._queue and not self._stopped:
+                    self._not_empty.wait()
+                if not self._queue: # (Must have been stopped and the queue is empty)
+                    return
+                queue = self._queue
+                batch = [queue.popleft() for i in xrange(min(len(queue), self.max_batch))]
+                self._not_full.notify()
+            if self.metrics is not None:
+                now = time.time()
+                for arrived, raw_data in batch:
+                    self.metrics.observe("queue", now - arrived)
+                batch = [raw_data for arrived, raw_data in batch]
+            try:
+                result = self.downstream.on_batch(batch)
+            except Exception as e:
+                # Don't let one bad batch kill the thread, otherwise the queue will fill up
+                print "****\nCaught an exception passing messages on from the {n} queue.".format(n=self.name)
+                print "The trackback is:"
+                print traceback.format_exc()
+                print "****"
+                self.downstream.on_exception(e)
+                result = None
+            self.processed += len(batch)
+            if result is False:
+                # The downstream listener wants the stream to stop. Stop taking new messages (the
+                # stream will be told next time it calls on_data()).
+                with self._lock:
+                    self._stopped = True
+                    self._queue.clear()
+                    self._not_full.notify_all()
+                return
+
+    def close(self):
+        """Wait for everything in the queue to be passed on and stop the background thread. Closes
+        the downstream listener too (if it has a close() method)."""
+        with self._lock:
+            self._stopped = True
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        self._consumer.join()
+        print "Closed {n} queue. High water mark: {h}/{s} messages, {d} dropped, {b:.1f}s spent waiting for space".format(
+                n=self.name, h=self.high_water, s=self.max_size, d=self.dropped, b=self.blocked_time)
+        if hasattr(self.downstream, "close"):
+            self.downstream.close()
+
+    # Everything else is passed straight on to the downstream listener
+
+    def on_connect(self):
+        return self.downstream.on_connect()
+
+    def on_exception(self, exception):
+        return self.downstream.on_exception(exception)
+
+    def on_error(self, status_code):
+        return self.downstream.on_error(status_code)
+
+    def on_timeout(self):
+        return self.downstream.on_timeout()
+
+    def on_disconnect(self, notice):
+        return self.downstream.on_disconnect(notice)
+
+    def on_timings(self, timings):
+        return self.downstream.on_timings(timings)
+
+
+class MergingListener(object):
+    """Passes on the messages from several streams (each read in its own thread) to one 'downstream'
+    listener, one message (or batch) at a time. Each stream is given its own listener by source().
+    Used to run several connections into one capture (see shards.py and reconfigure.py)."""
+
+    def __init__(self, downstream):
+        self.api = getattr(downstream, "api", None)
+        self.downstream = downstream
+        self.lock = threading.Lock()
+
+    def source(self):
+        """A new listener for one of the streams."""
+        return MergedSource(self)
+
+    def close(self):
+        if hasattr(self.downstream, "close"):
+            self.downstream.close()
+
+
+class MergedSource(StreamListener):
+    """The listener for one of the streams going into a MergingListener. Counts the messages from
+    its stream and sets the 'connected' event when the stream connects."""
+
+    def __init__(self, merger):
+        self.api = merger.api
+        self.merger = merger
+        self.downstream = merger.downstream
+        self.messages = 0
+        self.connected = threading.Event()
+
+    def on_data(self, raw_data):
+        self.messages += 1
+        with self.merger.lock:
+            return self.downstream.on_data(raw_data)
+
+    def on_batch(self, frames):
+        self.messages += len(frames)
+        with self.merger.lock:
+            return self.downstream.on_batch(frames)
+
+    def on_connect(self):
+        self.connected.set()
+        with self.merger.lock:
+            return self.downstream.on_connect()
+
+    def on_exception(self, exception):
+        with self.merger.lock:
+            return self.downstream.on_exception(exception)
+
+    def on_error(self, status_code):
+        with self.merger.lock:
+            return self.downstream.on_error(status_code)
+
+    def on_timeout(self):
+        with self.merger.lock:
+            return self.downstream.on_timeout()
+
+    def on_disconnect(self, notice):
+        with self.merger.lock:
+            return self.downstream.on_disconnect(notice)
+
+    def on_timings(self, timings):
+        with self.merger.lock:
+            return self.downstream.on_timings(timings)
@@ -0,0 +1,91 @@
+# Somewhere to put messages from the stream that aren't tweets or deletes: messages that aren't
+# valid json, ones that we don't recognise, and notices like 'limit' and 'warning'. These used to be
+# written to a new file each (error<time>.json) with the whole message printed out, which during
+# problems at twitter's end meant thousands of tiny files and a lot of output. Now they are all
+# appended to one file (started again when it gets too big), and rather than printing every one a
+# summary of how many of each sort there have been is printed every so often.
+#
+# Each line of the quarantine file is a json object like:
+#
+#   {"class": "invalid", "received_ms": 1452591943781, "detail": "No JSON object...", "raw": "..."}
+
+import json
+import os
+import time
+
+from writer import BufferedTweetWriter
+
+QUARANTINE_FILENAME = "quarantine.json" # (In the data directory)
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024 # Start a new quarantine file when it gets this big
+DEFAULT_SUMMARY_INTERVAL = 60 # Print a summary at most this often (seconds)
+
+
+class QuarantineSink(object):
+    """Appends messages that can't be handled normally to 'filename', grouped into classes (e.g.
+    'invalid' or 'limit'). When the file is bigger than 'max_bytes' it is renamed (with the time
+    added to the name) and a new one started. A summary of the number of messages in each class is
+    printed at most every 'summary_interval' seconds. Other arguments are passed to the
+    BufferedTweetWriter that writes the file."""
+
+    def __init__(self, filename, max_bytes=DEFAULT_MAX_BYTES,
+            summary_interval=DEFAULT_SUMMARY_INTERVAL, **kwargs):
+        self.filename = filename
+        self.max_bytes = max_bytes
+        self.summary_interval = summary_interval
+
+        self.counts = {} # Total number of messages in each class
+        self._recent = {} # Number in each class since the last summary
+        self._last_summary = time.time()
+        self._size = os.path.getsize(filename) if os.path.isfile(filename) else 0
+
+        self._writer = BufferedTweetWriter(**kwargs)
+        self._writer.open(filename)
+
+    def add(self, error_class, raw_data, detail=None):
+        """Quarantine a message. 'detail' is an optional description of what was wrong with it."""
+        if error_class not in self.counts:
+            # The first of each class is worth mentioning straight away
+            print "Quarantining message(s) of class '{c}' in {f}{d}".format(c=error_class,
+                    f=self.filename, d=" ("+detail+")" if detail else "")
+        self.counts[error_class] = self.counts.get(error_class, 0) + 1
+        self._recent[error_class] = self._recent.get(error_class, 0) + 1
+
+        record = json.dumps({
+            "class": error_class,
+            "received_ms": int(time.time() * 1000),
+            "detail": detail,
+            "raw": raw_data.decode('utf-8', 'replace') if isinstance(raw_data, str) else raw_data,
+            }) + "\n"
+        if self._size + len(record) > self.max_bytes and self._size > 0:
+            self._start_new_file()
+        self._writer.write(record)
+        self._size += len(record)
+
+        if time.time() - self._last_summary >= self.summary_interval:
+            self.print_summary()
+
+    def print_summary(self):
+        """Print the number of messages quarantined since the last summary (if there were any)."""
+        if self._recent:
+            print "Quarantined {n} message(s) in the last {s:.0f}s: {r} (totals: {t})".format(
+                    n=sum(self._recent.values()), s=time.time() - self._last_summary,
+                    r=_format_counts(self._recent), t=_format_counts(self.counts))
+        self._recent = {}
+        self._last_summary = time.time()
+
+    def close(self):
+        self.print_summary()
+        self._writer.close()
+
+    def _start_new_file(self):
+        """Rename the current file out of the way and start a new one."""
+        self._writer.flush()
+        old_name = "{f}.{t}".format(f=self.filename, t=int(time.time() * 1000))
+        os.rename(self.filename, old_name)
+        self._writer.open(self.filename)
+        self._size = 0
+        print "Quarantine file was full, moved it to {f}".format(f=old_name)
+
+
+def _format_counts(counts):
+    return ", ".join("{k}={v}".format(k=k, v=v) for k, v in sorted(counts.items()))
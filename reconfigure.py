@@ -0,0 +1,294 @@
+# Changes what a capture is listening to without a gap in the tweets. Twitter doesn't let a
+# connection change its filter, so changing the words or the bounding box used to mean stopping the
+# program and starting it again, losing the tweets that arrived while reconnecting (and during any
+# backoff). Here a change is 'make before break': a new connection is opened with the new filter,
+# both connections run together for a few seconds, and then the old one is closed. The tweets that
+# arrive on both connections are removed by the dedup filter (see dedup.py).
+#
+# A reload is triggered by sending the process a SIGHUP or by changing one of the files it was
+# started with (the configuration file, or the files of words and boxes), e.g.:
+#
+#   python streaming.py --track_file election-words.txt
+#   ... edit election-words.txt (or: kill -HUP <pid>)
+#
+# Used by streaming.py, multicapture.py and shards.py (which also use Supervised, below, to restart
+# their connections when they stop).
+
+import os
+import signal
+import time
+import threading
+import traceback
+
+from tweepy import Stream
+from tweepy.asyncstream import AsyncStream
+
+CONNECT_TIMEOUT = 60 # Longest to wait (seconds) for a new connection before giving up on a change
+OVERLAP = 5 # Seconds to keep the old connection open after the new one has connected
+KINDS = ("track", "follow", "locations")
+MAX_RESTARTS = 5 # Give up on a connection after its stream has stopped this many times in a row
+RESTART_BACKOFF = 10 # Seconds to wait before restarting a stream (doubled after each restart)
+# A restarted stream that stays up for this many times the next backoff is working again, so the
+# count of restarts goes back to 0
+RESTART_RESET = 3
+
+
+def read_lines(filename):
+    """The non-blank lines of a file, with surrounding spaces removed. (There's no comment syntax
+    because hashtags start with '#')."""
+    with open(filename) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def read_boxes(numbers, where):
+    """Turn a list of numbers into (minx, miny, maxx, maxy) boxes, checking them. Raises
+    ValueError if they don't make sense."""
+    if len(numbers) % 4 != 0:
+        raise ValueError("the locations in {w} aren't a whole number of boxes (4 numbers each)"
+                .format(w=where))
+    boxes = [tuple(float(x) for x in numbers[i:i+4]) for i in range(0, len(numbers), 4)]
+    for box in boxes:
+        if box[0] > box[2] or box[1] > box[3]:
+            raise ValueError("the box {b} in {w} has its min x/y greater than its max x/y".format(
+                b=box, w=where))
+    return boxes
+
+
+def _unique(items, key=None):
+    """The items without any repeats (by 'key'), in the same order."""
+    seen = set()
+    result = []
+    for item in items:
+        k = item if key is None else key(item)
+        if k not in seen:
+            seen.add(k)
+            result.append(item)
+    return result
+
+
+def read_filters(words=None, follow=None, locs=None, track_file=None, follow_file=None,
+        locations_file=None):
+    """The words, users and boxes to filter by, from lists (e.g. from the command line) and files
+    (one per line; a box is four numbers: minx miny maxx maxy). Returns a dict like
+    {"track": [...], "follow": [...], "locations": [(minx, miny, maxx, maxy), ...]}. Raises IOError
+    or ValueError if they can't be read."""
+    track = list(words or [])
+    follow = list(follow or [])
+    locations = read_boxes(locs or [], "-l")
+    if track_file:
+        track.extend(read_lines(track_file))
+    if follow_file:
+        follow.extend(read_lines(follow_file))
+    if locations_file:
+        locations.extend(read_boxes(" ".join(read_lines(locations_file)).replace(",", " ").split(),
+            locations_file))
+    # (Twitter doesn't care about the case of words)
+    return {"track": _unique(track, key=str.lower), "follow": _unique(follow),
+            "locations": _unique(locations)}
+
+
+class ReloadTrigger(object):
+    """Says when it's time to reload: after a SIGHUP, or when any of the 'filenames' have changed.
+    Must be created in the main thread (to catch the signal)."""
+
+    def __init__(self, filenames=()):
+        self._signalled = False
+        self.watch(filenames)
+        if hasattr(signal, "SIGHUP"): # (Not on windows)
+            signal.signal(signal.SIGHUP, self._on_signal)
+
+    def watch(self, filenames):
+        """Change the files to watch."""
+        self.filenames = sorted(set(f for f in filenames if f))
+        self._times = self._file_times()
+
+    def _file_times(self):
+        return [os.path.getmtime(f) if os.path.isfile(f) else None for f in self.filenames]
+
+    def _on_signal(self, signum, frame):
+        self._signalled = True
+
+    def due(self):
+        """True if there has been a SIGHUP or a file has changed since the last call."""
+        times = self._file_times()
+        due = self._signalled or times != self._times
+        self._signalled = False
+        self._times = times
+        return due
+
+
+class Connection(object):
+    """One connection to twitter, filtering by 'filters' (a dict like read_filters() gives, or None
+    for the sample stream), that passes its messages to 'merger' (a pipeline.MergingListener, so
+    that an old and a new connection can run into the same listener). The stream is read in its own
+    thread, or by 'loop' (a tweepy.asyncstream.EventLoop) if given. If 'capture_metrics' is given
+    then the bytes the stream receives are counted in it."""
+
+    def __init__(self, name, auth, merger, filters, loop=None, capture_metrics=None,
+            **stream_options):
+        self.name = name
+        self.filters = filters
+        self.loop = loop
+        self.listener = merger.source()
+        if loop is None:
+            self.stream = Stream(auth, self.listener, **stream_options)
+        else:
+            self.stream = AsyncStream(auth, self.listener, loop=loop, **stream_options)
+        self.capture_metrics = capture_metrics
+        if capture_metrics is not None:
+            capture_metrics.watch_stream(self.stream)
+        self.thread = None
+
+    def start(self):
+        if self.loop is not None:
+            self._run() # (Returns straight away, the loop reads the stream)
+            return
+        self.thread = threading.Thread(target=self._run, name=str(self.name))
+        self.thread.daemon = True # (Don't stop the process exiting while waiting for tweets)
+        self.thread.start()
+
+    def _run(self):
+        try:
+            # (Ask twitter to warn us if we are falling behind)
+            if self.filters is None:
+                self.stream.sample(stall_warnings=True)
+            else:
+                locations = [x for box in self.filters.get("locations") or [] for x in box]
+                self.stream.filter(track=self.filters.get("track") or None,
+                        follow=self.filters.get("follow") or None, locations=locations or None,
+                        stall_warnings=True)
+        except:
+            print "****\nReceived an exception in {n}.".format(n=self.name)
+            print "The trackback is:"
+            print traceback.format_exc()
+            print "****"
+
+    def is_running(self):
+        if self.loop is not None:
+            return self.stream.running
+        return self.thread is not None and self.thread.is_alive()
+
+    def wait_connected(self, timeout):
+        """Wait for the stream to connect. Returns False if it hasn't connected after 'timeout'
+        seconds or has stopped."""
+        give_up = time.time() + timeout
+        while not self.listener.connected.wait(min(1, max(0, give_up - time.time()))):
+            if time.time() >= give_up or not self.is_running():
+                return False
+        return True
+
+    def stop(self):
+        print "Disconnecting {n} (received {m} messages, {s})".format(n=self.name,
+                m=self.listener.messages, s=describe_bytes(self.stream))
+        self.stream.disconnect()
+        self.release()
+
+    def release(self):
+        """Stop counting the stream's bytes separately (they are kept in the totals), so that the
+        metrics don't hold on to old streams. Call when it has been stopped or has died and is being
+        replaced. (Can be called more than once)."""
+        if self.capture_metrics is not None:
+            self.capture_metrics.unwatch_stream(self.stream)
+
+
+class Supervised(object):
+    """Keeps a Connection running: restarts it (waiting longer each time) when its stream stops, and
+    switches it to new filters without a gap. Used for the captures in multicapture.py and the
+    shards in shards.py. 'label' names it in messages (e.g. 'capture [leeds]'). Subclasses provide
+    _connection(filters), which makes a new Connection using the given filters."""
+
+    def __init__(self, label, filters):
+        self.label = label
+        self.filters = filters
+        self.connection = None
+        self.restarts = 0
+        self.restart_at = None # When to restart the stream, if it has stopped
+        self.started_at = None
+
+    def _connection(self, filters):
+        raise NotImplementedError
+
+    def describe(self):
+        return describe(self.filters)
+
+    def start(self):
+        print "Starting {l} ({d})".format(l=self.label, d=self.describe())
+        if self.connection is not None:
+            self.connection.release() # (The old one has died)
+        self.connection = self._connection(self.filters)
+        self.connection.start()
+        self.started_at = time.time()
+
+    def switch(self, filters):
+        """Change to new filters without a gap. (If it can't, carries on with the old ones)."""
+        if not self.is_running():
+            # (Nothing to hand over from; check() will start it with the new filters)
+            self.filters = filters
+            return
+        connection = self._connection(filters)
+        if handover(self.connection, connection):
+            self.connection = connection
+            self.filters = filters
+
+    def is_running(self):
+        return self.connection is not None and self.connection.is_running()
+
+    def check(self, now):
+        """Restart the stream if it has stopped. Returns False if it has given up."""
+        if self.is_running():
+            if self.restarts and now - self.started_at >= \
+                    RESTART_RESET * RESTART_BACKOFF * 2 ** self.restarts:
+                print "The stream for {l} has been running since it was restarted, resetting its "\
+                        "count of restarts".format(l=self.label)
+                self.restarts = 0
+            return True
+        if self.restarts >= MAX_RESTARTS:
+            return False
+        if self.restart_at is None:
+            self.restart_at = now + RESTART_BACKOFF * 2 ** self.restarts
+            print "The stream for {l} has stopped, restarting it in {s}s (restart {r} of {m})".format(
+                    l=self.label, s=RESTART_BACKOFF * 2 ** self.restarts, r=self.restarts+1,
+                    m=MAX_RESTARTS)
+        elif now >= self.restart_at:
+            self.restarts += 1
+            self.restart_at = None
+            self.start()
+        return True
+
+    def stop(self):
+        if self.connection is not None:
+            self.connection.stop()
+
+
+def handover(old, new, timeout=CONNECT_TIMEOUT, overlap=OVERLAP):
+    """Replace the Connection 'old' with 'new' without a gap: start 'new', wait for it to connect,
+    let both run for 'overlap' seconds, then stop 'old'. If 'new' hasn't connected after 'timeout'
+    seconds then it is stopped and 'old' is kept. Returns True if the new connection took over.
+    (If both use the same credentials then twitter may drop the old connection itself as soon as
+    the new one connects, which is fine)."""
+    print "Opening a new connection for {n} before closing the old one".format(n=new.name)
+    new.start()
+    if not new.wait_connected(timeout):
+        print "The new connection for {n} didn't connect, keeping the old one".format(n=new.name)
+        new.stop()
+        return False
+    time.sleep(overlap)
+    old.stop()
+    print "Switched {n} to the new connection".format(n=new.name)
+    return True
+
+
+def describe_bytes(stream):
+    """How much data a stream has received, e.g. '12.3MB' or '12.3MB, 2.1MB compressed'."""
+    text = "{d:.1f}MB".format(d=stream.bytes_decompressed / 1e6)
+    if stream.bytes_received != stream.bytes_decompressed:
+        text += ", {r:.1f}MB compressed".format(r=stream.bytes_received / 1e6)
+    return text
+
+
+def describe(filters):
+    """A short description of some filters, e.g. '12 track, 1 locations'."""
+    if filters is None:
+        return "sample"
+    return ", ".join("{n} {k}".format(n=len(filters[kind]), k=kind) for kind in KINDS
+            if filters.get(kind))
@@ -0,0 +1,433 @@
+# A stand-in for twitter's streaming API, for testing and benchmarking the listener without a live
+# connection (or a rate limit). It serves messages over HTTP the same way twitter does (chunked,
+# with each message preceded by its length: 'delimited=length') to any POST or GET, e.g. to
+# /1.1/statuses/filter.json, ignoring the words/locations asked for. The messages come from capture
+# files (the .json or .json.gz files that streaming.py writes) or, if no files are given, are made
+# up by synthetic.py.
+#
+# It can also misbehave in the ways that twitter does, so that reconnecting can be tested:
+#
+#   - send messages at a steady rate, with bursts of a higher rate (--rate, --burst_rate, ...)
+#   - send keep-alive newlines when there's nothing else to send (--keepalive)
+#   - refuse connections with a 420 ('Enhance Your Calm') or 503 (--errors, --error_rate)
+#   - hang up half way through a message (--disconnect_after)
+#   - go completely quiet for a while (--stall_after, --stall_for)
+#   - gzip the stream if the client asks for it (--gzip)
+#
+# Messages are handed out in order across connections, so a client that reconnects carries on where
+# it left off (less the message that was cut short by --disconnect_after, and any that were sent to
+# a client that had already gone). When they run out the stream carries on with just keep-alives.
+# Every few seconds it prints how many messages have been sent; with '--rate 0' (the default) that
+# is as fast as the client can take them. Usage, e.g.:
+#
+#   python replay.py data/t1452591943781.json.gz --repeat --errors 503 420
+#   python streaming.py -w anything --stream_url http://127.0.0.1:8765
+#
+# (streaming.py still needs a credentials file, but the keys in it can be made up).
+
+import argparse
+import gzip
+import os
+import random
+import socket
+import sys
+import threading
+import time
+import zlib
+import BaseHTTPServer
+import SocketServer
+
+from tweepy.streaming import KEEPALIVE_INTERVAL
+import synthetic # For making up tweets
+
+DEFAULT_PORT = 8765
+MAX_CHUNK = 64 * 1024 # Most bytes of messages to send in one chunk
+MIN_SLEEP = 0.001 # Send a message early rather than sleep for less than this (seconds)
+REASONS = {420: "Enhance Your Calm", 503: "Service Unavailable"}
+
+
+def read_captures(filenames):
+    """The messages in capture files (.json or .json.gz, one message per line), in order."""
+    for filename in filenames:
+        f = gzip.open(filename, 'rb') if filename.endswith(".gz") else open(filename, 'rb')
+        try:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield line
+        finally:
+            f.close()
+
+
+def frame(message):
+    """A message as it is sent with delimited=length: its length (including the \\r\\n on the end)
+    on a line of its own, then the message."""
+    message += "\r\n"
+    return "{n}\r\n{m}".format(n=len(message), m=message)
+
+
+class Source(object):
+    """Hands out the messages to the connections, one at a time. 'make_messages' is called to get an
+    iterator of the messages (and again each time they run out, if 'repeat' is True). Stops after
+    'limit' messages, if given."""
+
+    def __init__(self, make_messages, repeat=False, limit=None):
+        self._make_messages = make_messages
+        self._messages = make_messages()
+        self.repeat = repeat
+        self.limit = limit
+        self.count = 0 # Messages handed out so far
+        self._lock = threading.Lock()
+
+    def next(self):
+        """The next message (framed, ready to send), or None if there are no more."""
+        with self._lock:
+            if self.limit is not None and self.count >= self.limit:
+                return None
+            message = next(self._messages, None)
+            if message is None and self.repeat:
+                self._messages = self._make_messages()
+                message = next(self._messages, None)
+            if message is None:
+                return None
+            self.count += 1
+        return frame(message)
+
+
+class Pacer(object):
+    """Works out when each message should be sent: 'rate' messages per second (0 for as fast as
+    possible), except for 'burst_length' seconds out of every 'burst_every' seconds when it is
+    'burst_rate'."""
+
+    def __init__(self, rate, burst_rate=0, burst_every=0, burst_length=0):
+        self.rate = rate
+        self.burst_rate = burst_rate
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.start = time.time()
+        self.due = self.start
+
+    def rate_at(self, t):
+        if self.burst_every and (t - self.start) % self.burst_every < self.burst_length:
+            return self.burst_rate
+        return self.rate
+
+    def next(self):
+        """The time that the next message is due. (If sending falls behind then the messages are
+        due straight away until it has caught up)."""
+        due = self.due
+        rate = self.rate_at(due)
+        if rate:
+            self.due = due + 1.0 / rate
+        return due
+
+    def restart(self):
+        """Carry on from now (e.g. after a stall) rather than catching up."""
+        self.due = max(self.due, time.time())
+
+
+class ChunkedWriter(object):
+    """Writes the body of a response in HTTP chunks, gzip-compressing it if 'compress' is True.
+    Data is kept until flush() (or end()) is called."""
+
+    def __init__(self, wfile, compress=False):
+        self.wfile = wfile
+        self._compressor = None
+        if compress:
+            self._compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        self._buffer = []
+        self.buffered = 0 # Bytes waiting to be sent
+        self.bytes_sent = 0 # (After compression)
+        self.messages = 0 # (Counted by whatever writes them)
+
+    def write(self, data):
+        self._buffer.append(data)
+        self.buffered += len(data)
+
+    def _send_chunk(self, data):
+        if data:
+            self.wfile.write("{n:x}\r\n{d}\r\n".format(n=len(data), d=data))
+            self.bytes_sent += len(data)
+
+    def flush(self):
+        data = "".join(self._buffer)
+        self._buffer = []
+        self.buffered = 0
+        if self._compressor is not None and data:
+            # (A sync flush so the client can decompress everything sent so far)
+            data = self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+        self._send_chunk(data)
+        self.wfile.flush()
+
+    def end(self):
+        """Send anything left and the last (empty) chunk."""
+        self.flush()
+        if self._compressor is not None:
+            self._send_chunk(self._compressor.flush())
+        self.wfile.write("0\r\n\r\n")
+        self.wfile.flush()
+
+
+class _ReplayHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # (Chunked responses need HTTP/1.1)
+
+    def do_POST(self):
+        self.server.replay.serve(self)
+
+    do_GET = do_POST
+
+    def log_message(self, format, *args):
+        pass # (serve() prints what happened to each connection)
+
+    def handle(self):
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+        except socket.error:
+            pass # (The client has gone)
+
+    def finish(self):
+        try:
+            BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
+        except socket.error:
+            pass
+
+
+class _ReplayServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class ReplayServer(object):
+    """Serves the messages from 'source' (a Source) to any number of connections. The other options
+    are the same as the command-line options (see run()). Call start() to start serving."""
+
+    def __init__(self, source, rate=0, burst_rate=0, burst_every=0, burst_length=0,
+            keepalive=KEEPALIVE_INTERVAL, errors=(), error_rate=0, seed=None,
+            disconnect_after=0, stall_after=0, stall_for=0, gzip=False):
+        self.source = source
+        self.pacing = dict(rate=rate, burst_rate=burst_rate, burst_every=burst_every,
+                burst_length=burst_length)
+        self.keepalive = keepalive
+        self.errors = list(errors)
+        self.error_rate = error_rate
+        self.disconnect_after = disconnect_after
+        self.stall_after = stall_after
+        self.stall_for = stall_for
+        self.gzip = gzip
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.connections = 0 # Connections so far (including refused ones)
+        self.messages = 0 # Messages sent (not counting ones cut short)
+        self.bytes_sent = 0
+        self._server = None
+
+    def _new_connection(self):
+        """Number the connection and decide what status to give it."""
+        with self._lock:
+            self.connections += 1
+            number = self.connections
+            if number <= len(self.errors):
+                return number, self.errors[number - 1]
+            if self.error_rate and self._random.random() < self.error_rate:
+                return number, self._random.choice((420, 503))
+            return number, 200
+
+    def serve(self, handler):
+        """Respond to one request (called by the handler's thread)."""
+        length = int(handler.headers.getheader("content-length") or 0)
+        if length:
+            handler.rfile.read(length) # (The parameters, which are ignored)
+        number, status = self._new_connection()
+        if status != 200:
+            print "Connection {n}: refused with a {s}".format(n=number, s=status)
+            handler.send_response(status, REASONS.get(status))
+            handler.send_header("Content-Length", "0")
+            handler.end_headers()
+            return
+
+        compress = self.gzip and "gzip" in (handler.headers.getheader("accept-encoding") or "")
+        handler.send_response(200)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Transfer-Encoding", "chunked")
+        if compress:
+            handler.send_header("Content-Encoding", "gzip")
+        handler.end_headers()
+        handler.close_connection = 1 # (One stream per connection, like twitter)
+
+        out = ChunkedWriter(handler.wfile, compress)
+        start = time.time()
+        try:
+            ending = self._send(out, number)
+        except (socket.error, IOError):
+            ending = "closed by the client"
+        seconds = time.time() - start
+        with self._lock:
+            self.bytes_sent += out.bytes_sent
+        print "Connection {n}: sent {m} messages ({b:.1f}MB) in {s:.1f}s ({r:.0f}/s), {e}".format(
+                n=number, m=out.messages, b=out.bytes_sent / 1e6, s=seconds,
+                r=out.messages / max(seconds, 1e-6), e=ending)
+        if ending == "out of messages" and self.keepalive:
+            # (Like a filter that nothing matches any more, rather than a stream that ends and
+            # is reconnected straight away)
+            try:
+                while True:
+                    time.sleep(self.keepalive)
+                    out.write("\r\n")
+                    out.flush()
+            except (socket.error, IOError):
+                pass
+
+    def _send(self, out, number):
+        """Send messages to one connection until something ends it. Returns why it ended."""
+        pacer = Pacer(**self.pacing)
+        last_write = time.time()
+        stalled = False
+        while True:
+            if self.stall_after and out.messages == self.stall_after and not stalled:
+                out.flush()
+                print "Connection {n}: stalling for {s}s".format(n=number, s=self.stall_for)
+                time.sleep(self.stall_for)
+                stalled = True
+                pacer.restart()
+                last_write = time.time()
+            message = self.source.next()
+            if message is None:
+                if self.keepalive:
+                    out.flush() # (serve() carries on with keep-alives)
+                else:
+                    out.end()
+                return "out of messages"
+            if self.disconnect_after and out.messages == self.disconnect_after:
+                out.write(message[:len(message) // 2])
+                out.flush()
+                return "cut off half way through a message"
+
+            # Wait until the message is due, sending keep-alives if it's a long wait
+            due = pacer.next()
+            while True:
+                now = time.time()
+                if due - now < MIN_SLEEP:
+                    break
+                if out.buffered:
+                    out.flush()
+                    last_write = now
+                if self.keepalive and now - last_write >= self.keepalive:
+                    out.write("\r\n")
+                    out.flush()
+                    last_write = now
+                    continue
+                wake = due if not self.keepalive else min(due, last_write + self.keepalive)
+                time.sleep(max(0, wake - now))
+
+            out.write(message)
+            out.messages += 1
+            with self._lock:
+                self.messages += 1
+            if out.buffered >= MAX_CHUNK:
+                out.flush()
+                last_write = time.time()
+
+    def start(self, host="127.0.0.1", port=DEFAULT_PORT):
+        """Serve on http://host:port in a background thread. Returns the port (useful if 'port' is
+        0, which picks a free one)."""
+        self._server = _ReplayServer((host, port), _ReplayHandler)
+        self._server.replay = self
+        thread = threading.Thread(target=self._server.serve_forever, name="replay-server")
+        thread.daemon = True
+        thread.start()
+        return self._server.server_address[1]
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def run():
+    """Main function: serves the messages until interrupted, printing how many have been sent every
+    few seconds."""
+
+    parser = argparse.ArgumentParser(description="Pretend to be twitter's streaming API")
+    parser.add_argument('files', nargs='*', type=str, \
+            help='capture files (.json or .json.gz) to replay (default: made-up tweets)')
+    parser.add_argument('--template', dest='template', type=str, default=synthetic.TEMPLATE_FILE, \
+            help='the tweets to make copies of when there are no files (default %(default)s)')
+    parser.add_argument('--repeat', dest='repeat', action="store_true", default=False, \
+            help='start the files again when they have all been sent')
+    parser.add_argument('-n', '--count', dest='count', type=int, default=None, \
+            help='stop after sending this many messages')
+    parser.add_argument('--host', dest='host', type=str, default="127.0.0.1", \
+            help='address to listen on (default %(default)s)')
+    parser.add_argument('-p', '--port', dest='port', type=int, default=DEFAULT_PORT, \
+            help='port to listen on (default %(default)s)')
+
+    # How fast to send
+    parser.add_argument('-r', '--rate', dest='rate', type=float, default=0, \
+            help='messages per second, 0 for as fast as the client can read them (default '+\
+                    '%(default)s)')
+    parser.add_argument('--burst_rate', dest='burst_rate', type=float, default=0, \
+            help='messages per second during a burst (0 for as fast as possible)')
+    parser.add_argument('--burst_every', dest='burst_every', type=float, default=0, \
+            help='seconds between the starts of bursts (default 0: no bursts)')
+    parser.add_argument('--burst_length', dest='burst_length', type=float, default=5, \
+            help='how long each burst lasts (seconds, default %(default)s)')
+    parser.add_argument('--keepalive', dest='keepalive', type=float, default=KEEPALIVE_INTERVAL, \
+            help='send a newline after this many seconds without a message, 0 for never '+\
+                    '(default %(default)s)')
+
+    # How to misbehave
+    parser.add_argument('--errors', nargs='+', dest='errors', type=int, default=[], \
+            help='HTTP statuses (e.g. 420 503) to refuse the first connections with, in turn')
+    parser.add_argument('--error_rate', dest='error_rate', type=float, default=0, \
+            help='chance (0 to 1) of refusing each later connection with a 420 or 503')
+    parser.add_argument('--seed', dest='seed', type=int, default=0, \
+            help='seed for the made-up tweets and --error_rate, so that runs can be repeated '+\
+                    '(default %(default)s)')
+    parser.add_argument('--disconnect_after', dest='disconnect_after', type=int, default=0, \
+            help='hang up half way through a message after sending this many on a connection')
+    parser.add_argument('--stall_after', dest='stall_after', type=int, default=0, \
+            help='go quiet (not even keep-alives) after sending this many messages on a connection')
+    parser.add_argument('--stall_for', dest='stall_for', type=float, default=120, \
+            help='how long to go quiet for (seconds, default %(default)s)')
+    parser.add_argument('--gzip', dest='gzip', action="store_true", default=False, \
+            help='gzip the stream if the client asks for it (--gzip_stream)')
+    parser.add_argument('--report', dest='report', type=float, default=10, \
+            help='print how many messages have been sent every this many seconds (default '+\
+                    '%(default)s)')
+    args = parser.parse_args()
+
+    for filename in args.files + ([] if args.files else [args.template]):
+        if not os.path.isfile(filename):
+            print "Error",filename,"doesn't look like a file."
+            sys.exit(1)
+    if args.files:
+        source = Source(lambda: read_captures(args.files), repeat=args.repeat, limit=args.count)
+    else:
+        source = Source(lambda: synthetic.TweetGenerator(args.template, seed=args.seed,
+            start=time.time()).messages(), limit=args.count)
+
+    server = ReplayServer(source, rate=args.rate, burst_rate=args.burst_rate,
+            burst_every=args.burst_every, burst_length=args.burst_length, keepalive=args.keepalive,
+            errors=args.errors, error_rate=args.error_rate, seed=args.seed,
+            disconnect_after=args.disconnect_after, stall_after=args.stall_after,
+            stall_for=args.stall_for, gzip=args.gzip)
+    port = server.start(args.host, args.port)
+    print "Serving the stream on http://{h}:{p}".format(h=args.host, p=port)
+    try:
+        last_count = 0
+        while True:
+            time.sleep(args.report)
+            count = server.messages
+            print "Sent {m} messages ({r:.0f}/s over the last {s}s), {c} connection(s) so far" \
+                    .format(m=count, r=(count - last_count) / args.report, s=args.report,
+                            c=server.connections)
+            last_count = count
+    except KeyboardInterrupt:
+        print "Stopping"
+    finally:
+        server.shutdown()
+        print "Sent {m} messages ({b:.1f}MB) over {c} connection(s)".format(m=server.messages,
+                b=server.bytes_sent / 1e6, c=server.connections)
+
+if __name__=="__main__":
+    run()
@@ -0,0 +1,133 @@
+# Policies that decide when the listener should stop writing to one file and start a new one. The
+# listener used to start a new file every 500,000 tweets, which is every few minutes for the firehose
+# sample but can be days for a small bounding box. Files can now also be rotated when they reach a
+# certain size or at regular times (e.g. on the hour), or whichever of these comes first.
+#
+# All times are UTC (the same as the 'created_at' field in the tweets).
+
+import os
+import time
+
+# Names that can be used for common intervals (seconds)
+INTERVALS = {
+        "minute": 60,
+        "hour": 60 * 60,
+        "day": 24 * 60 * 60,
+        }
+
+
+class RotationPolicy(object):
+    """Base class for rotation policies. start() is called whenever a new file is started and
+    should_rotate() is asked whether it is time for another new file."""
+
+    def start(self, now):
+        """Called when a new file is started at time 'now' (seconds since the epoch)."""
+        pass
+
+    def should_rotate(self, tweets, size, now):
+        """Return True if a new file should be started. 'tweets' and 'size' are the number of tweets
+        and bytes that have been written to the current file, and 'now' is the current time."""
+        raise NotImplementedError
+
+
+class CountRotation(RotationPolicy):
+    """Start a new file after a certain number of tweets."""
+
+    def __init__(self, max_tweets):
+        self.max_tweets = max_tweets
+
+    def should_rotate(self, tweets, size, now):
+        return tweets >= self.max_tweets
+
+
+class SizeRotation(RotationPolicy):
+    """Start a new file once the current one has had a certain number of bytes written to it.
+    (If tweets are compressed as they are written this is the uncompressed size)."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+
+    def should_rotate(self, tweets, size, now):
+        return size >= self.max_bytes
+
+
+class IntervalRotation(RotationPolicy):
+    """Start a new file at regular times. 'interval' is either a number of seconds or one of the
+    names in INTERVALS (e.g. "hour"). Rotation times are aligned to multiples of the interval since
+    the epoch (1970-01-01 00:00 UTC), so e.g. hourly files start on the hour and daily files at
+    midnight UTC, whenever the listener was started. (An interval that doesn't divide a day, e.g. 7
+    hours, won't line up with midnight)."""
+
+    def __init__(self, interval):
+        if interval in INTERVALS:
+            interval = INTERVALS[interval]
+        self.interval = float(interval)
+        self.next_rotation = None
+
+    def start(self, now):
+        # Work out the next boundary after 'now'
+        self.next_rotation = (int(now // self.interval) + 1) * self.interval
+
+    def should_rotate(self, tweets, size, now):
+        return self.next_rotation is not None and now >= self.next_rotation
+
+
+class AnyRotation(RotationPolicy):
+    """Combines other policies, starting a new file as soon as any one of them says so."""
+
+    def __init__(self, *policies):
+        self.policies = policies
+
+    def start(self, now):
+        for policy in self.policies:
+            policy.start(now)
+
+    def should_rotate(self, tweets, size, now):
+        for policy in self.policies:
+            if policy.should_rotate(tweets, size, now):
+                return True
+        return False
+
+
+def make_policy(tweets=None, size=None, interval=None):
+    """Create a policy from the command-line options. Any that are None are ignored, and if more
+    than one is given then the file is rotated when the first one is reached."""
+    policies = []
+    if tweets:
+        policies.append(CountRotation(tweets))
+    if size:
+        policies.append(SizeRotation(size))
+    if interval:
+        policies.append(IntervalRotation(interval))
+    if len(policies) == 1:
+        return policies[0]
+    return AnyRotation(*policies)
+
+
+def partition_dir(data_dir, partition, now):
+    """Work out the directory that a file started at time 'now' should go in, creating it if
+    necessary. 'partition' is a time.strftime() format (e.g. "%Y/%m/%d") for naming
+    sub-directories of 'data_dir', or None to put all files directly in 'data_dir'."""
+    if not partition:
+        return data_dir
+    directory = os.path.join(data_dir, time.strftime(partition, time.gmtime(now)))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    return directory
+
+
+def parse_size(text):
+    """Convert a size from the command line like '500M' or '2G' into a number of bytes."""
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}
+    text = text.strip().upper()
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def parse_interval(text):
+    """Convert an interval from the command line (either a name like 'hour' or a number of seconds)
+    into something that IntervalRotation understands."""
+    if text in INTERVALS:
+        return text
+    return float(text)
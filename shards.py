@@ -0,0 +1,271 @@
+# Runs one capture over several connections to twitter. Each filtered connection can only track a
+# limited number of words (400), follow a limited number of users (5000) and listen to a limited
+# number of bounding boxes (25), and some lists (e.g. the election words) are getting too long for
+# one connection. Here the words, users and boxes are shared out between as many connections
+# ('shards') as are needed, each one using its own credentials, and everything they receive is
+# written to one data directory. A tweet that matches words in more than one shard arrives more than
+# once, so the duplicates are removed by the usual dedup filter (see dedup.py) before writing.
+#
+# The words, users and boxes can be given on the command line or in files (one per line; a box is
+# four numbers: minx miny maxx maxy). When the files change (or the process gets a SIGHUP) the
+# shards are rebalanced: words that have gone are removed from their shard, new words are added to
+# shards with room, and only the shards whose lists have changed are switched to new connections
+# (without a gap, see reconfigure.py).
+#
+# Usage, e.g.:
+#
+#   python shards.py --track_file election-words.txt -c cred1.ini cred2.ini cred3.ini
+#
+# (Twitter only allows one connection at a time for each set of credentials, so there must be at
+# least as many credentials files as shards).
+
+import os
+import sys
+import time
+
+import streaming
+import metrics
+import reconfigure
+from pipeline import MergingListener
+from multicapture import CHECK_INTERVAL
+
+# The most of each sort of filter that one connection can have
+MAX_TRACK = 400
+MAX_FOLLOW = 5000
+MAX_LOCATIONS = 25 # (Bounding boxes)
+LIMITS = {"track": MAX_TRACK, "follow": MAX_FOLLOW, "locations": MAX_LOCATIONS}
+KINDS = reconfigure.KINDS
+
+
+def plan_shards(shards, wanted, limits=LIMITS):
+    """Share out the 'wanted' filters (a dict of kind -> list, e.g. {"track": [...]}) between
+    shards, each having at most 'limits' of each kind. 'shards' is the current plan (a list of dicts
+    like 'wanted'), which is changed as little as possible: filters that are no longer wanted are
+    removed, new ones go in the first shard with room (a new shard is added if there isn't one) and
+    shards that end up empty are dropped. If the shards could be packed into fewer connections then
+    everything is shared out again from scratch. Returns the new plan."""
+    needed = max([1] + [-(-len(wanted.get(kind) or []) // limits[kind]) for kind in KINDS])
+    if len(shards) > needed:
+        shards = [] # (Start again rather than keep connections that are no longer needed)
+
+    wanted_sets = dict((kind, set(wanted.get(kind) or [])) for kind in KINDS)
+    new_shards = []
+    for shard in shards:
+        new_shards.append(dict((kind, [f for f in shard.get(kind, []) if f in wanted_sets[kind]])
+            for kind in KINDS))
+    for kind in KINDS:
+        placed = set(f for shard in new_shards for f in shard[kind])
+        for f in wanted.get(kind) or []:
+            if f in placed:
+                continue
+            placed.add(f)
+            for shard in new_shards:
+                if len(shard[kind]) < limits[kind]:
+                    break
+            else:
+                shard = dict((k, []) for k in KINDS)
+                new_shards.append(shard)
+            shard[kind].append(f)
+    return [shard for shard in new_shards if any(shard[kind] for kind in KINDS)]
+
+
+def _in_common(filters, other):
+    """The number of words, users and boxes that two sets of filters have in common."""
+    return sum(len(set(filters.get(kind) or []) & set(other.get(kind) or [])) for kind in KINDS)
+
+
+class Shard(reconfigure.Supervised):
+    """One connection to twitter, filtering by some of the words, users and boxes, using the
+    credentials in 'auth'. The stream is read in its own thread, and restarted if it stops (see
+    reconfigure.Supervised)."""
+
+    def __init__(self, name, filters, auth, merger, stream_options, capture_metrics=None):
+        # (filters is like {"track": [...], "follow": [...], "locations": [(x,y,x,y), ...]})
+        reconfigure.Supervised.__init__(self, "shard {n}".format(n=name), filters)
+        self.name = name
+        self.auth = auth
+        self.merger = merger
+        self.stream_options = stream_options
+        self.capture_metrics = capture_metrics
+
+    def _connection(self, filters):
+        return reconfigure.Connection(self.label, self.auth, self.merger, filters,
+                capture_metrics=self.capture_metrics, **self.stream_options)
+
+
+class ShardedFilter(object):
+    """Filters the stream by any number of words, users and boxes, using as many shards as are
+    needed. 'auths' is a list of OAuthHandlers (one for each shard that there might be) and
+    'listener' gets the messages from all of the shards. Call update() to change the filters.
+    'capture_metrics' (optional) counts the bytes received by all of the shards."""
+
+    def __init__(self, auths, listener, limits=LIMITS, capture_metrics=None, **stream_options):
+        self.auths = auths
+        self.merger = MergingListener(listener)
+        self.limits = limits
+        self.capture_metrics = capture_metrics
+        self.stream_options = stream_options
+        self.shards = []
+        self._next_name = 1
+
+    def update(self, track=None, follow=None, locations=None):
+        """Change the filters, switching only the shards whose filters have changed to new
+        connections. 'locations' is a list of (minx, miny, maxx, maxy) boxes. Raises ValueError if
+        there aren't enough credentials for the number of shards needed."""
+        wanted = {"track": list(track or []), "follow": list(follow or []),
+                "locations": [tuple(box) for box in locations or []]}
+        plan = plan_shards([shard.filters for shard in self.shards], wanted, self.limits)
+        if len(plan) > len(self.auths):
+            raise ValueError("Need {n} shards but only have {c} credentials".format(n=len(plan),
+                c=len(self.auths)))
+
+        # Shards whose filters haven't changed are left alone. Each of the other entries in the plan
+        # is taken by the old shard that has the most filters in common with it, which switches to
+        # it without a gap (there are only new shards if there are more entries than old shards)
+        shards = [None] * len(plan)
+        old = list(self.shards)
+        for i, filters in enumerate(plan):
+            for shard in old:
+                if shard.filters == filters:
+                    shards[i] = shard
+                    old.remove(shard)
+                    break
+        pairs = sorted((-_in_common(plan[i], shard.filters), i, j) for i in range(len(plan))
+                if shards[i] is None for j, shard in enumerate(old))
+        for _, i, j in pairs:
+            if shards[i] is None and old[j] is not None:
+                shards[i] = old[j]
+                old[j] = None
+        retired = [shard for shard in old if shard is not None]
+
+        switched = True
+        for shard, filters in zip(shards, plan):
+            if shard is not None and filters != shard.filters:
+                print "Changing shard {n} to {d}".format(n=shard.name, d=reconfigure.describe(filters))
+                shard.switch(filters)
+                switched = switched and shard.filters == filters
+        used = set(id(shard.auth) for shard in shards if shard is not None)
+        spare = [auth for auth in self.auths if id(auth) not in used]
+        for i, filters in enumerate(plan):
+            if shards[i] is None:
+                shards[i] = Shard(self._next_name, filters, spare.pop(0), self.merger,
+                        self.stream_options, self.capture_metrics)
+                self._next_name += 1
+                shards[i].start()
+
+        # Only now that the other shards have taken over their filters can the shards that are no
+        # longer needed be stopped. (If a shard couldn't switch then they are kept for now, and are
+        # planned again next time)
+        if switched:
+            for shard in retired:
+                print "Shard {n} is no longer needed".format(n=shard.name)
+                shard.stop()
+        else:
+            shards.extend(retired)
+        print "Filtering with {n} shard(s): {s}".format(n=len(shards),
+                s="; ".join("{n}: {d}".format(n=s.name, d=s.describe()) for s in shards))
+        self.shards = shards
+
+    def check(self, now):
+        """Restart any shards that have stopped. Returns False if they have all given up."""
+        return bool([shard for shard in self.shards if shard.check(now)])
+
+    def stop(self):
+        for shard in self.shards:
+            shard.stop()
+
+    def close(self):
+        self.merger.close()
+
+
+def read_filters(args):
+    """The words, users and boxes from the command-line options and the files they name (see
+    reconfigure.read_filters())."""
+    filters = reconfigure.read_filters(words=args.words, follow=args.follow, locs=args.locs,
+            track_file=args.track_file, follow_file=args.follow_file,
+            locations_file=args.locations_file)
+    return filters["track"], filters["follow"], filters["locations"]
+
+
+def run():
+    """Main function: reads the filters and credentials, starts the shards, and keeps them going
+    (rebalancing them when the files change) until interrupted."""
+
+    parser = streaming.make_parser(filter_options=False,
+            description="Filter the stream over several connections")
+    parser.add_argument('-w', nargs='+', dest='words', type=str, default=None, \
+            help='word(s) to search the stream for')
+    parser.add_argument('--track_file', dest='track_file', type=str, default=None, \
+            help='file of words to search the stream for (one per line)')
+    parser.add_argument('-f', '--follow', nargs='+', dest='follow', type=str, default=None, \
+            help='id(s) of users to follow')
+    parser.add_argument('--follow_file', dest='follow_file', type=str, default=None, \
+            help='file of ids of users to follow (one per line)')
+    parser.add_argument('-l', nargs='+', dest='locs', type=float, default=None, \
+            help='bounding box(es) to listen to, four numbers each (minx miny maxx maxy)')
+    parser.add_argument('--locations_file', dest='locations_file', type=str, default=None, \
+            help='file of bounding boxes to listen to (one per line, minx miny maxx maxy)')
+    parser.add_argument('-c', nargs='+', dest='cred', type=str, \
+            default=[streaming.credentials_file], \
+            help='credentials file(s), one for each shard that might be needed')
+    parser.add_argument('-d', '--data_dir', dest='data_dir', type=str, default="data", \
+            help='directory to store tweets in (default %(default)s)')
+    args = parser.parse_args()
+
+    for cred in args.cred:
+        if not os.path.isfile(cred):
+            print "Error",cred,"doesn't look like a file. See the README for details."
+            sys.exit(1)
+    try:
+        track, follow, locations = read_filters(args)
+    except (IOError, ValueError) as e:
+        print "Error:", e
+        sys.exit(1)
+    if not (track or follow or locations):
+        print "Error: no words (-w, --track_file), users (-f, --follow_file) or locations (-l, "+\
+                "--locations_file) have been specified. So I don't know what to do!"
+        parser.print_help()
+        sys.exit(1)
+    if not args.dedup_capacity:
+        print "Warning: tweets that match more than one shard will be written more than once "+\
+                "(because --dedup_capacity is 0)"
+
+    capture_metrics = None
+    if args.metrics_port is not None: # (0 means any free port)
+        capture_metrics = metrics.CaptureMetrics(capture=args.data_dir)
+        metrics.start_server(capture_metrics.registry, args.metrics_port)
+
+    listener = streaming.make_listener(args, args.data_dir, capture_metrics=capture_metrics)
+    sharded = ShardedFilter([streaming.read_auth(cred) for cred in args.cred], listener,
+            capture_metrics=capture_metrics,
+            **streaming.stream_options(args))
+
+    try:
+        try:
+            sharded.update(track, follow, locations)
+        except ValueError as e:
+            print "Error:", e
+            sys.exit(1)
+        trigger = reconfigure.ReloadTrigger([args.track_file, args.follow_file,
+            args.locations_file])
+        while True:
+            time.sleep(CHECK_INTERVAL)
+            now = time.time()
+            if trigger.due():
+                print "Rebalancing the shards"
+                try:
+                    sharded.update(*read_filters(args))
+                except (IOError, ValueError) as e:
+                    print "Error: could not rebalance the shards ({e}), keeping the old ones" \
+                            .format(e=e)
+            if not sharded.check(now):
+                print "All of the shards have stopped, giving up."
+                break
+    except KeyboardInterrupt:
+        print "Stopping shards"
+    finally:
+        sharded.stop()
+        sharded.close()
+
+if __name__=="__main__":
+    run()
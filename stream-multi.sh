@@ -0,0 +1,2 @@
+# Starts all of the captures described in captures.ini in one process (see captures-example.ini)
+python multicapture.py captures.ini
@@ -1,4 +1,4 @@
-from tweepy.streaming import StreamListener
+from tweepy.streaming import StreamListener, KEEPALIVE_INTERVAL
 from tweepy import OAuthHandler
 from tweepy import Stream
 import configparser # for reading the configuration file
@@ -7,9 +7,21 @@ import sys
 import json # For converting string into json object
 import argparse # For parsing command-line arguments
 import time # For adding a timestamp to files
-import gzip # For compressing files
 import traceback # For printing the traceback when errors occur
-from multiprocessing import Process # For compressing files in separate threads
+import threading # For checking whether files need rotating in the background
+import urlparse # For reading --stream_url
+from writer import BufferedTweetWriter, GzipTweetWriter, DEFAULT_FLUSH_BYTES, DEFAULT_FLUSH_INTERVAL, \
+        DEFAULT_COMPRESS_LEVEL
+# For working out what messages are quickly
+from messages import classify_message, message_type, TWEET, DELETE, INVALID
+from compression import CompressionPool, QUEUE_FILENAME, DEFAULT_WORKERS # For compressing files
+import rotation # For deciding when to start new files
+import pipeline # For reading from the stream and writing to disk in different threads
+import reconfigure # For changing the words/locations without stopping
+import dedup # For removing duplicate tweets
+import ledger # For saving 'delete' messages
+import metrics # For reporting what the listener is doing
+from quarantine import QuarantineSink, QUARANTINE_FILENAME # For messages that aren't tweets
 
 
 # add your details
@@ -22,6 +34,9 @@ access_token_secret=""
 credentials_file = "./credentials.ini" # Assume in local directory
 TWEETS_PER_FILE = 500000 # Number of tweets to store before creating a new file
 #TWEETS_PER_FILE = 5000 # Number of tweets to store before creating a new file
+ROTATION_CHECK_INTERVAL = 10 # How often to check whether a file needs rotating when it is quiet (s)
+RELOAD_CHECK_INTERVAL = 1 # How often to check whether the words/locations files have changed (s)
+STALL_TIMEOUT = 3 * KEEPALIVE_INTERVAL # Reconnect after missing this many seconds of keep-alives
 
 class StdOutListener(StreamListener):
     """ A listener handles tweets are the received from the stream.
@@ -40,54 +55,163 @@ class FileWriterListener(StreamListener):
     A listener handles tweets are the received from the stream, writing them to a file.
     """
 
-    def __init__(self, data_dir="data"):
+    def __init__(self, data_dir="data", flush_bytes=DEFAULT_FLUSH_BYTES,
+            flush_interval=DEFAULT_FLUSH_INTERVAL, full_parse=False, compressor=None,
+            compress_on_write=False, compress_level=DEFAULT_COMPRESS_LEVEL, rotation_policy=None,
+            partition=None, dedup_filter=None, delete_ledger=None, capture_metrics=None,
+            quarantine=None, shared_compressor=False):
         """Optional 'data_dir' argument specifies the data directory to store tweets in. This dir
         must exist - it is not added automatically because you will probably want to exclude it from
-        the git project."""
+        the git project.
+        'flush_bytes' and 'flush_interval' control how much data (bytes) and for how long (seconds)
+        tweets are buffered in memory before being written to disk.
+        If 'full_parse' is True then every message is decoded with json.loads, otherwise messages
+        are classified by looking at the first few bytes and only unusual ones are decoded.
+        'compressor' is the CompressionPool used to compress old files. If not given, a pool with
+        one worker is created. If 'shared_compressor' is True then the pool is also used by other
+        listeners (see multicapture.py) so close() doesn't close it.
+        If 'compress_on_write'' is True then tweets are compressed (with gzip level
+        'compress_level') as they are written, rather than compressing whole files afterwards. In
+        this case no CompressionPool is needed.
+        'rotation_policy' decides when to start a new file (see rotation.py). By default a new file
+        is started every TWEETS_PER_FILE tweets. 'partition' is an optional time.strftime() format
+        for putting files in sub-directories by time, e.g. "%Y/%m/%d" (UTC).
+        'dedup_filter' (e.g. a dedup.RollingBloomFilter) is used to spot tweets that have already
+        been written (twitter often sends them again after reconnecting). None to keep them all.
+        'delete_ledger' is a ledger.DeleteLedgerWriter for saving 'delete' messages alongside each
+        tweet file. If None then deletes are just counted.
+        'capture_metrics' is a metrics.CaptureMetrics to record what the listener is doing in (e.g.
+        to serve to prometheus). None to not bother.
+        'quarantine' is a QuarantineSink for messages that aren't tweets or deletes (e.g. invalid
+        json, or 'limit' notices). If None then one is created in the data directory."""
 
         self.json_filename = ""  # Name of the file that tweets are being written to
         self.csv_filename = ""   # (will be tXX where XX is the timestamp in seconds)
         self.counter = 0 # Count the number of tweets
         self.delete_count = 0 # Count the nmber of 'delete' messages received (these aren't tweets)
+        self.file_tweets = 0 # Number of tweets written to the current file
+        self.file_bytes = 0 # Number of bytes written to the current file
+        self.duplicate_count = 0 # Count the number of duplicate tweets (not written)
 
         self.data_dir=data_dir # The directory to store tweet data in
-
-    def compress_file(self, old_filename):
-        """Compress the file with all twitter data in using gzip, deleting the original."""
-
-        new_filename = old_filename+".gz" 
-        print "Attempting to compres json file {f} and creating {f2}. (Counter={c})".format(\
-                c=self.counter, f=old_filename, f2=new_filename)
-        with open( old_filename, 'rb') as oldfile, gzip.open(new_filename, 'wb') as zipfile:
-            zipfile.writelines(oldfile)
-            os.remove(old_filename)
-            print "\tFinished compressing file {f}, created file {f2}".format(\
-                    f=oldfile.name,f2=zipfile.name)
-
+        self.full_parse = full_parse # Whether to decode every message or just the unusual ones
+        self.compress_on_write = compress_on_write # Whether to write straight to .json.gz files
+        self.partition = partition # How to name sub-directories of data_dir (None for no sub-dirs)
+        self.dedup_filter = dedup_filter # Remembers recent tweet ids (None to not check)
+        self.delete_ledger = delete_ledger # Saves deletes (None to ignore them)
+        self.metrics = capture_metrics # Records message counts, timings etc (None to not record)
+
+        # Somewhere to put messages that aren't tweets or deletes
+        if quarantine is None:
+            quarantine = QuarantineSink(os.path.join(data_dir, QUARANTINE_FILENAME),
+                    flush_bytes=flush_bytes, flush_interval=flush_interval)
+        self.quarantine = quarantine
+
+        # Decide when to start new files
+        if rotation_policy is None:
+            rotation_policy = rotation.CountRotation(TWEETS_PER_FILE)
+        self.rotation_policy = rotation_policy
+
+        # Compresses files in the background once they are finished with. The queue of files is
+        # saved in the data directory so that none get missed if the listener is restarted.
+        # (Do this before starting the writer's thread so that the workers don't copy it).
+        if compressor is None and not compress_on_write:
+            compressor = CompressionPool(queue_file=os.path.join(data_dir, QUEUE_FILENAME))
+        self.compressor = compressor
+        self.shared_compressor = shared_compressor
+
+        # (Rotation can happen in on_data or in a background thread when the stream is quiet)
+        self._rotation_lock = threading.Lock()
+        self._rotation_thread = None
+        self._stopped = threading.Event()
+
+        # Keeps the current file open and writes tweets out in batches
+        if compress_on_write:
+            self.writer = GzipTweetWriter(level=compress_level, flush_bytes=flush_bytes,
+                    flush_interval=flush_interval)
+        else:
+            self.writer = BufferedTweetWriter(flush_bytes=flush_bytes, flush_interval=flush_interval)
+
+    def check_rotation(self, now=None):
+        """Start a new file if there isn't one yet or if the rotation policy says it is time."""
+        if now is None:
+            now = time.time()
+        with self._rotation_lock:
+            if self.rotation_due(now):
+                self.rotate(now)
+
+    def rotation_due(self, now, tweets=0, size=0):
+        """Whether a new file is needed before writing another tweet, once 'tweets' more tweets
+        ('size' bytes) have been written to the current file."""
+        return self.json_filename == "" or self.rotation_policy.should_rotate(
+                self.file_tweets + tweets, self.file_bytes + size, now)
+
+    def rotate(self, now):
+        """Start writing to a new file and compress the old one. (Call check_rotation() rather than
+        this, it makes sure that two files aren't started at the same time)."""
+
+        old_filename = self.json_filename
+
+        ts = int(now * 1000) # Append timestamp to files
+        #self.json_filename = "data/t"+ts+".json"
+        #self.csv_filename = "data/t"+ts+".csv"
+        directory = rotation.partition_dir(self.data_dir, self.partition, now)
+        # (Files can be rotated more than once a millisecond when they are small, so make sure that
+        # the name hasn't been used already)
+        while True:
+            self.json_filename = os.path.join(directory, "t"+str(ts)+".json")
+            if self.compress_on_write:
+                self.json_filename += ".gz" # (Already compressed, so doesn't need doing later)
+            if self.json_filename != old_filename and not os.path.exists(self.json_filename):
+                break
+            ts += 1
+        self.csv_filename =  os.path.join(directory, "t"+str(ts)+".csv")
+
+        print "Writing to files:", self.json_filename, self.csv_filename
+
+        # Start writing to the new file. This also flushes and closes the old one, so it is
+        # complete before it gets compressed.
+        self.writer.open(self.json_filename)
+        if self.delete_ledger is not None:
+            # (This also sorts the old file's deletes into its ledger)
+            self.delete_ledger.open(os.path.join(directory, "t"+str(ts)))
+        self.rotation_policy.start(now)
+        old_tweets = self.file_tweets
+        self.file_tweets = 0
+        self.file_bytes = 0
+
+        # Compress the old filename (only to json, not csv) (and not when the script starts).
+        # This is done by a separate process so as not to stop listenning in the meantime
+        if old_filename != "" and self.compressor is not None:
+            print "Queueing json file {f} for compression. ({n} tweets, Counter={c})".format(\
+                    f=old_filename, n=old_tweets, c=self.counter)
+            self.compressor.submit(old_filename)
+
+        # Make sure that files get rotated on time even if no tweets are arriving
+        if self._rotation_thread is None:
+            self._rotation_thread = threading.Thread(target=self._rotation_loop,
+                    name="rotation-check")
+            self._rotation_thread.daemon = True
+            self._rotation_thread.start()
+
+    def _rotation_loop(self):
+        """Runs in the background checking whether the current file needs rotating (e.g. because
+        it's a new hour) when the stream is too quiet for on_data() to notice."""
+        while not self._stopped.wait(ROTATION_CHECK_INTERVAL):
+            self.check_rotation()
 
     def on_data(self, raw_data):
         """Function called when the StreamReader (parent class) receives data from the stream. This
         function handles writing out the twitter data, compressing large files, etc"""
 
-        # See if a new file needs to be created for these tweets
-        if self.counter % TWEETS_PER_FILE == 0:
-
-            old_filename = self.json_filename
-
-            ts = str(int(time.time() * 1000) ) # Append timestamp to files
-            #self.json_filename = "data/t"+ts+".json"
-            #self.csv_filename = "data/t"+ts+".csv"
-            self.json_filename = os.path.join(self.data_dir, "t"+ts+".json")
-            self.csv_filename =  os.path.join(self.data_dir, "t"+ts+".csv")
+        metrics = self.metrics
+        if metrics is not None:
+            start = time.time()
+            metrics.received(len(raw_data))
 
-            print "Writing to files:", self.json_filename, self.csv_filename
-
-            # Compress the old filename (only to json, not csv) (and not when the script starts).
-            # This is done in separate thread so as not to stop listenning in the meantime
-            if self.counter > 0:
-                p = Process(target=self.compress_file, args=(old_filename,))
-                p.start()
-                #self.compress_file(old_filename)
+        # Make sure there is a file to write to (write_tweet() starts new ones when needed)
+        if self.json_filename == "":
+            self.check_rotation()
 
         # Call the parent (StreamReader) function which does some error checking, returning False if
         # this isn't a tweet.
@@ -95,32 +219,54 @@ class FileWriterListener(StreamListener):
         #    print "This doesn't look like a tweet"
         #    return False
 
+        # 0 - (the quick way) work out what the message is from the first few bytes. Tweets and
+        # deletes are by far the most common messages so deal with them here. Anything else is
+        # decoded properly below.
+        if not self.full_parse:
+            msg_type, tweetid = classify_message(raw_data)
+            if metrics is not None:
+                metrics.observe("classify", time.time() - start)
+            if msg_type == TWEET:
+                if metrics is not None:
+                    metrics.message(msg_type)
+                self.write_tweet(raw_data, tweetid)
+                return True
+            elif msg_type == DELETE:
+                if metrics is not None:
+                    metrics.message(msg_type)
+                self.count_delete(raw_data)
+                return True
+
+        self.handle_unusual(raw_data)
+        return True
+
+    def handle_unusual(self, raw_data):
+        """Handle a message that couldn't be classified quickly (or any message if 'full_parse' is
+        set) by decoding all of it."""
+        metrics = self.metrics
+
         # 1 - use json library to create a python dictionary object from the raw data (a 
         # json-formatter string). This can be then be interrogated to find info. about the tweet.
         try:
             data = json.loads(raw_data)
         except ValueError as e:
-            print "****\nCaught a ValueError:",str(e),"Wont try to parse the data."
-            print "The raw_data is:**\n\t",raw_data,"**"
-            print "The trackback is:"
-            print traceback.format_exc()
-            print "****"
-            # Can't continue with this invalid data.
-            return True
+            if metrics is not None:
+                metrics.message(INVALID)
+            # Can't continue with this invalid data. Put it to one side.
+            self.quarantine.add(INVALID, raw_data, "ValueError: "+str(e))
+            return
+
+        msg_type = message_type(data)
+        if metrics is not None:
+            metrics.message(msg_type)
 
         # 2 - get the id (e.g. data['id'] )
 
         try:
             tweetid = str(data['id'])
             #print "read tweet",tweetid
-            # 3 - write to a file (with filename of tweet id)
-            f = open(self.json_filename,'a')
-            try:
-                f.write(raw_data) # 
-            finally:
-                f.close()
-
-            self.counter += 1 # Increment tweet counter
+            # 3 - write to the file (buffered, it wont necessarily reach the disk straight away)
+            self.write_tweet(raw_data, data['id'])
 
             # 4 - TODO extract ueful info and write to a csv file
 
@@ -128,30 +274,173 @@ class FileWriterListener(StreamListener):
             #with open('data/'+tweetid,'w') as f:
             #    f.write(str(data))
 
-        except KeyError as e:
+        except (KeyError, TypeError) as e:
             # There is no ID field, so the data probably isn't a tweet. Need to decide what to do
+            # (TypeError means it wasn't even a json object).
+
+            if msg_type == DELETE: # Looks like a 'delete' message. Ignore it
+                self.count_delete(raw_data)
+
+            else: # Not a tweet (e.g. a 'limit' notice) or don't know what it is. Put it to one side.
+                self.quarantine.add(msg_type, raw_data, "No 'id' field ({e})".format(
+                    e=e.__class__.__name__))
+
+    def on_batch(self, frames):
+        """Handle a list of messages at once (e.g. from a pipeline.QueuedListener). The messages are
+        all classified first and then the tweets are written out together (see write_tweets())."""
+        if self.full_parse:
+            return StreamListener.on_batch(self, frames)
+
+        metrics = self.metrics
+        if metrics is not None:
+            start = time.time()
+            metrics.received(sum(len(raw_data) for raw_data in frames))
+
+        if self.json_filename == "":
+            self.check_rotation()
+
+        tweets = [] # The (non-duplicate) tweets to write
+        for raw_data in frames:
+            msg_type, tweetid = classify_message(raw_data)
+            if msg_type == TWEET:
+                if metrics is not None:
+                    metrics.message(msg_type)
+                if not self.is_duplicate(tweetid):
+                    tweets.append(raw_data)
+            elif msg_type == DELETE:
+                if metrics is not None:
+                    metrics.message(msg_type)
+                self.count_delete(raw_data)
+            else:
+                self.handle_unusual(raw_data)
+        if metrics is not None:
+            metrics.observe("classify_batch", time.time() - start)
+
+        self.write_tweets(tweets)
+        return True
 
-            if 'delete' in data: # Looks like a 'delete' message. Ignore it
-                self.delete_count += 1
-                if self.delete_count % (TWEETS_PER_FILE/100) == 0:
-                    print "For info: have received {num} delete messages. (These have been ignored).".format(num=self.delete_count)
-
-            else: # Don't know what's wrong, write the message out to a separate file.
-                print "Caught error receiving tweet: ", str(e) # Show what the error was
-                # Call the file 'error<time>.json'
-                fname = os.path.join(self.data_dir,"error"+str(int(time.time() * 1000) )+".json")
-                print "\tNot sure what the problem is. Will write data to a different file called ",fname 
-                f = open(fname,'w')
-                try:
-                    f.write(raw_data)
-                finally:
-                    f.close()
-
+    def write_tweet(self, raw_data, tweetid):
+        """Write a tweet to the current file (unless it's a duplicate)."""
+        if self.is_duplicate(tweetid):
+            return
+        # (Only start a new file when there is a tweet to go in it)
+        self.check_rotation()
+        metrics = self.metrics
+        if metrics is not None:
+            start = time.time()
+        self.writer.write(raw_data)
+
+        self.counter += 1 # Increment tweet counter
+        self.file_tweets += 1
+        self.file_bytes += len(raw_data)
+        if metrics is not None:
+            metrics.written()
+            metrics.observe("write", time.time() - start)
+
+    def write_tweets(self, tweets):
+        """Write a list of tweets (that have already been checked for duplicates) in as few writes as
+        possible. The rotation policy is asked before each tweet, the same as when they are written
+        one at a time, so a batch that reaches the policy's limit is split between files."""
+        if not tweets:
+            return
+        now = time.time()
+        first = 0 # The first tweet that hasn't been written yet
+        size = 0 # (Bytes in the tweets from 'first' onwards that have been checked)
+        for i, raw_data in enumerate(tweets):
+            if self.rotation_due(now, i - first, size):
+                self._write_run(tweets[first:i])
+                self.check_rotation(now)
+                first = i
+                size = 0
+            size += len(raw_data)
+        self._write_run(tweets[first:])
+
+    def _write_run(self, tweets):
+        """Write some tweets to the current file in one go."""
+        if not tweets:
+            return
+        metrics = self.metrics
+        if metrics is not None:
+            start = time.time()
+        data = "".join(tweets)
+        self.writer.write(data)
+
+        self.counter += len(tweets)
+        self.file_tweets += len(tweets)
+        self.file_bytes += len(data)
+        if metrics is not None:
+            metrics.written(len(tweets))
+            metrics.observe("write_batch", time.time() - start)
+
+    def is_duplicate(self, tweetid):
+        """Check whether a tweet has been seen recently, counting the duplicates."""
+        if self.dedup_filter is None or not self.dedup_filter.seen(tweetid):
+            return False
+        self.duplicate_count += 1
+        if self.metrics is not None:
+            self.metrics.duplicate()
+        if self.duplicate_count % (TWEETS_PER_FILE/100) == 1:
+            print "For info: have received {num} duplicate tweets. (These have been ignored).".format(num=self.duplicate_count)
         return True
 
+    def count_delete(self, raw_data):
+        """Remember that a 'delete' message has been received, saving it to the ledger (if there
+        is one) and printing the count occasionally."""
+        self.delete_count += 1
+        if self.delete_ledger is not None:
+            try:
+                self.delete_ledger.add(*ledger.parse_delete(raw_data))
+            except (ValueError, KeyError, TypeError) as e:
+                print "Could not save a delete message to the ledger ({e}): {d}".format(\
+                        e=str(e), d=raw_data)
+        if self.delete_count % (TWEETS_PER_FILE/100) == 0:
+            print "For info: have received {num} delete messages. ({what}).".format(\
+                    num=self.delete_count, what="These have been ignored" \
+                            if self.delete_ledger is None else "These are in the ledger")
+
+    def on_connect(self):
+        if self.metrics is not None:
+            self.metrics.connected()
+
     def on_error(self, status):
         print "ERROR: ", str(status)
-
+        if self.metrics is not None:
+            self.metrics.error(status)
+
+    def on_timeout(self):
+        print "Timed out waiting for data from twitter, will reconnect"
+        if self.metrics is not None:
+            self.metrics.error("timeout")
+
+    def on_timings(self, timings):
+        """Print (and record) how long it took to start receiving tweets after (re)connecting."""
+        gap = "" if timings.gap is None else ", {g:.1f}s since the last connection closed".format(
+                g=timings.gap)
+        print ("Connected: first message after {f:.2f}s (connect {c}, TLS {t}, response {r}), "+\
+                "backed off for {b:.1f}s{g}").format(f=timings.first_frame,
+                c=_seconds(timings.connect), t=_seconds(timings.tls), r=_seconds(timings.response),
+                b=timings.backoff, g=gap)
+        if self.metrics is not None:
+            self.metrics.connection_timings(timings)
+
+    def close(self):
+        """Write out any tweets that are still buffered, close the current file and wait for any
+        files that are being compressed. Should be called when the program is shutting down."""
+        self._stopped.set()
+        print "Closing. Wrote {n} tweets, ignored {d} duplicates, received {x} deletes.".format(\
+                n=self.counter, d=self.duplicate_count, x=self.delete_count)
+        with self._rotation_lock:
+            self.writer.close()
+            if self.delete_ledger is not None:
+                self.delete_ledger.close()
+            self.quarantine.close()
+        if self.compressor is not None and not self.shared_compressor:
+            self.compressor.close()
+
+
+
+def _seconds(seconds):
+    return "-" if seconds is None else "{s:.2f}s".format(s=seconds)
 
 
 def check_locations(locs):
@@ -167,30 +456,219 @@ def check_locations(locs):
         sys.exit(1)
 
 
-def run():
-    """Main munction: parses command-line options and starts the listener""" 
-    global credentials_file
-    
-    # Parse command-line options
-    parser = argparse.ArgumentParser()
+def make_parser(filter_options=True, **kwargs):
+    """Create the parser for the command-line options. (Also used by multicapture.py to read the
+    options for each capture from its configuration file). If 'filter_options' is False then the
+    options saying what to listen to (-l, -w, -c and -s) are left out, so that another program
+    (e.g. shards.py) can add its own. Other arguments are passed to the ArgumentParser."""
+
+    parser = argparse.ArgumentParser(**kwargs)
 #    (description='Usage %prog -l <locations> [-c <credentials_file]')
 
+    if not filter_options:
+        _add_capture_options(parser)
+        return parser
+
     # Can specify a bounding box
     parser.add_argument('-l', nargs=4, dest='locs', type=float, required=False, default=None, \
             help='specify min/max coordinates of bounding box (minx miny maxx maxy)')
-    
+
+    _add_capture_options(parser)
+
     # Or can search for particular words 
     parser.add_argument('-w', nargs='+', dest='words', type=str, required=False, default=None, \
             help='specify word(s) to search the stream for')
 
+    # Or read the words and/or bounding boxes from files (re-read if they change, or on a SIGHUP)
+    parser.add_argument('--track_file', dest='track_file', type=str, default=None, \
+            help='file of word(s) to search the stream for (one per line)')
+    parser.add_argument('--locations_file', dest='locations_file', type=str, default=None, \
+            help='file of bounding boxes to listen to (one per line: minx miny maxx maxy)')
+
     # The location of the credentials file
-    parser.add_argument('-c', nargs=1, dest='cred', type=str, required=False, \
+    parser.add_argument('-c', dest='cred', type=str, required=False, \
             help='specify location of credentials file', default=credentials_file)
 
     # Optionally get the sample of tweets from the firehose (not spatial)
     parser.add_argument('-s', '--sample', dest='sample', action="store_true", default=False,
         help="Get the 1 percent sample of tweets from the firehose (a random sample, no filtering)")
 
+    return parser
+
+
+def _add_capture_options(parser):
+    """Add the options for how tweets are written to disk (everything except what to listen to)."""
+
+    # Control how tweets are buffered before being written to disk
+    parser.add_argument('--flush_bytes', dest='flush_bytes', type=int, default=DEFAULT_FLUSH_BYTES, \
+            help='write buffered tweets to disk once there are this many bytes (default %(default)s)')
+    parser.add_argument('--flush_interval', dest='flush_interval', type=float, \
+            default=DEFAULT_FLUSH_INTERVAL, \
+            help='maximum number of seconds to buffer tweets before writing to disk (default %(default)s)')
+
+    # Whether to decode every message (slow) or only the ones that aren't tweets or deletes
+    parser.add_argument('--full_parse', dest='full_parse', action="store_true", default=False, \
+            help='decode every message with json.loads rather than just looking at the start of it')
+
+    # How many files can be compressed at the same time
+    parser.add_argument('--compress_workers', dest='compress_workers', type=int, \
+            default=DEFAULT_WORKERS, \
+            help='number of processes to use for compressing old files (default %(default)s)')
+
+    # Compress tweets as they are written rather than compressing whole files afterwards
+    parser.add_argument('-z', '--compress_on_write', dest='compress_on_write', action="store_true", \
+            default=False, help='write tweets straight to compressed (.json.gz) files')
+    parser.add_argument('--compress_level', dest='compress_level', type=int, \
+            default=DEFAULT_COMPRESS_LEVEL, \
+            help='gzip level to use with --compress_on_write, 1 (fastest) to 9 (smallest) '+\
+                    '(default %(default)s)')
+
+    # When to start new files, and whether to put them in sub-directories by time
+    parser.add_argument('--rotate_tweets', dest='rotate_tweets', type=int, default=TWEETS_PER_FILE, \
+            help='start a new file after this many tweets, 0 for no limit (default %(default)s)')
+    parser.add_argument('--rotate_size', dest='rotate_size', type=rotation.parse_size, default=None, \
+            help='start a new file after this many bytes, e.g. 500M or 2G')
+    parser.add_argument('--rotate_every', dest='rotate_every', type=rotation.parse_interval, \
+            default=None, \
+            help="start new files at regular times: 'minute', 'hour', 'day' or a number of seconds")
+    parser.add_argument('--partition', dest='partition', type=str, default=None, \
+            help="put files in sub-directories named by (UTC) time, e.g. '%%Y/%%m/%%d'")
+
+    # The queue between reading from the stream and writing to disk
+    parser.add_argument('--queue_size', dest='queue_size', type=int, \
+            default=pipeline.DEFAULT_QUEUE_SIZE, \
+            help='number of messages that can wait to be written to disk, 0 to write them in the '+\
+                    'same thread that reads the stream (default %(default)s)')
+    parser.add_argument('--queue_policy', dest='queue_policy', choices=pipeline.POLICIES, \
+            default=pipeline.BLOCK, \
+            help='what to do when the queue is full: wait for space, or drop the newest or oldest '+\
+                    'message (default %(default)s)')
+
+    # Passing messages from the stream to the listener in batches
+    parser.add_argument('--batch_size', dest='batch_size', type=int, default=0, \
+            help='pass up to this many messages at a time from the stream to the listener, 0 to '+\
+                    'pass them one at a time (default %(default)s)')
+    parser.add_argument('--batch_interval', dest='batch_interval', type=float, default=0.1, \
+            help='longest time (seconds) to wait to fill a batch (default %(default)s)')
+
+    # Ask twitter to compress the stream (uses several times less bandwidth, but more CPU)
+    parser.add_argument('--gzip_stream', dest='gzip_stream', action="store_true", default=False, \
+            help='have twitter send the stream gzip-compressed, and decompress it as it arrives')
+
+    # Connect to something other than twitter, e.g. a replay server (see replay.py)
+    parser.add_argument('--stream_url', dest='stream_url', type=str, default=None, \
+            help='where to connect to instead of twitter, e.g. http://127.0.0.1:8765')
+
+    # How long the stream can be silent before it is assumed to have stalled and is reconnected
+    # (twitter sends a keep-alive every 30 seconds, so a few of those)
+    parser.add_argument('--stall_timeout', dest='stall_timeout', type=float, \
+            default=STALL_TIMEOUT, \
+            help='reconnect if nothing (not even a keep-alive) arrives for this many seconds '+\
+                    '(default %(default)s)')
+
+    # How many recent tweet ids to remember when checking for duplicates
+    parser.add_argument('--dedup_capacity', dest='dedup_capacity', type=int, \
+            default=dedup.DEFAULT_CAPACITY, \
+            help='remember this many recent tweet ids (at least) to remove duplicates, 0 to keep '+\
+                    'duplicates (default %(default)s)')
+
+    # Whether to save 'delete' messages
+    parser.add_argument('--no_delete_ledger', dest='no_delete_ledger', action="store_true", \
+            default=False, help="don't save 'delete' messages (they are just counted)")
+
+    # Serve metrics (for prometheus) on a local port
+    parser.add_argument('--metrics_port', dest='metrics_port', type=int, default=None, \
+            help='serve metrics about the listener on http://localhost:PORT/metrics (0 for any '+\
+                    'free port, the one chosen is printed)')
+
+
+def read_auth(credentials_file):
+    """Read the twitter authentication stuff from the configuration file (see README for details)
+    and return an OAuthHandler. Exits if the credentials can't be read."""
+    try:
+        config = configparser.ConfigParser()
+        config.read(credentials_file)
+
+        consumer_key=str(config.get('CREDENTIALS','consumer_key'))
+        consumer_secret=str(config.get('CREDENTIALS','consumer_secret'))
+        access_token=str(config.get('CREDENTIALS','access_token'))
+        access_token_secret=str(config.get('CREDENTIALS','access_token_secret'))
+
+    except:
+        print "Error reading credentials from", credentials_file
+        print traceback.format_exc()
+        sys.exit(0)
+
+    auth = OAuthHandler(consumer_key, consumer_secret)
+    auth.set_access_token(access_token, access_token_secret)
+    return auth
+
+
+def make_listener(args, data_dir, compressor=None, capture_metrics=None, name="writer"):
+    """Create the listener that writes tweets to 'data_dir', using the command-line options in
+    'args'. 'compressor' and 'capture_metrics' can be shared between listeners (see
+    multicapture.py). Unless the queue is turned off, the listener is wrapped in a QueuedListener
+    (called 'name') so that writing to disk happens in a different thread to reading the stream."""
+
+    shared_compressor = compressor is not None
+    if compressor is None and not args.compress_on_write:
+        compressor = CompressionPool(workers=args.compress_workers,
+                queue_file=os.path.join(data_dir, QUEUE_FILENAME))
+        if capture_metrics is not None:
+            capture_metrics.gauge("twitter_compression_backlog",
+                    "Files waiting to be compressed", compressor.backlog)
+
+    l = FileWriterListener(data_dir=data_dir, flush_bytes=args.flush_bytes,
+            flush_interval=args.flush_interval, full_parse=args.full_parse,
+            compressor=None if args.compress_on_write else compressor,
+            compress_on_write=args.compress_on_write, compress_level=args.compress_level,
+            rotation_policy=rotation.make_policy(tweets=args.rotate_tweets, size=args.rotate_size,
+                interval=args.rotate_every),
+            partition=args.partition,
+            dedup_filter=dedup.RollingBloomFilter(args.dedup_capacity) if args.dedup_capacity else None,
+            delete_ledger=None if args.no_delete_ledger else ledger.DeleteLedgerWriter(
+                flush_bytes=args.flush_bytes, flush_interval=args.flush_interval),
+            capture_metrics=capture_metrics, shared_compressor=shared_compressor)
+    # Put a queue between the stream and the listener so that delays writing to disk don't stop the
+    # stream being read.
+    if args.queue_size > 0:
+        l = pipeline.QueuedListener(l, max_size=args.queue_size, policy=args.queue_policy,
+                name=name, capture_metrics=capture_metrics)
+    return l
+
+
+def stream_options(args):
+    """The options for tweepy's Stream from the command-line options."""
+    options = dict(batch_size=args.batch_size, batch_interval=args.batch_interval,
+            stall_timeout=args.stall_timeout, compression=args.gzip_stream)
+    if args.stream_url:
+        url = urlparse.urlsplit(args.stream_url)
+        options.update(host=url.hostname, port=url.port, secure=url.scheme != "http")
+    return options
+
+
+def has_filters(args):
+    """Whether the command-line options say what to filter the stream by."""
+    return args.locs is not None or args.words is not None or bool(args.track_file) or \
+            bool(args.locations_file)
+
+
+def read_filters(args):
+    """The words and bounding boxes to filter by (see reconfigure.read_filters()), from the
+    command-line options and the --track_file and --locations_file files, or None for the sample
+    stream."""
+    if args.sample:
+        return None
+    return reconfigure.read_filters(words=args.words, locs=args.locs, track_file=args.track_file,
+            locations_file=args.locations_file)
+
+
+def run():
+    """Main munction: parses command-line options and starts the listener""" 
+    global credentials_file
+    
+    # Parse command-line options
+    parser = make_parser()
     args = parser.parse_args()
 
     # Check the location of the credentials file
@@ -200,8 +678,8 @@ def run():
     credentials_file = args.cred
 
     # Check that there is something to do!
-    if args.locs == None and args.words == None and args.sample == False:
-        print "Error: no locations (-l) or keywords (-w) have been specified, nor has the"+\
+    if not has_filters(args) and args.sample == False:
+        print "Error: no locations (-l, --locations_file) or keywords (-w, --track_file) have been specified, nor has the"+\
             "'sample' flag been set (-s). So I don't know what to do!"
         parser.print_help()
         sys.exit(0)
@@ -218,44 +696,38 @@ def run():
     # Choose a default directory to store messages in ('data' if storing tweets extraxted using
     # locations or keywords, 'firehose' if listenning to the firehose)
     data_dir = ""
-    if args.locs != None or args.words != None:
+    if has_filters(args):
         data_dir = "data"
     elif args.sample:
         data_dir = "firehose" 
 
 
     # Read the twitter authentication stuff from the configuration file (see README for details).
-    try:
-        config = configparser.ConfigParser()
-        config.read(credentials_file)
+    auth = read_auth(credentials_file)
 
-        consumer_key=str(config.get('CREDENTIALS','consumer_key'))
-        consumer_secret=str(config.get('CREDENTIALS','consumer_secret'))
-        access_token=str(config.get('CREDENTIALS','access_token'))
-        access_token_secret=str(config.get('CREDENTIALS','access_token_secret'))
+    # Keep track of what the listener is doing, if the user wants to see it
+    capture_metrics = None
+    if args.metrics_port is not None: # (0 means any free port)
+        capture_metrics = metrics.CaptureMetrics(capture=data_dir)
+        metrics.start_server(capture_metrics.registry, args.metrics_port)
 
-    except:
-        print "Error reading credentials from", credentials_file
-        print traceback.format_exc()
-        sys.exit(0)
-
-    auth = OAuthHandler(consumer_key, consumer_secret)
-    auth.set_access_token(access_token, access_token_secret)
-
-    l = FileWriterListener(data_dir=data_dir)
-    stream = Stream(auth, l)
+    l = make_listener(args, data_dir, capture_metrics=capture_metrics)
+    stream = Stream(auth, l, **stream_options(args))
+    if capture_metrics is not None and args.sample:
+        capture_metrics.watch_stream(stream)
+    connection = None # (The connection used when filtering, which can be replaced on a reload)
 
     try:
         
         if args.sample: # User specified get the random sample of tweets from firehose
             print "Starting firehose sample listener"
-            if args.locs != None or args.words != None:
+            if has_filters(args):
                 print "Warning: both sample (-s) and locations (-l) or words (-w) have been specified. "+\
                         "I'm ignoring the locations/words and getting tweets from the firehose."
             count = 0 # Sometimes get an IncompleteRead exception. Catch this and continue
             while count < 5:
                 try:
-                    stream.sample()
+                    stream.sample(stall_warnings=True)
                 except:
                     print "****\nReceived an exception listenning to twitter firehose."
                     print "This is error number: ",(count+1),"will reconnect and continue"
@@ -280,13 +752,48 @@ def run():
                 words = args.words
 
             
+            if args.track_file != None or args.locations_file != None:
+                print "\tand the words/locations in:",args.track_file or "",args.locations_file or ""
+
             l = StdOutListener()
 
-            stream.filter(locations=locations,track=words)
+            # Filter the stream, and whenever the files of words/locations change (or on a SIGHUP)
+            # switch to a new connection with the new filter (see reconfigure.py)
+            try:
+                filters = read_filters(args)
+            except (IOError, ValueError) as e:
+                print "Error reading the words/locations:", e
+                sys.exit(1)
+            trigger = reconfigure.ReloadTrigger([args.track_file, args.locations_file])
+            merger = pipeline.MergingListener(stream.listener)
+            connection = reconfigure.Connection("stream", auth, merger, filters,
+                    capture_metrics=capture_metrics, **stream_options(args))
+            connection.start()
+            while connection.is_running():
+                time.sleep(RELOAD_CHECK_INTERVAL)
+                if not trigger.due():
+                    continue
+                try:
+                    new_filters = read_filters(args)
+                except (IOError, ValueError) as e:
+                    print "Error reading the new words/locations ({e}), carrying on with the old ones"\
+                            .format(e=e)
+                    continue
+                if new_filters == connection.filters:
+                    print "Reload requested but the words/locations haven't changed"
+                    continue
+                print "Reloading with", reconfigure.describe(new_filters)
+                new_connection = reconfigure.Connection("stream", auth, merger, new_filters,
+                        capture_metrics=capture_metrics, **stream_options(args))
+                if reconfigure.handover(connection, new_connection):
+                    connection = new_connection
 
 
     finally:
+        if connection is not None:
+            connection.stop()
         stream.disconnect()
+        stream.listener.close() # (l might have been replaced, so use the one the stream has)
 
 if __name__=="__main__":
     run()
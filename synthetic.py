@@ -0,0 +1,330 @@
+# Makes up any number of realistic tweets for load and regression testing (e.g. of json2csv.py, or of
+# the listener with replay.py), so that benchmarks can use a big input that anyone can make again
+# rather than sharing real data. Each tweet is a copy of one of the tweets in egtweet.json with new
+# ids, times, users, text and (for some) coordinates, so it has all the fields that twitter sends, in
+# the same order. How the tweets vary can be changed on the command line:
+#
+#   - how many have coordinates, and the bounding boxes that they are in (e.g. the UK, or Leeds)
+#   - how many different users there are, and how much more some of them tweet than others (a Zipf
+#     distribution: the most active user tweets twice as often as the second, three times as often
+#     as the third, and so on)
+#   - how many are retweets, and how many of the messages are delete notices (for earlier tweets)
+#   - the average length of the text, and how many tweets have emoji in them
+#
+# The same seed (and options) always gives exactly the same messages. The output is one message per
+# line (compressed if the filename ends in .gz, like the files that streaming.py writes) or, with
+# '--framed', in the format that the stream uses (each message preceded by its length). Usage, e.g.:
+#
+#   python synthetic.py -n 1000000 -o synthetic.json.gz -l -10 50 2 60 -2.17 53.52 -1.20 53.9
+#   python json2csv.py synthetic.json.gz ...
+
+import argparse
+import bisect
+import collections
+import gzip
+import json
+import math
+import os
+import random
+import sys
+import time
+
+TEMPLATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "egtweet.json")
+START = 1462795566 # Time (epoch seconds) of the first made-up tweet (when egtweet.json was sent)
+TWITTER_EPOCH_MS = 1288834974657 # Tweet ids count milliseconds from here (see _tweet_id())
+USER_ID_BASE = 100000000 # The made-up users have ids from here
+RECENT = 10000 # How many recent tweets a delete notice can be for
+PLACE_SIZE = 0.1 # Size (degrees) of the made-up places that geotagged tweets are in
+UK = (-10, 50, 2, 60) # (The same boxes as stream-uk.sh and stream-leeds.sh)
+LEEDS = (-2.17, 53.52, -1.20, 53.9)
+
+WORDS = ("the be to of and a in that have I it for not on with he as you do at this but his by from "
+        "they we say her she or an will my one all would there their what so up out if about who get "
+        "which go me when make can like time no just him know take people into year your good some "
+        "could them see other than then now look only come its over think also back after use two how "
+        "our work first well way even new want because any these give day most us leeds london rain "
+        "sunny weekend tonight tea match football train bus home coffee lol omg love happy great "
+        "morning night today tomorrow amazing party").split()
+EMOJI = [u"\U0001F602", u"\U0001F60D", u"\u2764\ufe0f", u"\U0001F62D", u"\U0001F60A", u"\U0001F44D",
+        u"\U0001F525", u"\U0001F64F", u"\U0001F436", u"\U0001F64A", u"\u2600\ufe0f", u"\U0001F389"]
+
+
+def read_templates(template_file=TEMPLATE_FILE):
+    """The tweets in 'template_file' (one per line), keeping their fields in the same order."""
+    with open(template_file) as f:
+        return [json.loads(line, object_pairs_hook=collections.OrderedDict) for line in f
+                if line.strip()]
+
+
+def zipf_weights(n, exponent):
+    """The cumulative weights for picking one of 'n' things with a Zipf distribution (thing k is
+    picked in proportion to 1/k^exponent)."""
+    total = 0.0
+    cumulative = []
+    for k in range(1, n+1):
+        total += 1.0 / k ** exponent
+        cumulative.append(total)
+    return cumulative
+
+
+def _copy(tweet):
+    return json.loads(json.dumps(tweet), object_pairs_hook=collections.OrderedDict)
+
+
+class _Template(object):
+    """A template tweet, with copies of it for a retweet (with a 'retweeted_status' field, in the
+    place that twitter puts it) and for the tweet that was retweeted (without a 'timestamp_ms')."""
+
+    def __init__(self, tweet):
+        self.tweet = tweet
+        self.retweet = collections.OrderedDict()
+        for key, value in _copy(tweet).items():
+            if key == "is_quote_status":
+                self.retweet["retweeted_status"] = None
+            self.retweet[key] = value
+        self.retweet.setdefault("retweeted_status", None)
+        self.original = _copy(tweet)
+        self.original.pop("timestamp_ms", None)
+
+
+class TweetGenerator(object):
+    """Makes up messages (json strings) from the tweets in 'template_file': tweets, retweets and
+    delete notices, arriving at an average of 'rate' per second from 'start'. The other options are
+    the same as the command-line options (see run()); 'boxes' is a list of (minx, miny, maxx, maxy).
+    The same 'seed' always gives the same messages."""
+
+    def __init__(self, template_file=TEMPLATE_FILE, seed=0, start=START, rate=50,
+            geo_fraction=0.02, boxes=(UK,), users=100000, zipf=1.0, retweet_fraction=0.3,
+            delete_fraction=0.02, text_length=70, emoji_fraction=0.2):
+        self.templates = [_Template(tweet) for tweet in read_templates(template_file)]
+        self.rate = rate
+        self.geo_fraction = geo_fraction
+        self.boxes = [tuple(box) for box in boxes]
+        self.retweet_fraction = retweet_fraction
+        self.delete_fraction = delete_fraction
+        self.text_length = text_length
+        self.emoji_fraction = emoji_fraction
+        self.counts = collections.Counter() # Messages made so far, by kind
+        self.now = start
+        self._random = random.Random(seed)
+        self._users = zipf_weights(users, zipf)
+        self._statuses = collections.Counter() # Tweets by each user so far
+        self._recent = [] # (id, user id) of recent tweets, for delete notices
+        self._sequence = 0
+        self._places = {}
+        self._place = next((t.tweet["place"] for t in self.templates if t.tweet.get("place")), None)
+
+    def messages(self, count=None):
+        """Make 'count' messages (or never stop, if None)."""
+        made = 0
+        while count is None or made < count:
+            yield self.next_message()
+            made += 1
+
+    def next_message(self):
+        self.now += self._random.expovariate(self.rate)
+        if self._recent and self._random.random() < self.delete_fraction:
+            self.counts["delete"] += 1
+            return self._delete()
+        template = self._random.choice(self.templates)
+        if self._random.random() < self.retweet_fraction:
+            self.counts["retweet"] += 1
+            tweet = self._retweet(template)
+        else:
+            self.counts["tweet"] += 1
+            tweet = self._fill(template.tweet, self.now, self._text())
+        return json.dumps(tweet, separators=(",", ":"))
+
+    def _tweet_id(self, t):
+        # (Like twitter's ids, the milliseconds since twitter's epoch followed by 22 more bits, so
+        # that later tweets have bigger ids)
+        self._sequence += 1
+        return ((int(t * 1000) - TWITTER_EPOCH_MS) << 22) | (self._sequence & 0x3fffff)
+
+    def _pick_user(self):
+        r = self._random.random() * self._users[-1]
+        return bisect.bisect_left(self._users, r) + 1 # (1 is the most active user)
+
+    def _fill_user(self, user, k):
+        self._statuses[k] += 1
+        user_id = USER_ID_BASE + k
+        user["id"] = user_id
+        user["id_str"] = str(user_id)
+        user["name"] = "Synthetic User {k}".format(k=k)
+        user["screen_name"] = "synth{k}".format(k=k)
+        # (The most active users have the most followers)
+        user["followers_count"] = int(100000 / k) + k % 97
+        user["friends_count"] = k % 1000
+        user["statuses_count"] = self._statuses[k]
+        user["created_at"] = time.strftime("%a %b %d %H:%M:%S +0000 %Y",
+                time.gmtime(START - k * 86400 % (8 * 365 * 86400)))
+        return user_id
+
+    def _text(self, limit=140):
+        r = self._random
+        length = int(min(limit, max(1, r.gauss(self.text_length, self.text_length / 2.0))))
+        words = []
+        used = 0
+        while used < length:
+            word = r.choice(WORDS)
+            words.append(word)
+            used += len(word) + 1
+        if r.random() < self.emoji_fraction:
+            for i in range(r.randint(1, 3)):
+                words.insert(r.randint(0, len(words)), r.choice(EMOJI))
+        return u" ".join(words)[:length].rstrip()
+
+    def _place_for(self, lon, lat):
+        """A made-up place (a PLACE_SIZE square) containing a point."""
+        x, y = int(math.floor(lon / PLACE_SIZE)), int(math.floor(lat / PLACE_SIZE))
+        place = self._places.get((x, y))
+        if place is None:
+            place = collections.OrderedDict(self._place or ())
+            place_id = "{x:04x}{y:04x}".format(x=x & 0xffff, y=y & 0xffff)
+            place["id"] = place_id
+            place["url"] = "https://api.twitter.com/1.1/geo/id/{i}.json".format(i=place_id)
+            place["place_type"] = "city"
+            place["name"] = "Place {x},{y}".format(x=x, y=y)
+            place["full_name"] = place["name"]
+            minx, miny = x * PLACE_SIZE, y * PLACE_SIZE
+            maxx, maxy = minx + PLACE_SIZE, miny + PLACE_SIZE
+            place["bounding_box"] = collections.OrderedDict([("type", "Polygon"), ("coordinates",
+                [[[minx, miny], [minx, maxy], [maxx, maxy], [maxx, miny]]])])
+            self._places[(x, y)] = place
+        return place
+
+    def _fill(self, tweet, t, text, mentions=()):
+        """Fill in the fields of a template tweet for a new tweet sent at time 't'."""
+        r = self._random
+        tweet_id = self._tweet_id(t)
+        tweet["created_at"] = time.strftime("%a %b %d %H:%M:%S +0000 %Y", time.gmtime(t))
+        tweet["id"] = tweet_id
+        tweet["id_str"] = str(tweet_id)
+        tweet["text"] = text
+        for key in ("in_reply_to_status_id", "in_reply_to_status_id_str", "in_reply_to_user_id",
+                "in_reply_to_user_id_str", "in_reply_to_screen_name"):
+            tweet[key] = None
+        user_id = self._fill_user(tweet["user"], self._pick_user())
+        if r.random() < self.geo_fraction:
+            self.counts["geo"] += 1
+            minx, miny, maxx, maxy = r.choice(self.boxes)
+            lon, lat = round(r.uniform(minx, maxx), 8), round(r.uniform(miny, maxy), 8)
+            tweet["geo"] = collections.OrderedDict([("type", "Point"), ("coordinates", [lat, lon])])
+            tweet["coordinates"] = collections.OrderedDict([("type", "Point"),
+                ("coordinates", [lon, lat])])
+            tweet["place"] = self._place_for(lon, lat)
+        else:
+            tweet["geo"] = tweet["coordinates"] = tweet["place"] = None
+        tweet["entities"] = collections.OrderedDict([("hashtags", []), ("urls", []),
+            ("user_mentions", list(mentions)), ("symbols", [])])
+        if "timestamp_ms" in tweet:
+            tweet["timestamp_ms"] = str(int(t * 1000))
+
+        if len(self._recent) < RECENT:
+            self._recent.append((tweet_id, user_id))
+        else:
+            self._recent[r.randrange(RECENT)] = (tweet_id, user_id)
+        return tweet
+
+    def _retweet(self, template):
+        r = self._random
+        # The retweeted tweet was sent earlier (usually in the last hour or so)
+        original = self._fill(template.original, self.now - r.expovariate(1 / 3600.0),
+                self._text())
+        original["retweet_count"] = r.randint(1, 1000)
+        user = original["user"]
+        prefix = u"RT @{s}: ".format(s=user["screen_name"])
+        mention = collections.OrderedDict([("screen_name", user["screen_name"]),
+            ("name", user["name"]), ("id", user["id"]), ("id_str", user["id_str"]),
+            ("indices", [3, 3 + len(user["screen_name"])])])
+        retweet = self._fill(template.retweet, self.now, (prefix + original["text"])[:140],
+                mentions=[mention])
+        retweet["retweeted_status"] = original
+        return retweet
+
+    def _delete(self):
+        status_id, user_id = self._recent[self._random.randrange(len(self._recent))]
+        return ('{{"delete":{{"status":{{"id":{i},"id_str":"{i}","user_id":{u},"user_id_str":"{u}"}},'
+                '"timestamp_ms":"{t}"}}}}').format(i=status_id, u=user_id, t=int(self.now * 1000))
+
+
+def run():
+    """Main function: makes up the messages and writes them to a file (or stdout)."""
+
+    parser = argparse.ArgumentParser(description="Make up tweets for testing")
+    parser.add_argument('-n', '--count', dest='count', type=int, default=100000, \
+            help='number of messages to make (default %(default)s)')
+    parser.add_argument('-o', '--output', dest='output', type=str, default="-", \
+            help='file to write them to, compressed if it ends in .gz (default: stdout)')
+    parser.add_argument('--framed', dest='framed', action="store_true", default=False, \
+            help='write them as the stream sends them (delimited=length) rather than one per line')
+    parser.add_argument('--seed', dest='seed', type=int, default=0, \
+            help='the same seed always makes the same messages (default %(default)s)')
+    parser.add_argument('--template', dest='template', type=str, default=TEMPLATE_FILE, \
+            help='the tweets to make copies of (default %(default)s)')
+    parser.add_argument('--start', dest='start', type=float, default=START, \
+            help='time of the first message (epoch seconds, default %(default)s)')
+    parser.add_argument('--rate', dest='rate', type=float, default=50, \
+            help='average messages per second (default %(default)s)')
+    parser.add_argument('--geo_fraction', dest='geo_fraction', type=float, default=0.02, \
+            help='fraction of tweets with coordinates (default %(default)s)')
+    parser.add_argument('-l', nargs='+', dest='locs', type=float, default=list(UK), \
+            help='bounding box(es) for the coordinates, four numbers each (minx miny maxx maxy, '+\
+                    'default the UK)')
+    parser.add_argument('--users', dest='users', type=int, default=100000, \
+            help='number of different users (default %(default)s)')
+    parser.add_argument('--zipf', dest='zipf', type=float, default=1.0, \
+            help='how unevenly the users tweet, 0 for all the same (default %(default)s)')
+    parser.add_argument('--retweet_fraction', dest='retweet_fraction', type=float, default=0.3, \
+            help='fraction of tweets that are retweets (default %(default)s)')
+    parser.add_argument('--delete_fraction', dest='delete_fraction', type=float, default=0.02, \
+            help='fraction of messages that are delete notices (default %(default)s)')
+    parser.add_argument('--text_length', dest='text_length', type=int, default=70, \
+            help='average length of the text (default %(default)s)')
+    parser.add_argument('--emoji_fraction', dest='emoji_fraction', type=float, default=0.2, \
+            help='fraction of tweets with emoji in the text (default %(default)s)')
+    args = parser.parse_args()
+
+    if len(args.locs) % 4 != 0:
+        print >> sys.stderr, "Error: the bounding boxes (-l) must be four numbers each"
+        sys.exit(1)
+    boxes = [args.locs[i:i+4] for i in range(0, len(args.locs), 4)]
+    if not os.path.isfile(args.template):
+        print >> sys.stderr, "Error",args.template,"doesn't look like a file."
+        sys.exit(1)
+
+    generator = TweetGenerator(args.template, seed=args.seed, start=args.start, rate=args.rate,
+            geo_fraction=args.geo_fraction, boxes=boxes, users=args.users, zipf=args.zipf,
+            retweet_fraction=args.retweet_fraction, delete_fraction=args.delete_fraction,
+            text_length=args.text_length, emoji_fraction=args.emoji_fraction)
+    if args.output == "-":
+        out = sys.stdout
+    elif args.output.endswith(".gz"):
+        # (No file name or time in the header, so the same messages always give the same file)
+        out = gzip.GzipFile(filename="", mode='wb', fileobj=open(args.output, 'wb'), mtime=0)
+    else:
+        out = open(args.output, 'wb')
+
+    start = time.time()
+    try:
+        for message in generator.messages(args.count):
+            if args.framed:
+                # (The same as replay.frame())
+                out.write("{n}\r\n{m}\r\n".format(n=len(message) + 2, m=message))
+            else:
+                out.write(message + "\n")
+    finally:
+        if out is not sys.stdout:
+            fileobj = getattr(out, "fileobj", None)
+            out.close()
+            if fileobj is not None:
+                fileobj.close()
+
+    # (To stderr, so it doesn't end up in the output if that is stdout)
+    counts = generator.counts
+    print >> sys.stderr, ("Made {n} messages in {s:.1f}s: {t} tweets, {r} retweets, {d} deletes, "+
+            "{g} with coordinates").format(n=args.count, s=time.time() - start, t=counts["tweet"],
+            r=counts["retweet"], d=counts["delete"], g=counts["geo"])
+
+if __name__=="__main__":
+    run()
@@ -0,0 +1,555 @@
+# Tweepy
+# Copyright 2009-2010 Joshua Roesslein
+# See LICENSE for details.
+
+"""
+Streams that share one thread.
+
+Stream runs each connection in its own thread with blocking sockets.
+AsyncStream has the same filter(), sample(), firehose() etc. methods
+but its connection is a non-blocking socket driven by an EventLoop, so
+one thread can read dozens of streams:
+
+    loop = EventLoop()
+    for auth, listener, words in captures:
+        AsyncStream(auth, listener, loop=loop).filter(track=words)
+    loop.run()
+
+The listener methods are called in the loop's thread, so they must not
+block for long (a slow listener holds up every stream on the loop). A
+listener's on_data() may instead be a generator function: it is run as
+a coroutine on the loop, and each value it yields is a number of
+seconds to sleep (None for "let the others run") before carrying on.
+"""
+
+import errno
+import heapq
+import logging
+import os
+import select
+import socket
+import ssl
+import threading
+import time
+import types
+import zlib
+from collections import deque
+
+from tweepy.streaming import Stream, ConnectionTimings, DECOMPRESS_WBITS
+from tweepy.error import TweepError
+
+READ_SIZE = 65536  # most to read from a socket at once
+
+# socket errors meaning "try again when the socket is ready"
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINPROGRESS)
+
+
+class _Timer(object):
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __lt__(self, other):
+        return self.when < other.when
+
+
+class EventLoop(object):
+    """Calls functions when sockets are ready or timers expire.
+
+    Everything runs in the thread that calls run(). call_soon() is the
+    only method that is safe to call from other threads.
+    """
+
+    def __init__(self, max_wait=1.0):
+        self.max_wait = max_wait  # longest time to wait in select()
+        self.running = False
+        self._readers = {}
+        self._writers = {}
+        self._timers = []
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._wake_read, self._wake_write = os.pipe()
+        self._thread = None
+
+    def add_reader(self, fd, callback):
+        self._readers[fd] = callback
+
+    def remove_reader(self, fd):
+        self._readers.pop(fd, None)
+
+    def add_writer(self, fd, callback):
+        self._writers[fd] = callback
+
+    def remove_writer(self, fd):
+        self._writers.pop(fd, None)
+
+    def call_later(self, delay, callback, *args):
+        """Call callback(*args) in delay seconds. Returns a timer with a cancel() method."""
+        timer = _Timer(time.time() + delay, callback, args)
+        heapq.heappush(self._timers, timer)
+        return timer
+
+    def call_soon(self, callback, *args):
+        """Call callback(*args) from the loop's thread as soon as possible."""
+        with self._lock:
+            self._pending.append((callback, args))
+        if self._thread is not threading.current_thread():
+            os.write(self._wake_write, 'x')
+
+    def spawn(self, generator):
+        """Run a generator as a coroutine (see the module docstring)."""
+        self.call_soon(self._step, generator)
+
+    def _step(self, generator):
+        try:
+            delay = next(generator)
+        except StopIteration:
+            return
+        except Exception:
+            logging.exception("Exception in coroutine")
+            return
+        self.call_later(delay or 0, self._step, generator)
+
+    def stop(self):
+        """Make run() return (can be called from any thread)."""
+        self.call_soon(self._stop)
+
+    def _stop(self):
+        self.running = False
+
+    def _call(self, callback, args):
+        try:
+            callback(*args)
+        except Exception:
+            logging.exception("Exception in event loop callback")
+
+    def run(self):
+        """Run until stop() is called."""
+        self._thread = threading.current_thread()
+        self.running = True
+        while self.running:
+            with self._lock:
+                pending, self._pending = self._pending, deque()
+            for callback, args in pending:
+                self._call(callback, args)
+            if not self.running:
+                break
+
+            wait = self.max_wait
+            if pending or self._pending:
+                wait = 0
+            elif self._timers:
+                wait = max(0, min(wait, self._timers[0].when - time.time()))
+            try:
+                readable, writable, _ = select.select(
+                    list(self._readers) + [self._wake_read], list(self._writers), [], wait)
+            except select.error as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+
+            if self._wake_read in readable:
+                os.read(self._wake_read, 4096)
+            for fd in writable:
+                callback = self._writers.get(fd)
+                if callback is not None:
+                    self._call(callback, ())
+            for fd in readable:
+                callback = self._readers.get(fd)
+                if callback is not None:
+                    self._call(callback, ())
+
+            now = time.time()
+            while self._timers and self._timers[0].when <= now:
+                timer = heapq.heappop(self._timers)
+                if not timer.cancelled:
+                    self._call(timer.callback, timer.args)
+        self._thread = None
+
+    def close(self):
+        os.close(self._wake_read)
+        os.close(self._wake_write)
+
+
+class AsyncStream(Stream):
+    """A Stream whose connection is driven by an EventLoop.
+
+    filter(), sample() etc. return straight away (whatever the async
+    argument) and the stream runs when the loop does. Reconnecting
+    follows the same rules as Stream: retry_time (doubling up to
+    retry_time_cap) after an HTTP error, at least retry_420 after a 420,
+    and snooze_time (growing by snooze_time each time) after a timeout or
+    when the connection is dropped while reading.
+    """
+
+    def __init__(self, auth, listener, loop, **options):
+        Stream.__init__(self, auth, listener, **options)
+        self.loop = loop
+        if self.port is None:
+            self.port = 443 if self.scheme == "https" else 80
+        self.exception = None  # the exception that stopped the stream, if any
+        self._sock = None
+        self._connected = False  # whether the connection got a 200 response
+        self._sent = None  # when the request was sent
+        self._timeout_timer = None
+        self._retry_timer = None
+        self._error_counter = 0
+        self._read_timeout = self.timeout  # (stall_timeout once connected)
+        self._reset()
+
+    def _reset(self):
+        self._out = ''
+        self._in = bytearray()  # raw data from the socket
+        self._body = bytearray()  # de-chunked data
+        self._status = None
+        self._chunked = False
+        self._chunk_left = None
+        self._decompressor = None  # (if the response is compressed)
+
+    def _start(self, async):
+        self.running = True
+        self.loop.call_soon(self._connect)
+
+    def disconnect(self):
+        if self.running is False:
+            return
+        self.running = False
+        self.loop.call_soon(self._close)
+
+    # Connecting
+
+    def _connect(self):
+        if not self.running:
+            return
+        if self.retry_count is not None and self._error_counter > self.retry_count:
+            self._stop()
+            return
+        self._reset()
+        self._read_timeout = self.timeout
+        self._timings = ConnectionTimings()
+        self._timings.started = time.time()
+        try:
+            self.auth.apply_auth("%s://%s%s" % (self.scheme, self.host, self.url),
+                                 'POST', self.headers, self.parameters)
+            # (The name lookup blocks, but is normally cached by the OS)
+            family, socktype, proto, _, address = socket.getaddrinfo(
+                self.host, self.port, 0, socket.SOCK_STREAM)[0]
+            self._sock = socket.socket(family, socktype, proto)
+            self._sock.setblocking(0)
+            err = self._sock.connect_ex(address)
+            if err not in (0,) + _WOULD_BLOCK:
+                raise socket.error(err, os.strerror(err))
+        except Exception as exc:
+            self._fail(exc)
+            return
+        self._reset_timeout()
+        self.loop.add_writer(self._sock.fileno(), self._on_connected)
+
+    def _on_connected(self):
+        self.loop.remove_writer(self._sock.fileno())
+        err = self._sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            self._fail(socket.error(err, os.strerror(err)))
+            return
+        self._timings.connect = time.time() - self._timings.started
+        if self.scheme == "https":
+            context = ssl._create_default_https_context()
+            self._sock = context.wrap_socket(self._sock, server_hostname=self.host,
+                                             do_handshake_on_connect=False)
+            self._handshake()
+        else:
+            self._send_request()
+
+    def _handshake(self):
+        fd = self._sock.fileno()
+        self.loop.remove_reader(fd)
+        self.loop.remove_writer(fd)
+        try:
+            self._sock.do_handshake()
+        except ssl.SSLWantReadError:
+            self.loop.add_reader(fd, self._handshake)
+            return
+        except ssl.SSLWantWriteError:
+            self.loop.add_writer(fd, self._handshake)
+            return
+        except Exception as exc:
+            self._fail(exc)
+            return
+        timings = self._timings
+        timings.tls = time.time() - timings.started - timings.connect
+        self._send_request()
+
+    def _send_request(self):
+        self._sent = time.time()
+        headers = dict(self.headers)
+        headers['Host'] = self.host
+        headers.setdefault('Accept-Encoding', 'identity')
+        headers['Content-Length'] = str(len(self.body or ''))
+        self._out = 'POST %s HTTP/1.1\r\n%s\r\n%s' % (
+            self.url, ''.join('%s: %s\r\n' % h for h in headers.items()), self.body or '')
+        self.loop.add_reader(self._sock.fileno(), self._on_readable)
+        self._on_writable()
+
+    def _on_writable(self):
+        fd = self._sock.fileno()
+        try:
+            sent = self._sock.send(self._out)
+        except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+            sent = 0
+        except socket.error as exc:
+            if exc.args[0] not in _WOULD_BLOCK:
+                self._fail(exc)
+                return
+            sent = 0
+        self._out = self._out[sent:]
+        if self._out:
+            self.loop.add_writer(fd, self._on_writable)
+        else:
+            self.loop.remove_writer(fd)
+
+    # Reading
+
+    def _on_readable(self):
+        # Read everything that is available (including anything that the
+        # SSL layer has buffered, which select() can't see).
+        while self._sock is not None:
+            try:
+                data = self._sock.recv(READ_SIZE)
+            except (ssl.SSLWantReadError, ssl.SSLWantWriteError):
+                return
+            except socket.error as exc:
+                if exc.args[0] in _WOULD_BLOCK:
+                    return
+                if self._connected:
+                    self._dropped(exc)
+                else:
+                    self._fail(exc)
+                return
+            except Exception as exc:
+                self._fail(exc)
+                return
+            if not data:
+                self._closed()
+                return
+            self._reset_timeout()
+            self._in += data
+            self._process()
+
+    def _process(self):
+        if self._status is None and not self._read_headers():
+            return
+        if self._status != 200:
+            return
+        if self._chunked:
+            ended = self._read_chunks()
+        else:
+            self._add_body(self._in)
+            del self._in[:]
+            ended = False
+        self._read_frames()
+        if ended:
+            self._closed()
+
+    def _read_headers(self):
+        end = self._in.find('\r\n\r\n')
+        if end == -1:
+            return False
+        lines = str(self._in[:end]).split('\r\n')
+        del self._in[:end + 4]
+        try:
+            self._status = int(lines[0].split(None, 2)[1])
+        except (IndexError, ValueError):
+            self._fail(TweepError('Bad status line: %r' % lines[0]))
+            return False
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            name = name.strip().lower()
+            value = value.strip().lower()
+            if name == 'transfer-encoding' and value == 'chunked':
+                self._chunked = True
+            elif name == 'content-encoding' and value in DECOMPRESS_WBITS:
+                self._decompressor = zlib.decompressobj(DECOMPRESS_WBITS[value])
+
+        status = self._status
+        self._timings.response = time.time() - self._sent
+        if status != 200:
+            self._close()
+            if self.listener.on_error(status) is False:
+                self._stop()
+                return False
+            self._error_counter += 1
+            if status == 420:
+                self.retry_time = max(self.retry_420_start, self.retry_time)
+            self._reconnect_later(self.retry_time)
+            self._backoff += self.retry_time
+            self.retry_time = min(self.retry_time * 2, self.retry_time_cap)
+            return False
+
+        self._error_counter = 0
+        self.retry_time = self.retry_time_start
+        self.snooze_time = self.snooze_time_step
+        self._timings.backoff = self._backoff
+        self._backoff = 0.0
+        self._connected = True
+        if self.stall_timeout:
+            self._read_timeout = self.stall_timeout
+            self._reset_timeout()
+        self.listener.on_connect()
+        return True
+
+    def _read_chunks(self):
+        """De-chunk what has arrived into the body. Returns True if the
+        last chunk has arrived (the frames in the body should be read
+        before closing)."""
+        data = self._in
+        while data:
+            if self._chunk_left is None:
+                end = data.find('\r\n')
+                if end == -1:
+                    return False
+                size = int(str(data[:end]).split(';')[0], 16)
+                del data[:end + 2]
+                if size == 0:
+                    return True
+                self._chunk_left = size
+            n = min(self._chunk_left, len(data))
+            self._add_body(data[:n])
+            del data[:n]
+            self._chunk_left -= n
+            if self._chunk_left:
+                return False
+            if len(data) < 2:
+                # (Wait for the CRLF at the end of the chunk)
+                self._chunk_left = 0
+                return False
+            del data[:2]
+            self._chunk_left = None
+        return False
+
+    def _add_body(self, data):
+        self._bytes_received += len(data)
+        if self._decompressor is not None:
+            data = self._decompressor.decompress(bytes(data))
+        self._bytes_decompressed += len(data)
+        self._body += data
+
+    def _read_frames(self):
+        # The same framing as Stream._read_loop: optional keep-alive
+        # newlines, a length line, then that many bytes.
+        body = self._body
+        pos = 0
+        batch = []
+        while self.running:
+            while pos < len(body) and body[pos] == 10:  # '\n'
+                pos += 1
+            end = body.find('\n', pos)
+            if end == -1:
+                break
+            line = body[pos:end + 1]
+            if not line.strip().isdigit():
+                pos = end + 1
+                continue
+            length = int(line)
+            if len(body) - (end + 1) < length:
+                break
+            pos = end + 1 + length
+            frame = memoryview(body)[end + 1:pos].tobytes()
+            if self._timings is not None:
+                self._first_frame()
+            if not self.batch_size:
+                self._data(frame)
+                continue
+            batch.append(frame)
+            if len(batch) >= self.batch_size:
+                self._data_batch(batch)
+                batch = []
+        # (Everything that has arrived has been read, so there's no point
+        # waiting for batch_interval)
+        if batch and self.running:
+            self._data_batch(batch)
+        del body[:pos]
+
+    def _data(self, data):
+        self._result(self.listener.on_data(data))
+
+    def _data_batch(self, frames):
+        self._result(self.listener.on_batch(frames))
+
+    def _result(self, result):
+        if isinstance(result, types.GeneratorType):
+            self.loop.spawn(result)
+        elif result is False:
+            self._stop()
+
+    # Timeouts, errors and reconnecting
+
+    def _reset_timeout(self):
+        if self._timeout_timer is not None:
+            self._timeout_timer.cancel()
+        self._timeout_timer = self.loop.call_later(self._read_timeout, self._on_timeout)
+
+    def _on_timeout(self):
+        self._timeout_timer = None
+        self._close()
+        if self.listener.on_timeout() == False or self.running is False:
+            self._stop()
+            return
+        self._snooze()
+
+    def _dropped(self, exc):
+        """The connection was lost while reading (e.g. reset): reconnect
+        after a snooze, as after a timeout (and as Stream does)."""
+        logging.warning("Stream connection dropped: %r", exc)
+        self._close()
+        if self.running:
+            self._snooze()
+
+    def _snooze(self):
+        self._reconnect_later(self.snooze_time)
+        self._backoff += self.snooze_time
+        self.snooze_time = min(self.snooze_time + self.snooze_time_step,
+                               self.snooze_time_cap)
+
+    def _closed(self):
+        """The server closed the connection: reconnect straight away, as Stream does."""
+        self._close()
+        self.on_closed(None)
+        if self.running:
+            self.loop.call_soon(self._connect)
+
+    def _reconnect_later(self, delay):
+        if self.running:
+            self._retry_timer = self.loop.call_later(delay, self._connect)
+
+    def _fail(self, exc):
+        """Any other error stops the stream."""
+        self.exception = exc
+        self._stop()
+        self.listener.on_exception(exc)
+        logging.error("Stream stopped by exception: %r", exc)
+
+    def _stop(self):
+        self.running = False
+        self._close()
+
+    def _close(self):
+        for timer in (self._timeout_timer, self._retry_timer):
+            if timer is not None:
+                timer.cancel()
+        self._timeout_timer = self._retry_timer = None
+        if self._sock is not None:
+            fd = self._sock.fileno()
+            self.loop.remove_reader(fd)
+            self.loop.remove_writer(fd)
+            self._sock.close()
+            self._sock = None
+        if self._connected:
+            self._disconnected_at = time.time()
+            self._connected = False
+        self._reset()
@@ -2,8 +2,19 @@
 # Copyright 2009-2010 Joshua Roesslein
 # See LICENSE for details.
 
+import threading
+from collections import OrderedDict
+
 from tweepy.error import TweepError
-from tweepy.utils import parse_datetime, parse_html_value, parse_a_href
+from tweepy.utils import parse_datetime, parse_html_value, parse_a_href, import_simplejson
+json_lib = import_simplejson()
+
+
+def model_class(api, name, default):
+    """The model class called name from the api's model factory (or
+    default if the api doesn't have one)."""
+    factory = getattr(getattr(api, 'parser', None), 'model_factory', None)
+    return getattr(factory, name, default)
 
 
 class ResultSet(list):
@@ -31,6 +42,9 @@ class ResultSet(list):
         return [item.id for item in self if hasattr(item, 'id')]
 
 class Model(object):
+    # (no per-instance dict in Model itself, so that CompactModel can use
+    # __slots__; subclasses that don't define __slots__ still get one)
+    __slots__ = ()
 
     def __init__(self, api=None):
         self._api = api
@@ -63,7 +77,82 @@ class Model(object):
         return '%s(%s)' % (self.__class__.__name__, ', '.join(state))
 
 
-class Status(Model):
+class StatusActions(object):
+    """API calls for a status (shared by Status and CompactStatus)."""
+    __slots__ = ()
+
+    def destroy(self):
+        return self._api.destroy_status(self.id)
+
+    def retweet(self):
+        return self._api.retweet(self.id)
+
+    def retweets(self):
+        return self._api.retweets(self.id)
+
+    def favorite(self):
+        return self._api.create_favorite(self.id)
+
+
+class UserActions(object):
+    """API calls for a user (shared by User and CompactUser)."""
+    __slots__ = ()
+
+    def timeline(self, **kargs):
+        return self._api.user_timeline(user_id=self.id, **kargs)
+
+    def friends(self, **kargs):
+        return self._api.friends(user_id=self.id, **kargs)
+
+    def followers(self, **kargs):
+        return self._api.followers(user_id=self.id, **kargs)
+
+    def follow(self):
+        self._api.create_friendship(user_id=self.id)
+        self.following = True
+
+    def unfollow(self):
+        self._api.destroy_friendship(user_id=self.id)
+        self.following = False
+
+    def lists_memberships(self, *args, **kargs):
+        return self._api.lists_memberships(user=self.screen_name, *args, **kargs)
+
+    def lists_subscriptions(self, *args, **kargs):
+        return self._api.lists_subscriptions(user=self.screen_name, *args, **kargs)
+
+    def lists(self, *args, **kargs):
+        return self._api.lists_all(user=self.screen_name, *args, **kargs)
+
+    def followers_ids(self, *args, **kargs):
+        return self._api.followers_ids(user_id=self.id, *args, **kargs)
+
+
+class BoundingBoxActions(object):
+    __slots__ = ()
+
+    def origin(self):
+        """
+        Return longitude, latitude of southwest (bottom, left) corner of
+        bounding box, as a tuple.
+
+        This assumes that bounding box is always a rectangle, which
+        appears to be the case at present.
+        """
+        return tuple(self.coordinates[0][0])
+
+    def corner(self):
+        """
+        Return longitude, latitude of northeast (top, right) corner of
+        bounding box, as a tuple.
+
+        This assumes that bounding box is always a rectangle, which
+        appears to be the case at present.
+        """
+        return tuple(self.coordinates[0][2])
+
+
+class Status(Model, StatusActions):
 
     @classmethod
     def parse(cls, api, json):
@@ -94,20 +183,8 @@ class Status(Model):
                 setattr(status, k, v)
         return status
 
-    def destroy(self):
-        return self._api.destroy_status(self.id)
-
-    def retweet(self):
-        return self._api.retweet(self.id)
 
-    def retweets(self):
-        return self._api.retweets(self.id)
-
-    def favorite(self):
-        return self._api.create_favorite(self.id)
-
-
-class User(Model):
+class User(Model, UserActions):
 
     @classmethod
     def parse(cls, api, json):
@@ -139,35 +216,6 @@ class User(Model):
             results.append(cls.parse(api, obj))
         return results
 
-    def timeline(self, **kargs):
-        return self._api.user_timeline(user_id=self.id, **kargs)
-
-    def friends(self, **kargs):
-        return self._api.friends(user_id=self.id, **kargs)
-
-    def followers(self, **kargs):
-        return self._api.followers(user_id=self.id, **kargs)
-
-    def follow(self):
-        self._api.create_friendship(user_id=self.id)
-        self.following = True
-
-    def unfollow(self):
-        self._api.destroy_friendship(user_id=self.id)
-        self.following = False
-
-    def lists_memberships(self, *args, **kargs):
-        return self._api.lists_memberships(user=self.screen_name, *args, **kargs)
-
-    def lists_subscriptions(self, *args, **kargs):
-        return self._api.lists_subscriptions(user=self.screen_name, *args, **kargs)
-
-    def lists(self, *args, **kargs):
-        return self._api.lists_all(user=self.screen_name, *args, **kargs)
-
-    def followers_ids(self, *args, **kargs):
-        return self._api.followers_ids(user_id=self.id, *args, **kargs)
-
 
 class DirectMessage(Model):
 
@@ -244,8 +292,9 @@ class SearchResults(ResultSet):
         results.count = metadata.get('count')
         results.next_results = metadata.get('next_results')
 
+        status_model = model_class(api, 'status', Status)
         for status in json['statuses']:
-            results.append(Status.parse(api, status))
+            results.append(status_model.parse(api, status))
         return results
 
 
@@ -347,7 +396,7 @@ class IDModel(Model):
             return json['ids']
 
 
-class BoundingBox(Model):
+class BoundingBox(Model, BoundingBoxActions):
 
     @classmethod
     def parse(cls, api, json):
@@ -357,26 +406,6 @@ class BoundingBox(Model):
                 setattr(result, k, v)
         return result
 
-    def origin(self):
-        """
-        Return longitude, latitude of southwest (bottom, left) corner of
-        bounding box, as a tuple.
-
-        This assumes that bounding box is always a rectangle, which
-        appears to be the case at present.
-        """
-        return tuple(self.coordinates[0][0])
-
-    def corner(self):
-        """
-        Return longitude, latitude of northeast (top, right) corner of
-        bounding box, as a tuple.
-
-        This assumes that bounding box is always a rectangle, which
-        appears to be the case at present.
-        """
-        return tuple(self.coordinates[0][2])
-
 
 class Place(Model):
 
@@ -411,6 +440,289 @@ class Place(Model):
             results.append(cls.parse(api, obj))
         return results
 
+class LazyModel(Model):
+    """Base class for models that keep the decoded JSON (or even the raw
+    JSON string) and only build each attribute, nested model or datetime
+    the first time that it is used. Attributes that are never used cost
+    nothing, which is much quicker when only a few fields are wanted.
+
+    Subclasses implement _lazy_value(name) to build an attribute from the
+    JSON (raising AttributeError if there isn't one).
+    """
+
+    @classmethod
+    def parse(cls, api, json):
+        model = cls(api)
+        if isinstance(json, basestring):
+            model._raw = json
+        else:
+            model._json = json
+        return model
+
+    def _data(self):
+        """The decoded JSON (decoding the raw string the first time)."""
+        d = self.__dict__
+        data = d.get('_json')
+        if data is None:
+            raw = d.pop('_raw', None)
+            data = d['_json'] = json_lib.loads(raw) if raw is not None else {}
+        return data
+
+    def __getattr__(self, name):
+        # (only called for attributes that haven't been built yet)
+        if name.startswith('__'):
+            raise AttributeError(name)
+        value = self._lazy_value(name)
+        setattr(self, name, value)
+        return value
+
+    def _lazy_value(self, name):
+        try:
+            return self._data()[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def _lazy_class(api, name, default):
+    # (the factory's class if it is lazy too, otherwise default)
+    cls = model_class(api, name, default)
+    return cls if issubclass(cls, LazyModel) else default
+
+
+class LazyStatus(LazyModel, Status):
+    """A Status that is built as it is used (see LazyModel)."""
+
+    def _lazy_value(self, name):
+        data = self._data()
+        api = self.__dict__.get('_api')
+        if name == 'author' or name == 'user':
+            if 'user' not in data:
+                raise AttributeError(name)
+            user = _lazy_class(api, 'user', LazyUser).parse(api, data['user'])
+            self.author = self.user = user
+            return user
+        if name == 'source_url':
+            if 'source' not in data:
+                raise AttributeError(name)
+            source = data['source']
+            return parse_a_href(source) if '<' in source else None
+        if name not in data:
+            raise AttributeError(name)
+        value = data[name]
+        if name == 'created_at':
+            return parse_datetime(value)
+        if name == 'source':
+            return parse_html_value(value) if '<' in value else value
+        if name == 'retweeted_status':
+            return type(self).parse(api, value)
+        if name == 'place':
+            return Place.parse(api, value) if value is not None else None
+        return value
+
+
+class LazyUser(LazyModel, User):
+    """A User that is built as it is used (see LazyModel)."""
+
+    def _lazy_value(self, name):
+        data = self._data()
+        if name not in data:
+            raise AttributeError(name)
+        value = data[name]
+        if name == 'created_at':
+            return parse_datetime(value)
+        if name == 'status':
+            api = self.__dict__.get('_api')
+            return _lazy_class(api, 'status', LazyStatus).parse(api, value)
+        if name == 'following':
+            # twitter sets this to null if it is false
+            return value is True
+        return value
+
+
+class CompactModel(Model):
+    """Base class for models that store their fields in __slots__ rather
+    than a per-instance dict, which takes much less memory when holding
+    lots of them. Subclasses list the common fields in __slots__; any
+    other fields go in a dict (_extra) that is only made when needed.
+    """
+    __slots__ = ('_api', '_extra')
+
+    def __init__(self, api=None):
+        self._api = api
+        self._extra = None
+
+    def __getattr__(self, name):
+        # (only called for fields that aren't set)
+        if name != '_extra' and self._extra is not None and name in self._extra:
+            return self._extra[name]
+        raise AttributeError("'%s' object has no attribute '%s'" % (
+            self.__class__.__name__, name))
+
+    def __setattr__(self, name, value):
+        try:
+            object.__setattr__(self, name, value)
+        except AttributeError:
+            # not one of the slots
+            if self._extra is None:
+                object.__setattr__(self, '_extra', {})
+            self._extra[name] = value
+
+    def _fields(self):
+        """The fields that are set, as a dict (without _api)."""
+        fields = {}
+        for cls in type(self).__mro__:
+            for name in cls.__dict__.get('__slots__', ()):
+                if name in ('_api', '_extra') or name in fields:
+                    continue
+                try:
+                    fields[name] = object.__getattribute__(self, name)
+                except AttributeError:
+                    pass
+        if self._extra:
+            fields.update(self._extra)
+        return fields
+
+    def __getstate__(self):
+        # pickle (without the API reference, like Model)
+        return self._fields()
+
+    def __setstate__(self, state):
+        # unpickle
+        CompactModel.__init__(self)
+        for name, value in state.items():
+            setattr(self, name, value)
+
+    def __repr__(self):
+        state = ['%s=%s' % (k, repr(v)) for (k, v) in self._fields().items()]
+        return '%s(%s)' % (self.__class__.__name__, ', '.join(state))
+
+
+def _compact_class(api, name, default):
+    # (the factory's class if it is compact too, otherwise default)
+    cls = model_class(api, name, default)
+    return cls if issubclass(cls, CompactModel) else default
+
+
+class CompactStatus(CompactModel, StatusActions):
+    """A Status that stores the usual tweet fields in slots. 'user' is the
+    same as 'author' rather than a second field."""
+    __slots__ = (
+        'created_at', 'id', 'id_str', 'text', 'source', 'source_url', 'truncated',
+        'in_reply_to_status_id', 'in_reply_to_status_id_str', 'in_reply_to_user_id',
+        'in_reply_to_user_id_str', 'in_reply_to_screen_name', 'author', 'geo',
+        'coordinates', 'place', 'contributors', 'retweet_count', 'favorite_count',
+        'entities', 'extended_entities', 'favorited', 'retweeted', 'possibly_sensitive',
+        'filter_level', 'lang', 'timestamp_ms', 'retweeted_status', 'is_quote_status',
+        'quoted_status_id', 'quoted_status_id_str', 'quoted_status')
+
+    @property
+    def user(self):  # DEPRECIATED
+        return self.author
+
+    @user.setter
+    def user(self, user):
+        self.author = user
+
+    @classmethod
+    def parse(cls, api, json):
+        status = cls(api)
+        for k, v in json.items():
+            if k == 'user':
+                status.author = _compact_class(api, 'user', CompactUser).parse(api, v)
+            elif k == 'created_at':
+                status.created_at = parse_datetime(v)
+            elif k == 'source':
+                if '<' in v:
+                    status.source = parse_html_value(v)
+                    status.source_url = parse_a_href(v)
+                else:
+                    status.source = v
+                    status.source_url = None
+            elif k == 'retweeted_status':
+                status.retweeted_status = cls.parse(api, v)
+            elif k == 'place':
+                if v is not None:
+                    status.place = _compact_class(api, 'place', CompactPlace).parse(api, v)
+                else:
+                    status.place = None
+            else:
+                setattr(status, k, v)
+        return status
+
+
+class CompactUser(CompactModel, UserActions):
+    """A User that stores the usual user fields in slots."""
+    __slots__ = (
+        'id', 'id_str', 'name', 'screen_name', 'location', 'url', 'description',
+        'protected', 'verified', 'followers_count', 'friends_count', 'listed_count',
+        'favourites_count', 'statuses_count', 'created_at', 'utc_offset', 'time_zone',
+        'geo_enabled', 'lang', 'contributors_enabled', 'is_translator', 'following',
+        'follow_request_sent', 'notifications', 'default_profile',
+        'default_profile_image', 'profile_image_url', 'profile_image_url_https',
+        'profile_banner_url', 'profile_background_color', 'profile_background_image_url',
+        'profile_background_image_url_https', 'profile_background_tile', 'profile_link_color',
+        'profile_sidebar_border_color', 'profile_sidebar_fill_color', 'profile_text_color',
+        'profile_use_background_image', 'status')
+
+    @classmethod
+    def parse(cls, api, json):
+        user = cls(api)
+        for k, v in json.items():
+            if k == 'created_at':
+                user.created_at = parse_datetime(v)
+            elif k == 'status':
+                user.status = _compact_class(api, 'status', CompactStatus).parse(api, v)
+            elif k == 'following':
+                # twitter sets this to null if it is false
+                user.following = v is True
+            else:
+                setattr(user, k, v)
+        return user
+
+
+class CompactBoundingBox(CompactModel, BoundingBoxActions):
+    __slots__ = ('type', 'coordinates')
+
+    @classmethod
+    def parse(cls, api, json):
+        result = cls(api)
+        if json is not None:
+            for k, v in json.items():
+                setattr(result, k, v)
+        return result
+
+
+class CompactPlace(CompactModel):
+    __slots__ = ('id', 'url', 'place_type', 'name', 'full_name', 'country_code',
+                 'country', 'bounding_box', 'attributes', 'contained_within')
+
+    @classmethod
+    def parse(cls, api, json):
+        place = cls(api)
+        for k, v in json.items():
+            if k == 'bounding_box':
+                # bounding_box value may be null (None.)
+                place.bounding_box = CompactBoundingBox.parse(api, v) if v is not None else None
+            elif k == 'contained_within':
+                # contained_within is a list of Places.
+                place.contained_within = cls.parse_list(api, v)
+            else:
+                setattr(place, k, v)
+        return place
+
+    @classmethod
+    def parse_list(cls, api, json_list):
+        if isinstance(json_list, list):
+            item_list = json_list
+        else:
+            item_list = json_list['result']['places']
+
+        results = ResultSet()
+        for obj in item_list:
+            results.append(cls.parse(api, obj))
+        return results
+
+
 class ModelFactory(object):
     """
     Used by parsers for creating instances
@@ -434,3 +746,122 @@ class ModelFactory(object):
     place = Place
     bounding_box = BoundingBox
 
+
+
+class LazyModelFactory(ModelFactory):
+    """
+    A factory whose statuses and users are only built
+    as they are used (see LazyModel). E.g.:
+
+        api = API(auth, parser=ModelParser(LazyModelFactory))
+    """
+
+    status = LazyStatus
+    user = LazyUser
+
+
+class CompactModelFactory(ModelFactory):
+    """
+    A factory whose statuses, users and places use
+    __slots__ to save memory (see CompactModel).
+    """
+
+    status = CompactStatus
+    user = CompactUser
+    place = CompactPlace
+    bounding_box = CompactBoundingBox
+
+
+class UserCache(object):
+    """Remembers the most recent max_size users (by id) so that statuses
+    from the same user can share one User object instead of each having
+    its own copy. When a newer snapshot of a user's profile arrives (one
+    with a higher statuses_count) the shared object is updated with it.
+    """
+
+    def __init__(self, max_size=100000):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self._users = OrderedDict()  # least recently used first
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._users)
+
+    def intern(self, json, parse):
+        """Return the shared user for the decoded user json, calling
+        parse() to make one if it isn't already known."""
+        user_id = json.get('id') if isinstance(json, dict) else None
+        if user_id is None:
+            return parse()
+        with self._lock:
+            user = self._users.pop(user_id, None)
+            if user is not None:
+                self._users[user_id] = user  # (now the most recent)
+                self.hits += 1
+                if json.get('statuses_count', 0) <= _statuses_count(user):
+                    return user
+        # (parse outside the lock: it can parse the user's own status)
+        new = parse()
+        with self._lock:
+            if user is not None:
+                _update_model(user, new)
+                self.refreshes += 1
+                return user
+            self.misses += 1
+            self._users[user_id] = new
+            while len(self._users) > self.max_size:
+                self._users.popitem(last=False)
+        return new
+
+
+def _statuses_count(user):
+    try:
+        return user.statuses_count or 0
+    except AttributeError:
+        return 0
+
+
+def _update_model(model, new):
+    """Copy the fields of new into model (of the same type)."""
+    if isinstance(model, CompactModel):
+        for name, value in new._fields().items():
+            setattr(model, name, value)
+    else:
+        if isinstance(model, LazyModel):
+            # (forget the fields built from the old json)
+            model.__dict__.clear()
+        model.__dict__.update(new.__dict__)
+
+
+def _new_model(cls):
+    return cls.__new__(cls)
+
+
+def interning_factory(factory=ModelFactory, max_users=100000):
+    """
+    Make a model factory like factory, but whose users
+    are shared between statuses through a UserCache of
+    up to max_users users (the factory's user_cache). E.g.:
+
+        api = API(parser=ModelParser(interning_factory(CompactModelFactory)))
+    """
+    cache = UserCache(max_users)
+    user_model = factory.user
+
+    class InterningUser(user_model):
+        __slots__ = ()
+
+        @classmethod
+        def parse(cls, api, json):
+            return cache.intern(json, lambda: super(InterningUser, cls).parse(api, json))
+
+        def __reduce_ex__(self, protocol):
+            # pickle as the ordinary user class (this one can't be found by name)
+            return _new_model, (user_model,), self.__getstate__()
+
+    InterningUser.__name__ = 'Interning' + user_model.__name__
+    return type('Interning' + factory.__name__, (factory,),
+                {'user': InterningUser, 'user_cache': cache})
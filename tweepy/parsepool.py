@@ -0,0 +1,163 @@
+# Tweepy
+# Copyright 2009-2010 Joshua Roesslein
+# See LICENSE for details.
+
+"""
+Decode stream messages into models in other processes.
+
+StreamListener.on_data() decodes each message (json.loads and
+Status.parse) in the thread that reads the stream, so a listener that
+uses on_status() on a busy stream can fall behind. ParsingListener sends
+the raw messages to a pool of worker processes to be decoded, and calls
+the usual on_status(), on_delete() etc. of another listener with the
+results:
+
+    listener = ParsingListener(MyListener(), workers=4)
+    stream = Stream(auth, listener, batch_size=100)
+
+Messages are sent to the workers in batches (one batch per on_batch()
+call, or one message per on_data() call), so giving the Stream a
+batch_size saves a lot of time passing messages between processes.
+"""
+
+import logging
+import multiprocessing
+import threading
+import traceback
+
+from tweepy.api import API
+from tweepy.models import Model, ModelFactory, CompactModel
+from tweepy.parsers import ModelParser
+from tweepy.streaming import StreamListener, parse_message
+
+# the API used to parse messages in each worker process
+_worker_api = None
+
+
+def _init_worker(model_factory):
+    global _worker_api
+    _worker_api = API(parser=ModelParser(model_factory))
+
+
+def _parse_batch(frames):
+    """Decode a list of raw messages (in a worker process). Returns a list
+    of (kind, obj) tuples like parse_message(); a message that can't be
+    decoded gives ('exception', traceback)."""
+    results = []
+    for raw_data in frames:
+        try:
+            results.append(parse_message(_worker_api, raw_data))
+        except Exception:
+            results.append(('exception', traceback.format_exc()))
+    return results
+
+
+def _attach_api(obj, api, depth=0):
+    """Give a model (and the models inside it) the API that was dropped
+    when it was pickled to come back from the worker."""
+    if depth > 3 or not isinstance(obj, Model):
+        return
+    obj._api = api
+    # (CompactModels keep their fields in __slots__, so have no __dict__)
+    if isinstance(obj, CompactModel):
+        values = obj._fields().values()
+    else:
+        values = vars(obj).values()
+    for value in values:
+        if isinstance(value, Model) and getattr(value, '_api', None) is not api:
+            _attach_api(value, api, depth + 1)
+
+
+class ParsingListener(StreamListener):
+    """Decodes messages in a pool of 'workers' processes and passes the
+    results to the methods of the 'downstream' listener (in the order that
+    they arrived, unless 'ordered' is False). At most 'max_pending'
+    batches are being decoded at once; after that on_data() and
+    on_batch() wait, which stops the stream being read."""
+
+    def __init__(self, downstream, workers=None, ordered=True, max_pending=64,
+                 model_factory=None):
+        self.api = downstream.api
+        self.downstream = downstream
+        self.ordered = ordered
+        if model_factory is None:
+            model_factory = getattr(getattr(self.api, 'parser', None), 'model_factory',
+                                    ModelFactory)
+        self._pool = multiprocessing.Pool(workers, _init_worker, (model_factory,))
+        self._slots = threading.Semaphore(max_pending)
+        self._lock = threading.Lock()
+        self._next_batch = 0  # number of the next batch to be sent
+        self._next_result = 0  # number of the next batch to be delivered (if ordered)
+        self._results = {}  # decoded batches waiting for earlier ones (if ordered)
+        self._stopped = False
+
+    def on_data(self, raw_data):
+        return self._submit([raw_data])
+
+    def on_batch(self, frames):
+        return self._submit(list(frames))
+
+    def _submit(self, frames):
+        if self._stopped:
+            return False
+        self._slots.acquire()
+        with self._lock:
+            number = self._next_batch
+            self._next_batch += 1
+        self._pool.apply_async(_parse_batch, (frames,),
+                               callback=lambda results: self._decoded(number, results))
+        return True
+
+    def _decoded(self, number, results):
+        # (called in the pool's result thread)
+        with self._lock:
+            if not self.ordered:
+                self._deliver(results)
+            else:
+                self._results[number] = results
+                while self._next_result in self._results:
+                    self._deliver(self._results.pop(self._next_result))
+                    self._next_result += 1
+        self._slots.release()
+
+    def _deliver(self, results):
+        for kind, obj in results:
+            if self._stopped:
+                return
+            try:
+                if kind == 'exception':
+                    logging.error("Could not decode a message:\n" + obj)
+                    self.downstream.on_exception(ValueError(obj.strip().splitlines()[-1]))
+                    continue
+                _attach_api(obj, self.api)
+                if self.downstream.dispatch(kind, obj) is False:
+                    self._stopped = True
+            except Exception as exc:
+                logging.exception("Exception in listener")
+                self.downstream.on_exception(exc)
+
+    def close(self):
+        """Wait for the messages that are being decoded to be delivered
+        and stop the workers. Closes the downstream listener too (if it has
+        a close() method)."""
+        self._pool.close()
+        self._pool.join()
+        if hasattr(self.downstream, 'close'):
+            self.downstream.close()
+
+    # everything else is passed straight on to the downstream listener
+
+    def on_connect(self):
+        return self.downstream.on_connect()
+
+    def on_exception(self, exception):
+        return self.downstream.on_exception(exception)
+
+    def on_error(self, status_code):
+        return self.downstream.on_error(status_code)
+
+    def on_timeout(self):
+        return self.downstream.on_timeout()
+
+    def on_timings(self, timings):
+        return self.downstream.on_timings(timings)
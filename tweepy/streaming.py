@@ -4,12 +4,15 @@
 
 import logging
 import httplib
+import socket
 from socket import timeout
 from threading import Thread
 from time import sleep
+import time
 import ssl
+import zlib
 
-from tweepy.models import Status
+from tweepy.models import Status, model_class
 from tweepy.api import API
 from tweepy.error import TweepError
 
@@ -18,6 +21,40 @@ json = import_simplejson()
 
 STREAM_VERSION = '1.1'
 
+# twitter sends a keep-alive newline at least this often (seconds), so a
+# connection that has been silent for a few of these has stalled
+KEEPALIVE_INTERVAL = 30
+
+
+def parse_message(api, raw_data):
+    """Decode a raw message from the stream.
+
+    Returns a tuple of (kind, obj) where kind is 'status', 'delete',
+    'event', 'direct_message', 'limit', 'disconnect', 'warning' or
+    'unknown' and obj
+    is what StreamListener.dispatch() passes to the matching method.
+    """
+    data = json.loads(raw_data)
+    status_model = model_class(api, 'status', Status)
+
+    if 'in_reply_to_status_id' in data:
+        return 'status', status_model.parse(api, data)
+    elif 'delete' in data:
+        delete = data['delete']['status']
+        return 'delete', (delete['id'], delete['user_id'])
+    elif 'event' in data:
+        return 'event', status_model.parse(api, data)
+    elif 'direct_message' in data:
+        return 'direct_message', status_model.parse(api, data)
+    elif 'limit' in data:
+        return 'limit', data['limit']['track']
+    elif 'disconnect' in data:
+        return 'disconnect', data['disconnect']
+    elif 'warning' in data:
+        return 'warning', data['warning']
+    else:
+        return 'unknown', raw_data
+
 
 class StreamListener(object):
 
@@ -39,32 +76,47 @@ class StreamListener(object):
         Override this method if you wish to manually handle
         the stream data. Return False to stop stream and close connection.
         """
-        data = json.loads(raw_data)
+        return self.dispatch(*parse_message(self.api, raw_data))
 
-        if 'in_reply_to_status_id' in data:
-            status = Status.parse(self.api, data)
-            if self.on_status(status) is False:
+    def dispatch(self, kind, obj):
+        """Call the method for a message decoded by parse_message(),
+        e.g. on_status() for a status. Returns False if the method does.
+        """
+        if kind == 'status':
+            if self.on_status(obj) is False:
                 return False
-        elif 'delete' in data:
-            delete = data['delete']['status']
-            if self.on_delete(delete['id'], delete['user_id']) is False:
+        elif kind == 'delete':
+            if self.on_delete(*obj) is False:
                 return False
-        elif 'event' in data:
-            status = Status.parse(self.api, data)
-            if self.on_event(status) is False:
+        elif kind == 'event':
+            if self.on_event(obj) is False:
                 return False
-        elif 'direct_message' in data:
-            status = Status.parse(self.api, data)
-            if self.on_direct_message(status) is False:
+        elif kind == 'direct_message':
+            if self.on_direct_message(obj) is False:
                 return False
-        elif 'limit' in data:
-            if self.on_limit(data['limit']['track']) is False:
+        elif kind == 'limit':
+            if self.on_limit(obj) is False:
                 return False
-        elif 'disconnect' in data:
-            if self.on_disconnect(data['disconnect']) is False:
+        elif kind == 'disconnect':
+            if self.on_disconnect(obj) is False:
+                return False
+        elif kind == 'warning':
+            if self.on_warning(obj) is False:
                 return False
         else:
-            logging.error("Unknown message type: " + str(raw_data))
+            logging.error("Unknown message type: " + str(obj))
+
+    def on_batch(self, frames):
+        """Called with a list of raw messages when the stream delivers
+        them in batches (the batch_size option of Stream).
+
+        By default each one is passed to on_data(). Override this to
+        handle the whole batch at once. Return False to stop stream and
+        close connection.
+        """
+        for raw_data in frames:
+            if self.on_data(raw_data) is False:
+                return False
 
     def on_status(self, status):
         """Called when a new status arrives"""
@@ -106,6 +158,175 @@ class StreamListener(object):
         """
         return
 
+    def on_warning(self, notice):
+        """Called when twitter sends a warning, e.g. a stall warning
+        (the stall_warnings argument of filter() and sample())"""
+        return
+
+    def on_timings(self, timings):
+        """Called with a ConnectionTimings when the first message arrives
+        on each new connection (i.e. after every reconnect)"""
+        return
+
+
+class ConnectionTimings(object):
+    """How long each stage of (re)connecting to the stream took, in
+    seconds (None if the stage didn't happen):
+
+    backoff: waiting before connecting, after errors or timeouts
+    connect: making the TCP connection
+    tls: the TLS handshake
+    response: from sending the request to getting the response headers
+    first_frame: from starting to connect to the first message
+    gap: from the previous connection being closed to the first message
+        on this one, i.e. how long nothing could be received (None for
+        the first connection)
+    """
+
+    def __init__(self):
+        self.backoff = 0.0
+        self.connect = None
+        self.tls = None
+        self.response = None
+        self.first_frame = None
+        self.gap = None
+        self.started = None  # time.time() when connecting started
+
+    def __repr__(self):
+        return 'ConnectionTimings(%s)' % ', '.join(
+            '%s=%s' % (name, '%.3f' % value if value is not None else None)
+            for name, value in [('backoff', self.backoff), ('connect', self.connect),
+                                ('tls', self.tls), ('response', self.response),
+                                ('first_frame', self.first_frame), ('gap', self.gap)])
+
+
+class ReadBuffer(object):
+    """Reads the length-delimited frames of a stream from an HTTP response.
+
+    Data is read in blocks of up to chunk_size bytes into a bytearray and
+    the length lines and frames are sliced out of it, rather than reading
+    the length a byte at a time. When the response is chunked, a block
+    never goes beyond the end of the current HTTP chunk, so a read never
+    waits for data that the server hasn't sent yet.
+    """
+
+    def __init__(self, resp, chunk_size):
+        self._resp = resp
+        self._chunk_size = chunk_size
+        self._buffer = bytearray()
+        self._pos = 0  # start of the data that hasn't been used yet
+        self.bytes_received = 0  # bytes of the response body read so far
+
+    @property
+    def bytes_decompressed(self):
+        return self.bytes_received
+
+    def _read_block(self):
+        """Read the next block of the response body ('' at the end)."""
+        chunk_left = getattr(self._resp, 'chunk_left', None)
+        if self._resp.chunked and chunk_left:
+            data = self._resp.read(min(self._chunk_size, chunk_left))
+        else:
+            # At the start of a chunk (or not chunked): we don't know how
+            # much is there, so only ask for one byte.
+            data = self._resp.read(1)
+        self.bytes_received += len(data)
+        return data
+
+    def _fill(self):
+        """Read the next block into the buffer. Returns False at the end of the response."""
+        data = self._read_block()
+        if not data:
+            return False
+        self._append(data)
+        return True
+
+    def _append(self, data):
+        # Throw away the data that has been used before adding more
+        if self._pos:
+            del self._buffer[:self._pos]
+            self._pos = 0
+        self._buffer += data
+
+    def _take(self, end):
+        """Remove and return the buffered data up to end."""
+        data = memoryview(self._buffer)[self._pos:end].tobytes()
+        self._pos = end
+        return data
+
+    def read_line(self):
+        """Return the next line (including the newline), skipping any
+        keep-alive newlines before it. Returns None if the response ends
+        before a whole line has been read."""
+        buf = self._buffer
+        while True:
+            while self._pos < len(buf) and buf[self._pos] == 10:  # '\n'
+                self._pos += 1
+            end = buf.find('\n', self._pos)
+            if end != -1:
+                return self._take(end + 1)
+            if not self._fill():
+                return None
+            buf = self._buffer
+
+    def would_block(self):
+        """True if there is nothing buffered and reading more might have
+        to wait for the server."""
+        return self._pos == len(self._buffer) and \
+            not (self._resp.chunked and getattr(self._resp, 'chunk_left', None))
+
+    def read_len(self, length):
+        """Return the next length bytes. Whatever isn't already buffered
+        is read from the response in one go."""
+        available = len(self._buffer) - self._pos
+        if available >= length:
+            return self._take(self._pos + length)
+        data = self._take(len(self._buffer))
+        rest = self._resp.read(length - available)
+        self.bytes_received += len(rest)
+        return data + rest
+
+
+class DecompressingReadBuffer(ReadBuffer):
+    """A ReadBuffer for a compressed response (Content-Encoding gzip, or
+    deflate with wbits=zlib.MAX_WBITS).
+
+    Each block is decompressed as soon as it is read, so the frames and
+    length lines can be split across blocks, HTTP chunks and compressed
+    blocks in any way. bytes_received counts the compressed bytes and
+    bytes_decompressed what they decompressed to.
+    """
+
+    def __init__(self, resp, chunk_size, wbits=16 + zlib.MAX_WBITS):
+        ReadBuffer.__init__(self, resp, chunk_size)
+        self._decompressor = zlib.decompressobj(wbits)
+        self._decompressed = 0
+
+    @property
+    def bytes_decompressed(self):
+        return self._decompressed
+
+    def _fill(self):
+        data = self._read_block()
+        if not data:
+            return False
+        data = self._decompressor.decompress(data)
+        self._decompressed += len(data)
+        self._append(data)
+        return True
+
+    def read_len(self, length):
+        # (The compressed data has to go through the buffer, so the rest of
+        # a frame can't be read straight from the response)
+        while len(self._buffer) - self._pos < length:
+            if not self._fill():
+                break
+        return self._take(min(self._pos + length, len(self._buffer)))
+
+
+# Content-Encodings that the stream can decompress, and their zlib wbits
+DECOMPRESS_WBITS = {'gzip': 16 + zlib.MAX_WBITS, 'deflate': zlib.MAX_WBITS}
+
 
 class Stream(object):
 
@@ -124,21 +345,58 @@ class Stream(object):
         self.snooze_time_step = options.get("snooze_time", 0.25)
         self.snooze_time_cap = options.get("snooze_time_cap", 16)
         self.buffer_size = options.get("buffer_size",  1500)
+        # deliver up to batch_size messages at a time to listener.on_batch(),
+        # waiting no more than batch_interval seconds to fill a batch (0 to
+        # call listener.on_data() with each message)
+        self.batch_size = options.get("batch_size", 0)
+        self.batch_interval = options.get("batch_interval", 0.1)
+        # reconnect if nothing (not even a keep-alive) arrives for this
+        # many seconds once connected (None to use timeout)
+        self.stall_timeout = options.get("stall_timeout")
+        # ask for the stream to be compressed (several times less data)
+        self.compression = options.get("compression", False)
         if options.get("secure", True):
             self.scheme = "https"
         else:
             self.scheme = "http"
+        # connect somewhere other than twitter (e.g. a local test server);
+        # port None means the usual one for the scheme
+        self.host = options.get("host", self.host)
+        self.port = options.get("port")
 
         self.api = API()
         self.headers = options.get("headers") or {}
+        if self.compression:
+            self.headers['Accept-Encoding'] = 'deflate, gzip'
         self.parameters = None
         self.body = None
         self.retry_time = self.retry_time_start
         self.snooze_time = self.snooze_time_step
+        self._backoff = 0.0  # time spent waiting since the last connection
+        self._disconnected_at = None  # when the last connection was closed
+        self._timings = None  # timings of a new connection, until its first message
+        self._buf = None  # the ReadBuffer of the current connection
+        self._bytes_received = 0  # (from earlier connections)
+        self._bytes_decompressed = 0
+
+    @property
+    def bytes_received(self):
+        """Bytes of message data received so far (compressed, if the
+        stream is compressed), over all connections."""
+        buf = self._buf
+        return self._bytes_received + (buf.bytes_received if buf is not None else 0)
+
+    @property
+    def bytes_decompressed(self):
+        """Bytes of message data received so far after decompression
+        (the same as bytes_received if the stream isn't compressed)."""
+        buf = self._buf
+        return self._bytes_decompressed + (buf.bytes_decompressed if buf is not None else 0)
 
     def _run(self):
         # Authenticate
-        url = "%s://%s%s" % (self.scheme, self.host, self.url)
+        host = self.host if self.port is None else "%s:%s" % (self.host, self.port)
+        url = "%s://%s%s" % (self.scheme, host, self.url)
 
         # Connect and process the stream
         error_counter = 0
@@ -148,15 +406,29 @@ class Stream(object):
             if self.retry_count is not None and error_counter > self.retry_count:
                 # quit if error count greater than retry count
                 break
+            reading = False  # (whether the connection got as far as reading messages)
             try:
                 if self.scheme == "http":
-                    conn = httplib.HTTPConnection(self.host, timeout=self.timeout)
+                    conn = httplib.HTTPConnection(self.host, self.port, timeout=self.timeout)
                 else:
-                    conn = httplib.HTTPSConnection(self.host, timeout=self.timeout)
+                    conn = httplib.HTTPSConnection(self.host, self.port, timeout=self.timeout)
                 self.auth.apply_auth(url, 'POST', self.headers, self.parameters)
+                timings = ConnectionTimings()
+                timings.started = time.time()
+
+                def create_connection(*args, **kwargs):
+                    # (Time the TCP connection separately from the handshake)
+                    sock = socket.create_connection(*args, **kwargs)
+                    timings.connect = time.time() - timings.started
+                    return sock
+                conn._create_connection = create_connection
                 conn.connect()
+                if self.scheme == "https" and timings.connect is not None:
+                    timings.tls = time.time() - timings.started - timings.connect
+                sent = time.time()
                 conn.request('POST', self.url, self.body, headers=self.headers)
                 resp = conn.getresponse()
+                timings.response = time.time() - sent
                 if resp.status != 200:
                     if self.listener.on_error(resp.status) is False:
                         break
@@ -164,25 +436,41 @@ class Stream(object):
                     if resp.status == 420:
                         self.retry_time = max(self.retry_420_start, self.retry_time)
                     sleep(self.retry_time)
+                    self._backoff += self.retry_time
                     self.retry_time = min(self.retry_time * 2, self.retry_time_cap)
                 else:
                     error_counter = 0
                     self.retry_time = self.retry_time_start
                     self.snooze_time = self.snooze_time_step
+                    timings.backoff = self._backoff
+                    self._backoff = 0.0
+                    self._timings = timings
+                    if self.stall_timeout:
+                        conn.sock.settimeout(self.stall_timeout)
                     self.listener.on_connect()
-                    self._read_loop(resp)
-            except (timeout, ssl.SSLError) as exc:
-                # If it's not time out treat it like any other exception
-                if isinstance(exc, ssl.SSLError) and not (exc.args and 'timed out' in str(exc.args[0])):
-                    exception = exc
-                    break
-
-                if self.listener.on_timeout() == False:
+                    reading = True
+                    try:
+                        self._read_loop(resp)
+                    finally:
+                        self._disconnected_at = time.time()
+            except (timeout, ssl.SSLError, httplib.IncompleteRead, socket.error) as exc:
+                timed_out = isinstance(exc, timeout) or \
+                    (isinstance(exc, ssl.SSLError) and exc.args and 'timed out' in str(exc.args[0]))
+                if not timed_out:
+                    if not reading:
+                        # If it's not a time out, and the connection wasn't
+                        # dropped while reading (e.g. half way through a
+                        # message), treat it like any other exception
+                        exception = exc
+                        break
+                    logging.warning("Stream connection dropped: %r", exc)
+                elif self.listener.on_timeout() == False:
                     break
                 if self.running is False:
                     break
                 conn.close()
                 sleep(self.snooze_time)
+                self._backoff += self.snooze_time
                 self.snooze_time = min(self.snooze_time + self.snooze_time_step,
                                        self.snooze_time_cap)
             except Exception as exception:
@@ -203,27 +491,73 @@ class Stream(object):
         if self.listener.on_data(data) is False:
             self.running = False
 
-    def _read_loop(self, resp):
-
-        while self.running and not resp.isclosed():
+    def _first_frame(self):
+        # (Called when the first message arrives on a new connection)
+        timings = self._timings
+        self._timings = None
+        now = time.time()
+        timings.first_frame = now - timings.started
+        if self._disconnected_at is not None:
+            timings.gap = now - self._disconnected_at
+        self.listener.on_timings(timings)
+
+    def _data_batch(self, frames):
+        if self.listener.on_batch(frames) is False:
+            self.running = False
 
-            # Note: keep-alive newlines might be inserted before each length value.
-            # read until we get a digit...
-            c = '\n'
-            while c == '\n' and self.running and not resp.isclosed():
-                c = resp.read(1)
-            delimited_string = c
+    def _read_loop(self, resp):
+        encoding = (resp.getheader('content-encoding') or '').strip().lower()
+        if encoding in DECOMPRESS_WBITS:
+            buf = DecompressingReadBuffer(resp, self.buffer_size, DECOMPRESS_WBITS[encoding])
+        else:
+            buf = ReadBuffer(resp, self.buffer_size)
+        self._buf = buf
+        try:
+            self._read_messages(resp, buf)
+        finally:
+            self._buf = None
+            self._bytes_received += buf.bytes_received
+            self._bytes_decompressed += buf.bytes_decompressed
+
+    def _read_messages(self, resp, buf):
+        batch = []
+        batch_start = None
+
+        try:
+            while self.running and not resp.isclosed():
+
+                # Deliver the batch when it is full, has waited long enough, or
+                # before reading something that we might have to wait for.
+                if batch and (len(batch) >= self.batch_size or buf.would_block() or
+                              time.time() - batch_start >= self.batch_interval):
+                    self._data_batch(batch)
+                    batch = []
+                    continue
+
+                # Note: keep-alive newlines might be inserted before each length value.
+                delimited_string = buf.read_line()
+                if delimited_string is None:
+                    break
 
-            # read rest of delimiter length..
-            d = ''
-            while d != '\n' and self.running and not resp.isclosed():
-                d = resp.read(1)
-                delimited_string += d
+                # read the next twitter status object
+                if delimited_string.strip().isdigit():
+                    next_status_obj = buf.read_len(int(delimited_string))
+                    if self._timings is not None:
+                        self._first_frame()
+                    if not self.batch_size:
+                        self._data(next_status_obj)
+                        continue
+                    if not batch:
+                        batch_start = time.time()
+                    batch.append(next_status_obj)
+        except (httplib.IncompleteRead, socket.error):
+            # Deliver the whole messages before the connection is dealt with
+            if batch and self.running:
+                self._data_batch(batch)
+            raise
 
-            # read the next twitter status object
-            if delimited_string.strip().isdigit():
-                next_status_obj = resp.read( int(delimited_string) )
-                self._data(next_status_obj)
+        if batch and self.running:
+            self._data_batch(batch)
 
         if resp.isclosed():
             self.on_closed(resp)
@@ -245,7 +579,8 @@ class Stream(object):
         if self.running:
             raise TweepError('Stream object already connected!')
         self.url = '/%s/user.json?delimited=length' % STREAM_VERSION
-        self.host='userstream.twitter.com'
+        if self.host == Stream.host:  # (unless it was pointed somewhere else)
+            self.host = 'userstream.twitter.com'
         if stall_warnings:
             self.parameters['stall_warnings'] = stall_warnings
         if _with:
@@ -277,13 +612,15 @@ class Stream(object):
         self.url = '/%s/statuses/retweet.json?delimited=length' % STREAM_VERSION
         self._start(async)
 
-    def sample(self, count=None, async=False):
+    def sample(self, count=None, async=False, stall_warnings=False):
         self.parameters = {'delimited': 'length'}
         if self.running:
             raise TweepError('Stream object already connected!')
         self.url = '/%s/statuses/sample.json?delimited=length' % STREAM_VERSION
         if count:
             self.url += '&count=%s' % count
+        if stall_warnings:
+            self.url += '&stall_warnings=true'
         self._start(async)
 
     def filter(self, follow=None, track=None, async=False, locations=None,
@@ -6,12 +6,54 @@ from datetime import datetime
 import time
 import re
 import locale
+import calendar
 from urllib import quote
-from email.utils import parsedate
+from email.utils import parsedate_tz
+
+_MONTHS = dict((m, i + 1) for i, m in enumerate(
+    ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']))
+
+# recently parsed times (a busy stream has lots of tweets from the same second)
+_time_cache = {}
+TIME_CACHE_SIZE = 4096
+
+
+def parse_twitter_time(string):
+    """Parse a time in twitter's format (e.g. 'Wed Aug 27 13:08:45 +0000 2008').
+
+    Returns a tuple of (datetime, epoch) where datetime has the fields as
+    written (like parse_datetime) and epoch is the number of seconds since
+    1970 (UTC) as an int. Recent results are remembered, so parsing the same
+    string again is just a dictionary lookup.
+    """
+    result = _time_cache.get(string)
+    if result is not None:
+        return result
+    try:
+        if len(string) != 30 or string[20:25] != '+0000':
+            raise ValueError
+        fields = (int(string[26:30]), _MONTHS[string[4:7]], int(string[8:10]),
+                  int(string[11:13]), int(string[14:16]), int(string[17:19]))
+        offset = 0
+    except (ValueError, KeyError):
+        # not the usual format, let the email library have a go
+        parsed = parsedate_tz(string)
+        fields = parsed[:6]
+        offset = parsed[9] or 0
+    result = (datetime(*fields), calendar.timegm(fields) - offset)
+    if len(_time_cache) >= TIME_CACHE_SIZE:
+        _time_cache.clear()
+    _time_cache[string] = result
+    return result
 
 
 def parse_datetime(string):
-    return datetime(*(parsedate(string)[:6]))
+    return parse_twitter_time(string)[0]
+
+
+def parse_epoch(string):
+    """The number of seconds since 1970 (UTC) for a time in twitter's format."""
+    return parse_twitter_time(string)[1]
 
 
 def parse_html_value(html):
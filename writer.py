@@ -0,0 +1,142 @@
+# Classes for writing tweets out to disk. The stream listener used to open, append to and close the
+# output file for every single tweet, which is a lot of system calls when listening to the firehose
+# sample. Instead, the writer here keeps the current file open and collects tweets in memory,
+# writing them out in one go when enough data has built up, when enough time has passed, or when
+# the file is rotated / the program shuts down.
+
+import atexit # For stopping the flushing threads of writers that were never closed
+import gzip # For compressing tweets as they are written
+import threading # For flushing the buffer periodically in the background
+import time
+import zlib
+
+DEFAULT_FLUSH_BYTES = 4 * 1024 * 1024 # Write the buffer out once it holds this many bytes
+DEFAULT_FLUSH_INTERVAL = 5.0 # Never keep tweets in memory for longer than this (seconds)
+DEFAULT_COMPRESS_LEVEL = 6 # gzip level used when compressing as tweets are written
+
+_open_writers = set() # Writers that haven't been closed yet (see _close_open_writers)
+
+
+class BufferedTweetWriter(object):
+    """Writes raw tweets to a file that is kept open between writes. Tweets are buffered in memory
+    and written out when the buffer reaches 'flush_bytes', when 'flush_interval' seconds have passed
+    since the last flush, or when the file is closed. This means that at most 'flush_interval'
+    seconds of tweets can be lost if the program dies."""
+
+    def __init__(self, flush_bytes=DEFAULT_FLUSH_BYTES, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+
+        self.filename = None # The file currently being written to
+        self._file = None
+        self._buffer = [] # Store the tweets in a list and join them when writing (more efficient)
+        self._buffered = 0 # Number of bytes in the buffer
+        self._last_flush = time.time()
+        # The buffer is shared with the background flushing thread so needs protecting
+        self._lock = threading.Lock()
+
+        self._closed = threading.Event()
+        self._flusher = None
+        if flush_interval and flush_interval > 0:
+            self._flusher = threading.Thread(target=self._flush_loop, name="tweet-writer-flush")
+            self._flusher.daemon = True # Don't stop the program exiting
+            self._flusher.start()
+        _open_writers.add(self)
+
+    def open(self, filename):
+        """Start writing to a new file, flushing and closing the current one (if there is one)."""
+        with self._lock:
+            self._close_file()
+            self._file = self._open_file(filename)
+            self.filename = filename
+
+    def write(self, data):
+        """Add some data to the buffer, writing it out if the buffer is full or is getting old."""
+        with self._lock:
+            self._buffer.append(data)
+            self._buffered += len(data)
+            if self._buffered >= self.flush_bytes or \
+                    time.time() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def flush(self):
+        """Write out anything that is in the buffer."""
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        """Flush the buffer, close the current file and stop the background thread."""
+        self._closed.set()
+        _open_writers.discard(self)
+        with self._lock:
+            self._close_file()
+        if self._flusher is not None and self._flusher is not threading.current_thread():
+            self._flusher.join()
+
+    def _open_file(self, filename):
+        """Open the file to write to. Don't use python's buffering as well as ours, each flush
+        should be one write."""
+        return open(filename, 'ab', 0)
+
+    def _flush(self):
+        # (The lock must be held when this is called)
+        if self._buffer and self._file is not None:
+            self._file.write(''.join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+        self._last_flush = time.time()
+
+    def _close_file(self):
+        # (The lock must be held when this is called)
+        if self._file is not None:
+            self._flush()
+            self._file.close()
+            self._file = None
+
+    def _flush_loop(self):
+        """Runs in the background, making sure that tweets don't sit in the buffer for too long
+        when the stream is quiet."""
+        while not self._closed.wait(self.flush_interval / 2.0):
+            with self._lock:
+                if time.time() - self._last_flush >= self.flush_interval:
+                    self._flush()
+
+
+class GzipTweetWriter(BufferedTweetWriter):
+    """Like BufferedTweetWriter, but compresses the tweets with gzip as they are written, so the
+    uncompressed data never reaches the disk. Each time the buffer is flushed the compressor is
+    'sync flushed' as well, so everything written so far can be read back even if the program dies
+    before the file is closed. (The gzip trailer is only written when the file is closed, so an
+    unfinished file has to be read as a stream, like json2csv.py does; python's GzipFile refuses to
+    read it, and zcat prints everything but then complains about the unexpected end of the file.)
+    'level' is the gzip compression level (1 is fastest, 9 is smallest)."""
+
+    def __init__(self, level=DEFAULT_COMPRESS_LEVEL, **kwargs):
+        self.level = level
+        super(GzipTweetWriter, self).__init__(**kwargs)
+
+    def _open_file(self, filename):
+        return gzip.GzipFile(filename, 'ab', self.level)
+
+    def _flush(self):
+        # (The lock must be held when this is called)
+        if self._buffer and self._file is not None:
+            self._file.write(''.join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+            self._file.flush(zlib.Z_SYNC_FLUSH) # (Also flushes the underlying file)
+        self._last_flush = time.time()
+
+
+def _close_open_writers():
+    """Close any writers that are still open when the program exits, e.g. because it stopped with an
+    error before getting round to closing them. Otherwise the background flushing threads carry on
+    while python is tearing down its modules and die with confusing errors (and whatever was in the
+    buffer is lost)."""
+    for writer in list(_open_writers):
+        try:
+            writer.close()
+        except Exception as e:
+            print "Could not close {f} on exit: {e}".format(f=writer.filename, e=e)
+
+atexit.register(_close_open_writers)